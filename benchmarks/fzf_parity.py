@@ -0,0 +1,84 @@
+"""
+Compare the rankings of the native matcher with the ones of `fzf --filter` on generated path corpora.
+
+    python -m benchmarks.fzf_parity --entries 20000 --seed 1
+"""
+import argparse
+import random
+import shutil
+import subprocess
+import sys
+from typing import List
+
+from matcher.native import NativeMatcher
+from scan.snapshot import FileSystemSnapshot
+
+WORDS = [
+    "src", "lib", "docs", "test", "tests", "build", "main", "utils", "config", "Projects",
+    "README", "index", "node_modules", "MyClass", "snake_case", "kebab-case", "v2", "2022",
+    "report", "Downloads", "photo", "data", "fzf", "ulauncher", "extension", "__init__",
+    # Word boundaries inside names: whitespace, '-' and '_'
+    "My Documents", "old files", "a-f", "build-output", "make_file", "c_m", "x f",
+]
+EXTENSIONS = ["", ".py", ".md", ".txt", ".json", ".PNG", ".tar.gz", ".c", ".h"]
+QUERIES = [
+    "a", "c", "f", "m", "src", "main", "mc", "MyC", "readme", "test py", "'index", "^/home", "py$", "!test",
+    "conf json", "dl photo", "src | lib", "v2 2022", "node mod", "__in", "ext ul", "^/home/u/src$",
+    "mydoc", "bo", "mf", "'old f",
+]
+
+
+def generate_corpus(entries: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    paths = set()
+    while len(paths) < entries:
+        depth = rng.randint(1, 6)
+        parts = [rng.choice(WORDS) + rng.choice(["", "", str(rng.randint(0, 99))]) for _ in range(depth)]
+        paths.add("/home/u/" + "/".join(parts) + rng.choice(EXTENSIONS))
+    # Sort first, set iteration order depends on the hash seed
+    corpus = sorted(paths)
+    rng.shuffle(corpus)
+    return corpus
+
+
+def run_fzf(candidates: str, query: str) -> List[str]:
+    process = subprocess.run(["fzf", "--filter", query], input=candidates, stdout=subprocess.PIPE, text=True)
+    return process.stdout.splitlines()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=15, help="compare only the first LIMIT results")
+    parser.add_argument("queries", nargs="*", default=QUERIES)
+    args = parser.parse_args()
+
+    if shutil.which("fzf") is None:
+        print("fzf is not installed", file=sys.stderr)
+        return 2
+
+    candidates = "\n".join(generate_corpus(args.entries, args.seed)) + "\n"
+    matcher = NativeMatcher()
+    matcher.load(FileSystemSnapshot(data=candidates.encode(), timestamp=0))
+
+    failures = 0
+    for query in args.queries:
+        expected = run_fzf(candidates, query)[:args.limit]
+        actual = matcher.match(query, args.limit)
+        status = "ok" if expected == actual else "MISMATCH"
+        print(f"{status:8} {query!r}")
+        if expected != actual:
+            failures += 1
+            for i, (exp, act) in enumerate(zip(expected + [""] * args.limit, actual + [""] * args.limit)):
+                if i >= max(len(expected), len(actual)):
+                    break
+                marker = " " if exp == act else "!"
+                print(f"    {marker} {exp:60} | {act}")
+
+    print(f"{len(args.queries) - failures}/{len(args.queries)} queries ranked identically")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
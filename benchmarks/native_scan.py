@@ -0,0 +1,81 @@
+"""
+Scan time of the native scanner against fd on the same synthetic tree, and the differences
+between their listings (fd must be installed for the comparison).
+
+    python -m benchmarks.native_scan --entries 200000 --workers 4,8,16
+"""
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Set
+
+from benchmarks.tree import generate_tree
+from scan.index import ScanRules
+from scan.native import NativeScanner
+from scan.roots import build_fd_cmd
+
+
+def best_time(scan: Callable[[], bytes], runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        scan()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def listing(outs: bytes) -> Set[bytes]:
+    """ Paths of a scan output, fd before version 9 doesn't end directories with "/" """
+    return {line.rstrip(b"/") for line in outs.split(b"\n") if line}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hidden", action="store_true", help="list hidden files")
+    parser.add_argument("--runs", type=int, default=3, help="scans of each scanner, the fastest is kept")
+    parser.add_argument("--workers", default="", help="comma-separated thread counts of the native scanner")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ulauncher-fzf-scan-")
+    try:
+        generate_tree(work_dir, args.entries, args.depth, args.fanout, seed=args.seed)
+        rules = ScanRules(base_dir=work_dir, allow_hidden=args.hidden)
+        workers: List[int] = [int(count) for count in args.workers.split(",") if count] or [0]
+
+        fd_bin = shutil.which("fd") or shutil.which("fdfind")
+        fd_listing = None
+        if fd_bin is not None:
+            cmd = list(build_fd_cmd(fd_bin, rules))
+            fd_listing = listing(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout)
+            fd_time = best_time(lambda: subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout, args.runs)
+            print(f"{'fd':20} {fd_time * 1000:9.1f} ms {len(fd_listing):10,} entries")
+        else:
+            print("fd is not installed, timing the native scanner only", file=sys.stderr)
+
+        status = 0
+        for count in workers:
+            native_listing = listing(NativeScanner(rules, count or None).scan())
+            native_time = best_time(lambda: NativeScanner(rules, count or None).scan(), args.runs)
+            name = f"native ({count or NativeScanner(rules).workers} threads)"
+            speed = f" {fd_time / native_time:6.2f}x fd" if fd_listing is not None else ""
+            print(f"{name:20} {native_time * 1000:9.1f} ms {len(native_listing):10,} entries{speed}")
+            if fd_listing is not None and native_listing != fd_listing:
+                status = 1
+                only_fd, only_native = len(fd_listing - native_listing), len(native_listing - fd_listing)
+                print(f"  only listed by fd: {only_fd}, only listed by the native scanner: {only_native}")
+                for line in sorted(fd_listing ^ native_listing)[:10]:
+                    print(f"    {line.decode(errors='replace')}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
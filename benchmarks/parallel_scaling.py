@@ -0,0 +1,82 @@
+"""
+Query latency of the sharded matcher from 1 to N worker processes, against the single-process
+native matcher, on a generated path corpus. Also checks that every shard count ranks like it.
+
+Queries are timed without the narrowing from the matches of previous runs.
+
+    python -m benchmarks.parallel_scaling --entries 1000000 --max-shards 8
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+from benchmarks.fzf_parity import QUERIES, generate_corpus
+from matcher.base import Matcher
+from matcher.native import NativeMatcher
+from matcher.sharded import ShardedMatcher
+from scan.snapshot import FileSystemSnapshot
+
+
+def time_queries(
+    matcher: Matcher, snapshot: FileSystemSnapshot, queries: List[str], limit: int, repeat: int
+) -> List[float]:
+    """
+    Median latency of each query, in seconds. Each run starts from a new generation of the snapshot,
+    otherwise the previous runs would answer it from the cache of recent matches.
+    """
+    latencies = []
+    for query in queries:
+        runs = []
+        for _ in range(repeat):
+            matcher.load(FileSystemSnapshot(data=snapshot.data, timestamp=snapshot.timestamp))
+            started = time.perf_counter()
+            matcher.match(query, limit)
+            runs.append(time.perf_counter() - started)
+        latencies.append(sorted(runs)[len(runs) // 2])
+    return latencies
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=500000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--limit", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each query, the median is kept")
+    parser.add_argument("queries", nargs="*", default=QUERIES)
+    args = parser.parse_args()
+
+    snapshot = FileSystemSnapshot(data=("\n".join(generate_corpus(args.entries, args.seed)) + "\n").encode())
+    print(f"{args.entries:,} entries, {len(snapshot.data) / 2**20:.1f} MiB, {os.cpu_count()} CPUs")
+    print(f"{'shards':>8} {'load':>10} {'latency':>19} {'speedup':>7}")
+
+    native = NativeMatcher()
+    native.load(snapshot)
+    expected = {query: native.match(query, args.limit) for query in args.queries}
+    baseline = sum(time_queries(native, snapshot, args.queries, args.limit, args.repeat))
+    print(f"{'native':>8} {'':>10} {baseline * 1000 / len(args.queries):10.1f} ms/query {'1.00':>6}x")
+
+    status = 0
+    # Powers of two, then the maximum
+    for shards in sorted({2**i for i in range(args.max_shards.bit_length())} | {args.max_shards}):
+        sharded = ShardedMatcher(shards)
+        try:
+            started = time.perf_counter()
+            sharded.load(snapshot)
+            load = time.perf_counter() - started
+            mismatches = [query for query in args.queries if sharded.match(query, args.limit) != expected[query]]
+            total = sum(time_queries(sharded, snapshot, args.queries, args.limit, args.repeat))
+        finally:
+            sharded.close()
+        print(
+            f"{shards:>8} {load * 1000:7.0f} ms {total * 1000 / len(args.queries):10.1f} ms/query "
+            f"{baseline / total:6.2f}x" + (f"  DIFFERENT RANKING: {mismatches}" if mismatches else "")
+        )
+        status = status or (1 if mismatches else 0)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
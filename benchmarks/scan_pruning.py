@@ -0,0 +1,94 @@
+"""
+Time and memory saved by the scan limits: a synthetic tree with a few huge dependency directories
+is scanned with fd without limits, then with the given ones (fd must be installed).
+
+    python -m benchmarks.scan_pruning --entries 100000 --exclude node_modules --max-children 1000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os import path
+from typing import List, Optional, Tuple
+
+from benchmarks.tree import generate_tree
+from scan.index import IncrementalIndex, ScanRules
+from scan.prune import PruneStats
+from scan.roots import build_fd_cmd
+
+
+def add_crowded_dirs(root: str, count: int, children: int) -> None:
+    """ Flat directories with many files, like node_modules or a cache """
+    for i in range(count):
+        crowded = path.join(root, f"project{i}", "node_modules")
+        os.makedirs(crowded)
+        for j in range(children):
+            open(path.join(crowded, f"module{j}.js"), "w").close()
+
+
+def scan(fd_bin: str, rules: ScanRules, runs: int) -> Tuple[float, int, int, Optional[PruneStats]]:
+    """ Best scan time, entries, snapshot bytes (with offsets) and prune stats of the last run """
+    durations = []
+    for _ in range(runs):
+        index = IncrementalIndex()
+        index.set_command(list(build_fd_cmd(fd_bin, rules)), rules)
+        started = time.perf_counter()
+        snapshot = index.refresh(scan_period=0, timeout=None, background=False)
+        durations.append(time.perf_counter() - started)
+    size = len(snapshot.data) + snapshot.offsets.itemsize * len(snapshot)
+    return min(durations), len(snapshot), size, index.prune_stats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--crowded-dirs", type=int, default=3)
+    parser.add_argument("--crowded-children", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3, help="scans of each configuration, the fastest is kept")
+    parser.add_argument("--max-depth", type=int)
+    parser.add_argument("--exclude", action="append", default=[], help="glob pattern, can be repeated")
+    parser.add_argument("--max-entries", type=int)
+    parser.add_argument("--max-children", type=int)
+    args = parser.parse_args()
+
+    fd_bin = shutil.which("fd") or shutil.which("fdfind")
+    if fd_bin is None:
+        print("fd is not installed", file=sys.stderr)
+        return 2
+
+    work_dir = tempfile.mkdtemp(prefix="ulauncher-fzf-prune-")
+    try:
+        generate_tree(work_dir, args.entries, seed=args.seed)
+        add_crowded_dirs(work_dir, args.crowded_dirs, args.crowded_children)
+        unlimited = ScanRules(base_dir=work_dir, allow_hidden=True)
+        limited = ScanRules(
+            base_dir=work_dir,
+            allow_hidden=True,
+            max_depth=args.max_depth,
+            excludes=tuple(args.exclude),
+            max_entries=args.max_entries,
+            max_children=args.max_children,
+        )
+        results: List[Tuple[str, float, int, int]] = []
+        for name, rules in [("unlimited", unlimited), ("limited", limited)]:
+            duration, entries, size, stats = scan(fd_bin, rules, args.runs)
+            results.append((name, duration, entries, size))
+            print(f"{name:10} {duration * 1000:9.1f} ms {entries:10,} entries {size / 2**20:8.2f} MiB")
+            if stats is not None and rules is limited:
+                print(f"{'':10} {stats}")
+
+        (_, full_time, full_entries, full_size), (_, time_, entries, size) = results
+        print(
+            f"{'saved':10} {(full_time - time_) * 1000:9.1f} ms {full_entries - entries:10,} entries "
+            f"{(full_size - size) / 2**20:8.2f} MiB"
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+End-to-end search benchmark on a synthetic tree, driving FuzzyFinderExtension.search and
+KeywordQueryEventListener.on_event with fake preferences and query events, without a running
+Ulauncher (the ulauncher package must be importable, fd installed, fzf unless --matcher native).
+
+    python -m benchmarks.search_latency --entries 100000 --save-baseline baseline.json
+    python -m benchmarks.search_latency --entries 100000 --compare baseline.json
+
+Reports the cold scan (first query) time, warm query latency percentiles, peak RSS and
+snapshot size. With --compare, exits with status 1 when a metric regressed more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from os import path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from benchmarks.tree import generate_tree
+from stats.latency import LatencyStats
+
+MANIFEST = path.join(path.dirname(path.dirname(path.abspath(__file__))), "manifest.json")
+# Metrics where lower is better, compared against the baseline, and the noise below which they are ignored
+METRICS = {
+    "cold_query_ms": 5.0,
+    "scan_ms": 5.0,
+    "warm_p50_ms": 1.0,
+    "warm_p95_ms": 2.0,
+    "warm_p99_ms": 2.0,
+    "peak_rss_mib": 2.0,
+    "snapshot_mib": 0.5,
+}
+
+
+class FakeQueryEvent:
+    """ The part of KeywordQueryEvent used by the extension """
+
+    def __init__(self, keyword: str, argument: str):
+        self._keyword = keyword
+        self._argument = argument
+
+    def get_keyword(self) -> str:
+        return self._keyword
+
+    def get_argument(self) -> str:
+        return self._argument
+
+
+def default_preferences() -> Dict[str, Any]:
+    with open(MANIFEST) as file:
+        manifest = json.load(file)
+    return {pref["id"]: pref.get("default_value") for pref in manifest["preferences"]}
+
+
+def create_extension(preferences: Dict[str, Any]) -> Any:
+    """ Build the extension and feed it the preferences the way Ulauncher does on startup """
+    from main import FuzzyFinderExtension
+    from preferences.listeners import PreferencesInitEventListener
+
+    extension = FuzzyFinderExtension()
+    PreferencesInitEventListener().on_event(SimpleNamespace(preferences=preferences), extension)
+    if extension.prefs_have_errors:
+        errors = [p.formatted_error_msg() for p in extension.prefs.values() if p.error is not None]
+        raise RuntimeError("Invalid preferences: " + ", ".join(errors))
+    return extension
+
+
+def typing_sequences(files: List[str], root: str, count: int, seed: int) -> List[List[str]]:
+    """
+    Queries typed one character at a time, as a user looking for a file would:
+    a few characters of one of its directories, a space, then the beginning of its name
+    """
+    rng = random.Random(seed)
+    sequences = []
+    for file_name in rng.sample(files, min(count, len(files))):
+        parts = path.relpath(file_name, root).split(os.sep)
+        target = parts[-1].lstrip(".")[:5]
+        if len(parts) > 1:
+            target = parts[rng.randrange(len(parts) - 1)].lstrip(".")[:3] + " " + target
+        sequences.append([target[:i] for i in range(1, len(target) + 1) if not target[:i].endswith(" ")])
+    return sequences
+
+
+def percentile(ordered: List[float], percent: float) -> float:
+    """ Nearest-rank percentile of a sorted list """
+    return ordered[max(0, int(-(-len(ordered) * percent // 100)) - 1)]
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    work_dir = tempfile.mkdtemp(prefix="ulauncher-fzf-bench-")
+    # Keep the caches and the usage log of the extension away from the user ones
+    os.environ["XDG_CACHE_HOME"] = path.join(work_dir, "cache")
+    os.environ["XDG_DATA_HOME"] = path.join(work_dir, "data")
+    try:
+        root = path.join(work_dir, "tree")
+        os.mkdir(root)
+        started = time.perf_counter()
+        files = generate_tree(root, args.entries, args.depth, args.fanout, args.hidden_ratio, args.skew, args.seed)
+        print(f"Generated {len(files):,} files in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+        preferences = default_preferences()
+        preferences.update(
+            base_dir=root,
+            matcher="1" if args.matcher == "native" else "0",
+            allow_hidden="1",
+            scan_period=str(10**6),
+            scan_timeout="600",
+            watch_filesystem="0",
+            cache_snapshot="0",
+            frecency="0",
+            debug_timings="0",
+        )
+        extension = create_extension(preferences)
+        from main import KeywordQueryEventListener
+
+        listener = KeywordQueryEventListener()
+        keyword = extension.prefs["fzf_kw"].value
+        sequences = typing_sequences(files, root, args.sequences, args.seed)
+
+        # Cold: the first query waits for the whole scan
+        started = time.perf_counter()
+        listener.on_event(FakeQueryEvent(keyword, sequences[0][0]), extension)
+        cold_query = time.perf_counter() - started
+        snapshot = extension.refresher.refresh()
+        extension.latency = LatencyStats()
+
+        latencies = []
+        for sequence in sequences:
+            for query in sequence:
+                started = time.perf_counter()
+                listener.on_event(FakeQueryEvent(keyword, query), extension)
+                latencies.append(time.perf_counter() - started)
+        latencies.sort()
+
+        self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        return {
+            "config": {
+                "entries": args.entries,
+                "depth": args.depth,
+                "fanout": args.fanout,
+                "hidden_ratio": args.hidden_ratio,
+                "skew": args.skew,
+                "seed": args.seed,
+                "matcher": args.matcher,
+                "sequences": args.sequences,
+            },
+            "metrics": {
+                "snapshot_entries": len(snapshot),
+                "queries": len(latencies),
+                "cold_query_ms": cold_query * 1000,
+                "scan_ms": (extension.refresher.scan_duration or 0.0) * 1000,
+                "warm_p50_ms": percentile(latencies, 50) * 1000,
+                "warm_p95_ms": percentile(latencies, 95) * 1000,
+                "warm_p99_ms": percentile(latencies, 99) * 1000,
+                "peak_rss_mib": self_rss,
+                "peak_children_rss_mib": children_rss,
+                "snapshot_mib": (len(snapshot.data) + snapshot.offsets.itemsize * len(snapshot)) / 2**20,
+            },
+            "stages": extension.latency.summary(),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """ Print both runs side by side, return whether any metric regressed """
+    if result["config"] != baseline["config"]:
+        print(f"WARNING: baseline configuration differs: {baseline['config']}")
+    regressed = False
+    for name, noise in METRICS.items():
+        current, previous = result["metrics"][name], baseline["metrics"].get(name)
+        if previous is None:
+            continue
+        worse = current > previous * (1 + tolerance) and current - previous > noise
+        regressed = regressed or worse
+        change = (current - previous) / previous * 100 if previous else 0.0
+        print(f"{'REGRESSED' if worse else 'ok':10} {name:16} {previous:10.2f} -> {current:10.2f} ({change:+.1f}%)")
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--hidden-ratio", type=float, default=0.05)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--matcher", choices=["fzf", "native"], default="fzf")
+    parser.add_argument("--sequences", type=int, default=20, help="number of typed queries")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown (default 0.2)")
+    args = parser.parse_args()
+
+    result = run(args)
+    for name, value in result["metrics"].items():
+        print(f"{name:22} {value:10.2f}" if isinstance(value, float) else f"{name:22} {value:10}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(result, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
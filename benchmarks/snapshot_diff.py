@@ -0,0 +1,121 @@
+"""
+Cost of a rescan with generational snapshots: a synthetic tree is scanned by the native scanner,
+rescanned without changes, then rescanned after creating and deleting some files. Each rescan
+reports its diff, whether the snapshot was kept or patched, and the time a matcher takes to load
+it and to run the last query again, compared with a matcher starting over on the same snapshot.
+
+    python -m benchmarks.snapshot_diff --entries 200000 --changes 1000 --memory
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import path
+from typing import List, Tuple
+
+from benchmarks.tree import generate_tree
+from matcher.native import NativeMatcher
+from scan.diff import DIFF_MEMORY_BUDGET, StreamingDiff, diff_snapshot
+from scan.index import IncrementalIndex, ScanRules
+from scan.native import NATIVE_SCANNER
+from scan.roots import build_fd_cmd
+from scan.snapshot import FileSystemSnapshot
+
+# Typed one character at a time before the rescans
+QUERIES = ["f", "fi", "fil", "file", "file1"]
+
+
+def timed_query(matcher: NativeMatcher, snapshot: FileSystemSnapshot) -> Tuple[float, float]:
+    """ Seconds to load 'snapshot' and to run the last query """
+    started = time.perf_counter()
+    matcher.load(snapshot)
+    loaded = time.perf_counter()
+    matcher.match(QUERIES[-1], 10)
+    return loaded - started, time.perf_counter() - loaded
+
+
+def change_tree(snapshot: FileSystemSnapshot, changes: int) -> None:
+    """ Delete 'changes' files of the snapshot and create as many new ones """
+    files = [entry for entry in snapshot.entries() if not entry.endswith("/")]
+    for i, file_name in enumerate(files[:: max(1, len(files) // changes)][:changes]):
+        os.remove(file_name)
+        open(path.join(path.dirname(file_name), f"added_file{i}.txt"), "w").close()
+
+
+def rescan(name: str, index: IncrementalIndex, matcher: NativeMatcher) -> None:
+    previous = index.snapshot
+    started = time.perf_counter()
+    snapshot = index.refresh(scan_period=0, timeout=None, background=False)
+    scan_time = time.perf_counter() - started
+    kept = "kept" if snapshot is previous else "patched" if snapshot.diff is not None else "replaced"
+    diff = index.last_diff if index.last_diff is not None else "not computed"
+    print(f"{name}: scan {scan_time * 1000:.1f} ms, diff {diff}, snapshot {kept}")
+    for label, used in [("warm matcher", matcher), ("new matcher", NativeMatcher())]:
+        load_time, query_time = timed_query(used, snapshot)
+        print(f"  {label:13} load {load_time * 1000:8.1f} ms, query {query_time * 1000:8.1f} ms")
+
+
+def diff_memory(snapshot: FileSystemSnapshot, budgets: List[int]) -> None:
+    """ Peak memory of diffing the snapshot against a reordered copy of itself, as fd outputs are """
+    lines = snapshot.data.split(b"\n")[:-1]
+    reordered = b"\n".join(lines[1::2] + lines[::2]) + b"\n"
+    del lines
+    for budget in budgets:
+        tracemalloc.start()
+        diff_snapshot(snapshot, reordered, memory_budget=budget)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"diff of {len(snapshot):,} reordered entries, budget {budget / 2**20:.0f} MiB: "
+              f"peak {peak / 2**20:.1f} MiB")
+
+    # Streamed as a scan would be, the output is never held in full
+    chunks = [reordered[start:start + 2**20] for start in range(0, len(reordered), 2**20)]
+    del reordered
+    tracemalloc.start()
+    stream = StreamingDiff(snapshot)
+    for chunk in chunks:
+        stream.write(chunk)
+    stream.finish(time.time())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"streamed diff of {len(snapshot):,} reordered entries: peak {peak / 2**20:.1f} MiB")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--changes", type=int, default=100, help="files deleted and created before the last rescan")
+    parser.add_argument("--memory", action="store_true", help="also trace the peak memory of diffs (slow)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ulauncher-fzf-diff-")
+    try:
+        generate_tree(work_dir, args.entries, args.depth, args.fanout, seed=args.seed)
+        rules = ScanRules(base_dir=work_dir)
+        index = IncrementalIndex()
+        index.set_command(list(build_fd_cmd(NATIVE_SCANNER, rules)), rules)
+        snapshot = index.refresh(scan_period=0, timeout=None, background=False)
+        print(f"{len(snapshot):,} entries, {len(snapshot.data) / 2**20:.1f} MiB")
+        matcher = NativeMatcher()
+        matcher.load(snapshot)
+        for query in QUERIES:
+            matcher.match(query, 10)
+
+        rescan("rescan without changes", index, matcher)
+        change_tree(index.snapshot, args.changes)
+        rescan(f"rescan after {args.changes} deletions and creations", index, matcher)
+        if args.memory:
+            diff_memory(index.snapshot, [DIFF_MEMORY_BUDGET // 4, DIFF_MEMORY_BUDGET, DIFF_MEMORY_BUDGET * 4])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Memory footprint of a snapshot, as the single decoded string used before and as the raw bytes
+plus offsets array of FileSystemSnapshot.
+
+    python -m benchmarks.snapshot_memory --sizes 100000,1000000,5000000
+"""
+import argparse
+import sys
+import tracemalloc
+from os import path
+from typing import Callable, List, Tuple
+
+from benchmarks.fzf_parity import generate_corpus
+from scan.snapshot import FileSystemSnapshot
+
+BASE_DIR = "/home/u"
+
+
+def measure(build: Callable[[], object]) -> Tuple[int, int]:
+    """ Return (retained, peak) bytes allocated while building an object """
+    tracemalloc.start()
+    obj = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return retained, peak
+
+
+def front_coded_size(paths: List[str]) -> int:
+    """ Size if every path only stored what differs from the previous one (plus 2 bytes of prefix length) """
+    size, previous = 0, ""
+    for entry in sorted(paths):
+        shared = len(path.commonprefix([previous, entry]))
+        size += len(entry.encode()) - shared + 2
+        previous = entry
+    return size
+
+
+def report(entries: int) -> None:
+    paths = generate_corpus(entries, seed=0)
+    data = ("\n".join(paths) + "\n").encode()
+    non_bmp = data + "/home/u/emoji\U0001F600\n".encode()
+    del paths
+
+    def as_str() -> object:
+        return data.decode()
+
+    def as_str_non_bmp() -> object:
+        return non_bmp.decode()
+
+    def offsets() -> object:
+        return FileSystemSnapshot(data=data, timestamp=0).offsets
+
+    # The snapshot keeps the scanner output as is, only the offsets are allocated on top of it
+    offsets_retained, offsets_peak = measure(offsets)
+    rows = [
+        ("str (before)", *measure(as_str)),
+        ("str, one non-BMP path (before)", *measure(as_str_non_bmp)),
+        ("bytes + offsets", len(data) + offsets_retained, len(data) + offsets_peak),
+    ]
+    print(f"{entries:,} entries, {len(data) / 2**20:.1f} MiB of scanner output")
+    for name, retained, peak in rows:
+        print(f"    {name:32} retained {retained / 2**20:8.1f} MiB    peak {peak / 2**20:8.1f} MiB")
+
+    # Layouts not adopted (the matchers need contiguous full paths), reported for reference
+    relative = len(data) - entries * (len(BASE_DIR) + 1)
+    print(f"    {'paths relative to base_dir':32} retained {relative / 2**20:8.1f} MiB (estimate)")
+    lines = data.decode().splitlines()
+    print(f"    {'front coded paths':32} retained {front_coded_size(lines) / 2**20:8.1f} MiB (estimate)")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000,5000000", help="comma separated entry counts")
+    args = parser.parse_args()
+    for entries in args.sizes.split(","):
+        report(int(entries))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
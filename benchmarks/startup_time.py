@@ -0,0 +1,108 @@
+"""
+Startup cost of the extension: import time of main.py (from `python -X importtime`, in fresh
+interpreters) and time from the preferences event to the first query's results on a synthetic tree,
+without a running Ulauncher (the ulauncher package must be importable and fd installed).
+
+    python -m benchmarks.startup_time --entries 100000 --max-import-ms 150
+
+Exits with status 1 when the median import time is above --max-import-ms.
+"""
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+from typing import Dict, List, Tuple
+
+from benchmarks.search_latency import FakeQueryEvent, create_extension, default_preferences
+from benchmarks.tree import generate_tree
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+# import time: self [us] | cumulative | imported package
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> Tuple[int, Dict[str, int]]:
+    """ Cumulative import time of 'module' and self time of every module it imported, in microseconds """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, encoding="utf-8", check=True,
+    )
+    total, self_times = 0, {}
+    for line in process.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        self_time, cumulative, indent, name = match.groups()
+        self_times[name] = int(self_time)
+        if name == module and not indent:
+            total = int(cumulative)
+    return total, self_times
+
+
+def first_query(entries: int, delay: float, seed: int) -> Tuple[float, float, int]:
+    """
+    Seconds spent handling the preferences event, then answering a query sent 'delay' seconds later,
+    and the number of results of that query
+    """
+    work_dir = tempfile.mkdtemp(prefix="ulauncher-fzf-startup-")
+    os.environ["XDG_CACHE_HOME"] = path.join(work_dir, "cache")
+    os.environ["XDG_DATA_HOME"] = path.join(work_dir, "data")
+    try:
+        root = path.join(work_dir, "tree")
+        os.mkdir(root)
+        generate_tree(root, entries, seed=seed)
+        preferences = default_preferences()
+        preferences.update(base_dir=root, allow_hidden="1", cache_snapshot="0", debug_timings="0")
+
+        from main import KeywordQueryEventListener
+
+        started = time.perf_counter()
+        extension = create_extension(preferences)
+        prefs_time = time.perf_counter() - started
+
+        # The user opens the launcher and types a first character
+        time.sleep(delay)
+        started = time.perf_counter()
+        event = FakeQueryEvent(extension.prefs["fzf_kw"].value, "a")
+        action = KeywordQueryEventListener().on_event(event, extension)
+        query_time = time.perf_counter() - started
+        return prefs_time, query_time, len(action.result_list) if action is not None else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds between preferences and first query")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters timing the import")
+    parser.add_argument("--top", type=int, default=15, help="slowest imported modules to list")
+    parser.add_argument("--max-import-ms", type=float, help="fail when the median import time is above it")
+    args = parser.parse_args()
+
+    runs: List[Tuple[int, Dict[str, int]]] = [import_times("main") for _ in range(args.runs)]
+    median = statistics.median(total for total, _ in runs) / 1000
+    print(f"Import of main.py: {median:.1f} ms (median of {args.runs})")
+    slowest = sorted(runs[-1][1].items(), key=lambda item: item[1], reverse=True)[: args.top]
+    for name, self_time in slowest:
+        print(f"  {self_time / 1000:8.1f} ms  {name}")
+
+    prefs_time, query_time, results = first_query(args.entries, args.delay, args.seed)
+    print(f"Preferences event: {prefs_time * 1000:.1f} ms")
+    print(f"First query, {args.delay} s later: {query_time * 1000:.1f} ms ({results} results)")
+
+    if args.max_import_ms is not None and median > args.max_import_ms:
+        print(f"Import time above the {args.max_import_ms} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
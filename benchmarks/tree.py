@@ -0,0 +1,94 @@
+"""
+Synthetic directory trees, reproducible for a given seed.
+
+    python -m benchmarks.tree /tmp/tree --entries 100000 --depth 8 --fanout 12
+"""
+import argparse
+import os
+import random
+import sys
+from os import path
+from typing import Dict, List
+
+from benchmarks.fzf_parity import EXTENSIONS, WORDS
+
+
+def _name(rng: random.Random, weights: List[float]) -> str:
+    return rng.choices(WORDS, weights)[0] + rng.choice(["", "", f"_{rng.randint(0, 999)}"])
+
+
+def generate_tree(
+    root: str,
+    entries: int,
+    max_depth: int = 6,
+    fanout: int = 10,
+    hidden_ratio: float = 0.05,
+    skew: float = 1.0,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Create about 'entries' empty files and directories under 'root', which should be empty.
+    :param max_depth: maximum nesting of the files below 'root'
+    :param fanout: maximum number of subdirectories of a directory
+    :param hidden_ratio: share of the names starting with a dot
+    :param skew: Zipf exponent of the name distribution, 0 gives uniformly distributed names
+    :return: the paths of the created files
+    """
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) ** skew for i in range(len(WORDS))]
+    subdirs: Dict[str, List[str]] = {root: []}
+    files: List[str] = []
+    created = 0
+
+    def hide(name: str) -> str:
+        return "." + name if rng.random() < hidden_ratio else name
+
+    while created < entries:
+        parent = root
+        for _ in range(rng.randint(0, max_depth - 1)):
+            children = subdirs[parent]
+            if len(children) < fanout and (not children or rng.random() < 0.3):
+                child = path.join(parent, hide(_name(rng, weights)))
+                if child not in subdirs:
+                    if path.exists(child):
+                        # A file already has this name
+                        break
+                    os.mkdir(child)
+                    subdirs[child] = []
+                    children.append(child)
+                    created += 1
+                parent = child
+            else:
+                parent = rng.choice(children)
+
+        file_name = path.join(parent, hide(_name(rng, weights) + rng.choice(EXTENSIONS)))
+        if path.exists(file_name):
+            continue
+        open(file_name, "w").close()
+        files.append(file_name)
+        created += 1
+    return files
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="empty (or missing) directory to fill")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--hidden-ratio", type=float, default=0.05)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.root, exist_ok=True)
+    if os.listdir(args.root):
+        print(f"'{args.root}' is not empty", file=sys.stderr)
+        return 2
+    files = generate_tree(args.root, args.entries, args.depth, args.fanout, args.hidden_ratio, args.skew, args.seed)
+    print(f"{len(files):,} files created under {args.root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
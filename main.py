@@ -1,28 +1,45 @@
 import logging
+import os
 import shutil
 import subprocess
+import threading
 import time
 from enum import Enum
-from os import path, linesep
-from typing import Dict, List, Optional, Tuple
+from os import path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
 from ulauncher.api.client.EventListener import EventListener
 from ulauncher.api.client.Extension import Extension
 from ulauncher.api.shared.action.BaseAction import BaseAction
-from ulauncher.api.shared.action.CopyToClipboardAction import CopyToClipboardAction
-from ulauncher.api.shared.action.DoNothingAction import DoNothingAction
+from ulauncher.api.shared.action.ExtensionCustomAction import ExtensionCustomAction
 from ulauncher.api.shared.action.OpenAction import OpenAction
 from ulauncher.api.shared.action.RenderResultListAction import RenderResultListAction
-from ulauncher.api.shared.action.RunScriptAction import RunScriptAction
-from ulauncher.api.shared.event import KeywordQueryEvent, PreferencesEvent, PreferencesUpdateEvent
+from ulauncher.api.shared.event import ItemEnterEvent, KeywordQueryEvent, PreferencesEvent, PreferencesUpdateEvent
 from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
 from ulauncher.api.shared.item.ExtensionSmallResultItem import ExtensionSmallResultItem
 
+from matcher.base import MatchCancelledError, Matcher
+from matcher.fzf import FzfMatcher
+from matcher.native import NativeMatcher
+from matcher.scheduler import QueryScheduler
 from preferences.preferences import Preference, KeywordPreference
+from scan.cache import default_cache_dir
+from scan.filetype import FileTypeCache
+from scan.index import ScanRules
+from scan.refresher import ScanPendingError
+from scan.roots import MultiRootIndex, ScanRoot, build_fd_cmd, load_roots
+from scan.snapshot import FileSystemSnapshot
+from stats.latency import LatencyStats, QueryTimer, format_timer
+from usage.store import RERANK_POOL_FACTOR, UsageStore
+
+if TYPE_CHECKING:
+    from matcher.content import ContentMatch, ContentSearch
 
 logger = logging.getLogger(__name__)
 
+LATENCY_FILE = path.join(default_cache_dir(), "latency.json")
+
 
 class Actions(Enum):
     OPEN_PATH = 0
@@ -35,10 +52,14 @@ class SearchType(Enum):
     DIRS = 2
 
 
-@dataclass
-class FileSystemSnapshot:
-    snapshot: str = ""
-    timestamp: int = -1
+class MatcherType(Enum):
+    FZF = 0
+    NATIVE = 1
+
+
+class ScannerType(Enum):
+    FD = 0
+    NATIVE = 1
 
 
 @dataclass
@@ -47,6 +68,8 @@ class BinData:
     fd_cmd: List[str] = None
     fzf_error: Optional[str] = None
     fd_error: Optional[str] = None
+    # Shown without blocking the searches
+    fzf_warning: Optional[str] = None
 
 
 BinNames = Dict[str, str]
@@ -54,11 +77,40 @@ ExtensionPreferences = Dict[str, str]
 FuzzyFinderPreferences = Dict[str, Preference]
 
 
+# (name, PATH) -> path of the binary
+_found_binaries: Dict[Tuple[str, Optional[str]], str] = {}
+
+
+def _which(name: str, search_path: Optional[str]) -> Optional[str]:
+    found = _found_binaries.get((name, search_path))
+    if found is None:
+        # Misses aren't cached, the binary may be installed later
+        found = shutil.which(name, path=search_path)
+        if found is not None:
+            _found_binaries[name, search_path] = found
+    return found
+
+
+def find_binary(*names: str) -> Optional[str]:
+    """ The first of 'names' found in PATH, found binaries are cached until PATH changes """
+    search_path = os.environ.get("PATH")
+    return next((name for name in names if _which(name, search_path) is not None), None)
+
+
 class FuzzyFinderExtension(Extension):
     def __init__(self) -> None:
         super().__init__()
-        self.fss = FileSystemSnapshot()
+        self.refresher = MultiRootIndex()
         self.bins = BinData()
+        self.matcher: Optional[Matcher] = None
+        # Created on first use: the sharded matcher for large snapshots, the content search backend
+        self.sharded_matcher: Optional[Matcher] = None
+        self._matcher_lock = threading.Lock()
+        self.usage = UsageStore()
+        self.latency = LatencyStats()
+        self.scheduler = QueryScheduler()
+        self.file_types = FileTypeCache()
+        self.content_search: Optional["ContentSearch"] = None
 
         from preferences.listeners import PreferencesInitEventListener, PreferencesUpdateEventListener
         self.prefs_have_errors: bool = False
@@ -68,94 +120,201 @@ class FuzzyFinderExtension(Extension):
         self.subscribe(PreferencesEvent, PreferencesInitEventListener())
         self.subscribe(PreferencesUpdateEvent, PreferencesUpdateEventListener())
         self.subscribe(KeywordQueryEvent, KeywordQueryEventListener())
+        self.subscribe(ItemEnterEvent, ItemEnterEventListener())
 
     def generate_fd_cmd(self):
-        fd_bin = "fd" if shutil.which("fd") else "fdfind" if shutil.which("fdfind") else None
-        if fd_bin is None:
-            msg = "Missing dependency fd. Please install fd."
-            logger.error(msg)
-            self.bins.fd_error = msg
-            return
-
         preferences = self.prefs
-        cmd = [fd_bin, ".", preferences["base_dir"].value]
-        if preferences["search_type"].value == SearchType.FILES:
-            cmd.extend(["--type", "f"])
-        elif preferences["search_type"].value == SearchType.DIRS:
-            cmd.extend(["--type", "d"])
-
-        if preferences["allow_hidden"].value:
-            cmd.extend(["--hidden"])
-
-        if preferences["follow_symlinks"].value:
-            cmd.extend(["--follow"])
+        # Native scans are described by the fd command they replace, with a placeholder binary
+        fd_bin = find_binary("fd", "fdfind") if preferences["scanner"].value == ScannerType.FD else None
+        if fd_bin is None:
+            # Imported here since it's only needed without fd
+            from scan.native import NATIVE_SCANNER
+
+            if preferences["scanner"].value == ScannerType.FD:
+                logger.warning("fd not found, falling back to the native scanner")
+            fd_bin = NATIVE_SCANNER
+
+        rules = ScanRules(
+            base_dir=preferences["base_dir"].value,
+            files=preferences["search_type"].value != SearchType.DIRS,
+            dirs=preferences["search_type"].value != SearchType.FILES,
+            allow_hidden=preferences["allow_hidden"].value,
+            follow_symlinks=preferences["follow_symlinks"].value,
+            ignore_file=preferences["ignore_file"].value if preferences["ignore_file"].error is None else None,
+            max_depth=preferences["max_depth"].value or None,
+            excludes=preferences["excludes"].value or (),
+            max_entries=preferences["max_entries"].value or None,
+            max_children=preferences["max_children"].value or None,
+        )
+        default_root = ScanRoot(
+            rules=rules,
+            cmd=build_fd_cmd(fd_bin, rules),
+            scan_period=preferences["scan_period"].value,
+            scan_timeout=preferences["scan_timeout"].value,
+        )
+
+        # A roots file replaces 'base_dir', the preferences are the defaults of its roots
+        roots = [default_root]
+        if preferences["roots_file"].error is None:
+            try:
+                roots = load_roots(preferences["roots_file"].value, fd_bin, default_root)
+            except ValueError as error:
+                logger.error("Ignoring roots file: %s", error)
+                preferences["roots_file"].error = str(error)
+
+        for root in roots:
+            logger.debug("Using fd command: %s", list(root.cmd))
+        self.bins.fd_cmd = list(roots[0].cmd)
+        self.refresher.set_roots(
+            roots, watch=preferences["watch_filesystem"].value, cache=preferences["cache_snapshot"].value
+        )
+        self.bins.fd_error = None
 
-        if preferences["ignore_file"].error is None:
-            cmd.extend(["--ignore-file", preferences["ignore_file"].value])
+    def _set_matcher(self, matcher: Matcher) -> None:
+        if self.matcher is not None:
+            self.matcher.close()
+        if self.sharded_matcher is not None:
+            self.sharded_matcher.close()
+            self.sharded_matcher = None
+        self.matcher = matcher
+
+    def _matcher_for(self, fss: FileSystemSnapshot) -> Matcher:
+        """ Snapshots with more entries than 'parallel_threshold' are natively matched on every core """
+        threshold = self.prefs["parallel_threshold"].value
+        if not isinstance(self.matcher, NativeMatcher) or not threshold or (os.cpu_count() or 1) < 2:
+            return self.matcher
+        if len(fss) < threshold:
+            return self.matcher
+        with self._matcher_lock:
+            if self.sharded_matcher is None:
+                # Imported here since it's only needed by large snapshots
+                from matcher.sharded import ShardedMatcher
+
+                logger.debug("Matching %d entries in parallel", len(fss))
+                self.sharded_matcher = ShardedMatcher()
+            return self.sharded_matcher
+
+    def warm_up(self) -> None:
+        """ Start the first scan and load its snapshot in the matcher before a query needs them """
+        if self.prefs_have_errors or self.bins.fd_error is not None:
+            return
+        threading.Thread(target=self._warm_up, name="warm-up", daemon=True).start()
 
-        logger.debug("Using fd command: %s", cmd)
-        self.bins.fd_cmd = cmd
-        self.bins.fd_error = None
+    def _warm_up(self) -> None:
+        start = time.perf_counter()
+        try:
+            # Never waits longer than the scan timeout, the scan itself keeps running in background
+            fss = self.refresher.refresh(background=True)
+            self._matcher_for(fss).load(fss)
+        except (ScanPendingError, OSError, subprocess.SubprocessError) as error:
+            logger.info("Warm-up interrupted: %s", error)
+            return
+        logger.debug("Warm-up completed in %.3f s", time.perf_counter() - start)
 
     def generate_fzf_cmd(self):
-        if shutil.which("fzf") is None:
-            msg = "Missing dependency fzf. Please install fzf."
-            logger.error(msg)
-            self.bins.fzf_error = msg
+        self.bins.fzf_error = None
+        self.bins.fzf_warning = None
+        if self.prefs["matcher"].value == MatcherType.NATIVE:
+            logger.debug("Using the native matcher")
+            self._set_matcher(NativeMatcher())
+            return
+        if find_binary("fzf") is None:
+            # Several times slower than fzf, searches of large directories take seconds
+            logger.warning("fzf not found, falling back to the native matcher")
+            self.bins.fzf_warning = "fzf not found, using the slower built-in matcher. Install fzf for faster searches."
+            self._set_matcher(NativeMatcher())
             return
         cmd = ["fzf", "--filter"]
         logger.debug("Using fzf command: %s", cmd + ["<input>"])
         self.bins.fzf_cmd = cmd
-        self.bins.fzf_error = None
-
-    def _refresh_scan(self):
-        # Re-use the previous file system reading if it was recent enough
-        timestamp = time.time()
-        elapsed = timestamp - self.fss.timestamp
-        scan_period = self.prefs["scan_period"].value
-        if elapsed < scan_period:
-            logger.debug(f"Reusing previous snapshot - elapsed_time ({elapsed}) < refresh_period ({scan_period})")
-            return
-
-        # Update the file system reading
-        logger.debug(f"Updating snapshot - elapsed time ({elapsed}) >= refresh_period ({scan_period})")
-        fd_process = subprocess.Popen(self.bins.fd_cmd, stdout=subprocess.PIPE, text=True)
-        try:
-            outs, errs = fd_process.communicate(timeout=self.prefs["scan_timeout"].value)
-        except subprocess.TimeoutExpired:
-            fd_process.kill()
-            raise
-
-        self.fss.timestamp = timestamp
-        self.fss.snapshot = outs
+        self._set_matcher(FzfMatcher(cmd))
+
+    def _refresh_scan(self) -> FileSystemSnapshot:
+        # Serve the latest finished snapshot, a stale one triggers a refresh in background.
+        # While the filesystem is watched the snapshot is kept up to date by events instead.
+        # Each root uses its own scan period and timeout, roots that aren't ready are left out.
+        return self.refresher.refresh(background=self.prefs["background_scan"].value)
+
+    def is_dir(self, path_name: str) -> bool:
+        """ Known from the scan when possible, otherwise from a (cached) stat """
+        is_dir = self.refresher.is_dir(path_name)
+        if is_dir is None:
+            is_dir = self.file_types.is_dir(path_name)
+        return is_dir
+
+    def cancel_searches(self) -> None:
+        self.matcher.cancel()
+        if self.sharded_matcher is not None:
+            self.sharded_matcher.cancel()
+        if self.content_search is not None:
+            self.content_search.cancel()
+
+    def _get_content_search(self) -> "ContentSearch":
+        if self.content_search is None:
+            # Imported here since content searches are rare
+            from matcher.content import MmapSearch, RipgrepSearch
+
+            # Content searches fall back to reading the snapshot files when ripgrep is missing
+            self.content_search = RipgrepSearch() if find_binary("rg") else MmapSearch()
+        return self.content_search
+
+    def search_contents(self, query: str, timer: Optional[QueryTimer] = None) -> List["ContentMatch"]:
+        logger.debug("Finding files containing %s", query)
+        timer = timer or QueryTimer()
+        with timer.stage("filter"):
+            matches = self._get_content_search().search(
+                query,
+                [root.rules for root in self.refresher.roots],
+                self._refresh_scan,
+                self.prefs["result_limit"].value,
+                self.prefs["content_timeout"].value,
+            )
+        logger.info("Found content matches: %s", matches)
+        return matches
 
-    def search(self, query: str) -> List[str]:
+    def search(self, query: str, timer: Optional[QueryTimer] = None) -> List[str]:
         logger.debug("Finding results for %s", query)
+        timer = timer or QueryTimer()
 
         # Check if the filesystem snapshot needs a refresh
-        self._refresh_scan()
-
-        # Run fzf
-        fzf_cmd = self.bins.fzf_cmd + [query]
-        fzf_process = subprocess.Popen(fzf_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-        fzf_process.stdin.write(self.fss.snapshot)
-        outs, _ = fzf_process.communicate()
-
-        # Get the first 'limit' results
+        with timer.stage("refresh"):
+            fss = self._refresh_scan()
+        timer.add("snapshot_age", time.time() - fss.timestamp)
+        if self.refresher.scan_duration is not None:
+            timer.add("scan", self.refresher.scan_duration)
+        diffs = self.refresher.last_diffs.values()
+        if diffs:
+            timer.add("diff", max(diff.duration for diff in diffs))
+
+        # Rank the snapshot entries, the candidates are only reloaded when the snapshot changes
+        matcher = self._matcher_for(fss)
+        with timer.stage("load"):
+            matcher.load(fss)
         limit = self.prefs["result_limit"].value
-        results = outs.split(sep=linesep, maxsplit=limit+1)[:-1]   # head -n limit
+        frecency = self.prefs["frecency"].value
+        start = time.perf_counter()
+        # Frecent paths are moved up among a larger pool of the best matches
+        results = matcher.match(query, limit * RERANK_POOL_FACTOR if frecency else limit)
+        spawn = matcher.last_timings.get("spawn", 0.0)
+        timer.add("spawn", spawn)
+        timer.add("filter", time.perf_counter() - start - spawn)
+        if frecency:
+            with timer.stage("rerank"):
+                results = self.usage.rerank(results, limit)
         logger.info("Found results: %s", results)
         return results
 
 
 class KeywordQueryEventListener(EventListener):
     @staticmethod
-    def _get_dirname(path_name: str) -> str:
-        dirname = path_name if path.isdir(path_name) else path.dirname(path_name)
+    def _get_dirname(path_name: str, is_dir: bool) -> str:
+        dirname = path_name if is_dir else path.dirname(path_name)
         return dirname
 
     @staticmethod
     def _no_op_result_items(msgs: List[str], icon: str = "icon") -> List[ExtensionResultItem]:
+        from ulauncher.api.shared.action.DoNothingAction import DoNothingAction
+
         items = [
             ExtensionResultItem(icon=f"images/{icon}.png", name=msg, on_enter=DoNothingAction())
             for msg in msgs
@@ -163,26 +322,35 @@ class KeywordQueryEventListener(EventListener):
         return items
 
     @staticmethod
-    def _get_enter_action(path_name: str, keyword_id: str) -> BaseAction:
-        dirname = KeywordQueryEventListener._get_dirname(path_name)
+    def _get_enter_action(path_name: str, dirname: str, keyword_id: str) -> BaseAction:
+        # Rarely used actions are imported on demand to keep the startup short
         if keyword_id == "term_kw":
+            from ulauncher.api.shared.action.RunScriptAction import RunScriptAction
+
             return RunScriptAction(f"gnome-terminal --geometry 160x25 --working-directory \"{dirname}\"")
 
         if keyword_id == "fzf_kw":
             return OpenAction(dirname)
 
+        if keyword_id == "grep_kw":
+            return OpenAction(path_name)
+
+        from ulauncher.api.shared.action.CopyToClipboardAction import CopyToClipboardAction
+
         return CopyToClipboardAction(path_name)
 
     @staticmethod
-    def _get_alt_enter_action(action_type: Actions, filename: str, keyword_id: str) -> BaseAction:
-        dirname = KeywordQueryEventListener._get_dirname(filename)
+    def _get_alt_enter_action(action_type: Actions, filename: str, dirname: str, keyword_id: str) -> BaseAction:
         if keyword_id == "term_kw":
+            from ulauncher.api.shared.action.RunScriptAction import RunScriptAction
+
             return RunScriptAction(f"gnome-terminal --tab --working-directory \"{dirname}\"")
 
-        action = OpenAction(dirname)
         if action_type == Actions.COPY_PATH:
-            action = CopyToClipboardAction(filename)
-        return action
+            from ulauncher.api.shared.action.CopyToClipboardAction import CopyToClipboardAction
+
+            return CopyToClipboardAction(filename)
+        return OpenAction(dirname)
 
     @staticmethod
     def _get_path_prefix(results: List[str], trim_path: bool) -> Optional[str]:
@@ -206,21 +374,37 @@ class KeywordQueryEventListener(EventListener):
 
     @staticmethod
     def _generate_result_items(
-        preferences: FuzzyFinderPreferences, results: List[str], keyword_id: str
+        preferences: FuzzyFinderPreferences,
+        results: List[str],
+        keyword_id: str,
+        is_dir: Callable[[str], bool],
+        line_info: Optional[List[str]] = None,
     ) -> List[ExtensionSmallResultItem]:
 
         path_prefix = KeywordQueryEventListener._get_path_prefix(results, preferences["trim_display_path"].value)
 
         items = []
-        for path_name in results:
+        for i, path_name in enumerate(results):
+            name = KeywordQueryEventListener._get_display_name(path_name, path_prefix)
+            if line_info is not None:
+                name += line_info[i]
+            dirname = KeywordQueryEventListener._get_dirname(path_name, is_dir(path_name))
+            if preferences["frecency"].value:
+                # Go through the extension to record the selection, ItemEnterEventListener returns the action
+                data = {"path": path_name, "dirname": dirname, "keyword_id": keyword_id}
+                on_enter = ExtensionCustomAction({**data, "alt": False}, keep_app_open=True)
+                on_alt_enter = ExtensionCustomAction({**data, "alt": True}, keep_app_open=True)
+            else:
+                on_enter = KeywordQueryEventListener._get_enter_action(path_name, dirname, keyword_id)
+                on_alt_enter = KeywordQueryEventListener._get_alt_enter_action(
+                    preferences["alt_enter_action"].value, path_name, dirname, keyword_id
+                )
             items.append(
                 ExtensionSmallResultItem(
                     icon="images/sub-icon.png",
-                    name=KeywordQueryEventListener._get_display_name(path_name, path_prefix),
-                    on_enter=KeywordQueryEventListener._get_enter_action(path_name, keyword_id),
-                    on_alt_enter=KeywordQueryEventListener._get_alt_enter_action(
-                        preferences["alt_enter_action"].value, path_name, keyword_id
-                    )
+                    name=name,
+                    on_enter=on_enter,
+                    on_alt_enter=on_alt_enter,
                 )
             )
         return items
@@ -245,7 +429,9 @@ class KeywordQueryEventListener(EventListener):
             if kp.value == keyword:
                 return kp.keyword_id
 
-    def on_event(self, event: KeywordQueryEvent, extension: FuzzyFinderExtension) -> RenderResultListAction:
+    def on_event(
+        self, event: KeywordQueryEvent, extension: FuzzyFinderExtension
+    ) -> Optional[RenderResultListAction]:
         bins_have_errors = extension.bins.fd_error or extension.bins.fzf_error
         if bins_have_errors or extension.prefs_have_errors:
             pref_errors, pref_warnings = self._collect_error_and_warnings(extension.prefs)
@@ -255,23 +441,51 @@ class KeywordQueryEventListener(EventListener):
             warnings = KeywordQueryEventListener._no_op_result_items(pref_warnings, "warning")
             return RenderResultListAction(errors + warnings)
 
+        # A new query makes the ones still being searched useless
+        ticket = extension.scheduler.submit(extension.cancel_searches)
         query = event.get_argument()
+        keyword_id = self._get_keyword_id(event.get_keyword(), extension.keyword_prefs)
         if not query:
             items = KeywordQueryEventListener._no_op_result_items(["Enter your search criteria."])
+            if extension.bins.fzf_warning is not None and keyword_id != "grep_kw":
+                # Shown before searching, not on top of the results
+                items += KeywordQueryEventListener._no_op_result_items([extension.bins.fzf_warning], "warning")
             return RenderResultListAction(items)
 
+        timer = QueryTimer()
+        if not extension.scheduler.wait(ticket, extension.prefs["debounce"].value):
+            logger.debug("Query '%s' superseded while debouncing", query)
+            return None
+        line_info = None
         try:
-            results = extension.search(query)
+            if keyword_id == "grep_kw":
+                matches = extension.search_contents(query, timer)
+                results = [match.path for match in matches]
+                line_info = [f":{match.line_number}  {match.text}" for match in matches]
+            else:
+                results = extension.search(query, timer)
+        except MatchCancelledError:
+            logger.debug("Query '%s' superseded while matching", query)
+            return None
         except subprocess.CalledProcessError as error:
-            if error.cmd[0] == "fzf" and error.returncode == 1:
-                items = KeywordQueryEventListener._no_op_result_items(["No results found."])
-                return RenderResultListAction(items)
-
             logger.debug("Subprocess %s failed with status code %s", error.cmd, error.returncode)
             items = KeywordQueryEventListener._no_op_result_items(
                 [f"{error.cmd[0]} returned status code '{error.returncode}'"], "error"
             )
             return RenderResultListAction(items)
+        except ScanPendingError as error:
+            logger.info(str(error))
+            items = KeywordQueryEventListener._no_op_result_items(
+                ["Scanning the base directory, results will be available shortly."], "warning"
+            )
+            if extension.prefs["frecency"].value and keyword_id != "grep_kw":
+                # Frecent paths don't need a snapshot, serve them while the scan runs
+                hits = extension.usage.match(query, extension.prefs["result_limit"].value)
+                if hits:
+                    items += KeywordQueryEventListener._generate_result_items(
+                        extension.prefs, hits, keyword_id, extension.is_dir
+                    )
+            return self._render(extension, timer, items)
         except subprocess.TimeoutExpired as error:
             long_msg = f"Process '{' '.join(error.cmd)}' timed out after {error.timeout} seconds"
             short_msg = f"{error.cmd[0]} timed out after {error.timeout} s"
@@ -279,10 +493,56 @@ class KeywordQueryEventListener(EventListener):
             items = KeywordQueryEventListener._no_op_result_items([short_msg], "error")
             return RenderResultListAction(items)
 
-        keyword_id = self._get_keyword_id(event.get_keyword(), extension.keyword_prefs)
-        items = KeywordQueryEventListener._generate_result_items(extension.prefs, results, keyword_id)
+        if not extension.scheduler.is_latest(ticket):
+            # Only the newest query gets rendered
+            return None
+
+        if not results:
+            items = KeywordQueryEventListener._no_op_result_items(["No results found."])
+            return self._render(extension, timer, items)
+
+        with timer.stage("render"):
+            items = KeywordQueryEventListener._generate_result_items(
+                extension.prefs, results, keyword_id, extension.is_dir, line_info
+            )
+        return self._render(extension, timer, items)
+
+    @staticmethod
+    def _render(
+        extension: FuzzyFinderExtension, timer: QueryTimer, items: List[ExtensionResultItem]
+    ) -> RenderResultListAction:
+        """ Record the timings of a served query, shown on top of the results when debugging """
+        timer.add("total", timer.elapsed())
+        extension.latency.add(timer)
+        logger.debug("Query timings (s): %s", timer.durations)
+        if extension.prefs["debug_timings"].value:
+            diffs = extension.refresher.last_diffs.values()
+            changes = (sum(diff.added_count for diff in diffs), sum(diff.removed_count for diff in diffs))
+            debug_item = ExtensionResultItem(
+                icon="images/icon.png",
+                name=format_timer(timer, extension.latency, changes if diffs else None),
+                description=f"Press Enter to save the latency percentiles to {LATENCY_FILE}",
+                on_enter=ExtensionCustomAction({"dump_timings": True}, keep_app_open=True),
+            )
+            items.insert(0, debug_item)
         return RenderResultListAction(items)
 
 
+class ItemEnterEventListener(EventListener):
+    def on_event(self, event: ItemEnterEvent, extension: FuzzyFinderExtension) -> BaseAction:
+        data = event.get_data()
+        if data.get("dump_timings"):
+            extension.latency.dump(LATENCY_FILE)
+            return OpenAction(LATENCY_FILE)
+
+        path_name, dirname, keyword_id = data["path"], data["dirname"], data["keyword_id"]
+        extension.usage.record(path_name)
+        if data["alt"]:
+            return KeywordQueryEventListener._get_alt_enter_action(
+                extension.prefs["alt_enter_action"].value, path_name, dirname, keyword_id
+            )
+        return KeywordQueryEventListener._get_enter_action(path_name, dirname, keyword_id)
+
+
 if __name__ == "__main__":
     FuzzyFinderExtension().run()
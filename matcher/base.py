@@ -0,0 +1,28 @@
+from typing import Dict, List
+
+from scan.snapshot import FileSystemSnapshot
+
+
+class MatchCancelledError(Exception):
+    """ Raised by a match aborted through Matcher.cancel() """
+
+
+class Matcher:
+    """ Backend ranking the snapshot entries against the user queries """
+
+    # Seconds spent in the stages of the last match that a backend can tell apart, e.g. {"spawn": 0.002}
+    last_timings: Dict[str, float] = {}
+
+    def load(self, snapshot: FileSystemSnapshot) -> None:
+        """ Prepare the candidates of a snapshot, a no-op if it is already loaded """
+        raise NotImplementedError
+
+    def match(self, query: str, limit: int) -> List[str]:
+        """ Return the best 'limit' entries matching 'query', best first (empty if nothing matched) """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """ Release the resources held for the loaded snapshot """
+
+    def cancel(self) -> None:
+        """ Abort the matches in progress, they raise MatchCancelledError """
@@ -0,0 +1,229 @@
+import logging
+import mmap
+import os
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Pattern, Set
+
+from matcher.base import MatchCancelledError
+from scan.index import ScanRules
+from scan.snapshot import FileSystemSnapshot, decode, encode
+
+logger = logging.getLogger(__name__)
+
+# Matched lines are cut to this many characters
+MAX_LINE_LENGTH = 200
+
+
+@dataclass(frozen=True)
+class ContentMatch:
+    path: str
+    line_number: int
+    text: str
+
+
+def _line_text(raw: bytes) -> str:
+    return decode(raw[:MAX_LINE_LENGTH * 4]).strip()[:MAX_LINE_LENGTH]
+
+
+class ContentSearch:
+    """ Backend finding the lines of the scanned files that contain a query """
+
+    def search(
+        self,
+        pattern: str,
+        roots: List[ScanRules],
+        snapshot: Callable[[], FileSystemSnapshot],
+        limit: int,
+        timeout: Optional[float],
+    ) -> List[ContentMatch]:
+        """
+        Return the first 'limit' lines containing 'pattern' (smart case), stopping after 'timeout' seconds
+        with the matches found so far.
+        :param snapshot: returns the current snapshot, for backends scanning its files
+        """
+        raise NotImplementedError
+
+    def cancel(self) -> None:
+        """ Abort the searches in progress, they raise MatchCancelledError """
+
+
+class RipgrepSearch(ContentSearch):
+    """
+    Streams the matches of ripgrep, which applies the scan options and limits of each root itself
+    (except max_entries and max_children)
+    """
+
+    def __init__(self, rg_bin: str = "rg"):
+        self.rg_bin = rg_bin
+        self._lock = threading.Lock()
+        self._processes: Set[subprocess.Popen] = set()
+        self._epoch = 0
+
+    def _cmd(self, pattern: str, rules: ScanRules) -> List[str]:
+        cmd = [
+            self.rg_bin, "--line-number", "--with-filename", "--null", "--no-heading", "--color", "never",
+            "--no-messages", "--smart-case", "--fixed-strings",
+        ]
+        if rules.allow_hidden:
+            cmd.append("--hidden")
+        if rules.follow_symlinks:
+            cmd.append("--follow")
+        if rules.ignore_file is not None:
+            cmd.extend(["--ignore-file", rules.ignore_file])
+        # The limits of the scan, as applied by fd
+        if rules.max_depth is not None:
+            cmd.extend(["--max-depth", str(rules.max_depth)])
+        for exclude in rules.excludes:
+            cmd.extend(["--glob", "!" + exclude])
+        return cmd + ["--", pattern, rules.base_dir]
+
+    def search(
+        self,
+        pattern: str,
+        roots: List[ScanRules],
+        snapshot: Callable[[], FileSystemSnapshot],
+        limit: int,
+        timeout: Optional[float],
+    ) -> List[ContentMatch]:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            epoch = self._epoch
+        matches: List[ContentMatch] = []
+        # The snapshot of a root listing only directories has no file to search
+        for rules in (rules for rules in roots if rules.files):
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if len(matches) >= limit or (remaining is not None and remaining <= 0):
+                break
+            matches += self._search_root(self._cmd(pattern, rules), limit - len(matches), remaining, epoch)
+        return matches
+
+    def _search_root(
+        self, cmd: List[str], limit: int, timeout: Optional[float], epoch: int
+    ) -> List[ContentMatch]:
+        rg_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with self._lock:
+            self._processes.add(rg_process)
+            if epoch != self._epoch:
+                rg_process.kill()
+        timer = threading.Timer(timeout, rg_process.kill) if timeout is not None else None
+        if timer is not None:
+            timer.start()
+
+        # Output lines are 'path\0line number:text', only the first 'limit' ones are read
+        matches = []
+        killed = False
+        with rg_process:
+            for line in rg_process.stdout:
+                raw_path, _, rest = line.rstrip(b"\n").partition(b"\0")
+                raw_number, _, text = rest.partition(b":")
+                try:
+                    matches.append(ContentMatch(decode(raw_path), int(raw_number), _line_text(text)))
+                except ValueError:
+                    continue
+                if len(matches) == limit:
+                    rg_process.kill()
+                    killed = True
+                    break
+            returncode = rg_process.wait()
+        if timer is not None:
+            timer.cancel()
+
+        with self._lock:
+            self._processes.discard(rg_process)
+            if epoch != self._epoch:
+                raise MatchCancelledError(cmd[-2])
+        if returncode < 0 and not killed:
+            logger.info("'%s' timed out after %s seconds", " ".join(cmd), timeout)
+        # 1: nothing matched, 2: some files couldn't be read
+        elif returncode not in (0, 1, 2) and not killed:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        return matches
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            for process in self._processes:
+                process.kill()
+
+
+class MmapSearch(ContentSearch):
+    """
+    Pure Python fallback scanning the files of the snapshot, which already applied the ignore and
+    hidden options of the roots. Files are memory-mapped, binary files (a NUL byte in their first
+    8 KiB, as ripgrep does) and files larger than 'max_file_size' are skipped.
+    Case-insensitive matching only folds ASCII letters.
+    """
+
+    def __init__(self, max_file_size: int = 16 * 2**20):
+        self.max_file_size = max_file_size
+        self._epoch = 0
+
+    def search(
+        self,
+        pattern: str,
+        roots: List[ScanRules],
+        snapshot: Callable[[], FileSystemSnapshot],
+        limit: int,
+        timeout: Optional[float],
+    ) -> List[ContentMatch]:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        epoch = self._epoch
+        flags = 0 if pattern != pattern.lower() else re.IGNORECASE
+        regex = re.compile(re.escape(encode(pattern)), flags)
+
+        matches: List[ContentMatch] = []
+        files = snapshot()
+        # One entry decoded at a time, the search usually stops long before the end of the snapshot
+        for offset in files.offsets:
+            path_name = files.entry_at(offset)
+            if epoch != self._epoch:
+                raise MatchCancelledError(pattern)
+            if deadline is not None and time.monotonic() > deadline:
+                logger.info("Content search of '%s' timed out after %s seconds", pattern, timeout)
+                break
+            if path_name.endswith("/"):
+                continue
+            matches += self._search_file(regex, path_name, limit - len(matches))
+            if len(matches) >= limit:
+                break
+        return matches
+
+    def _search_file(self, regex: Pattern, path_name: str, limit: int) -> List[ContentMatch]:
+        try:
+            with open(path_name, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if size == 0 or size > self.max_file_size:
+                    return []
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if data.find(b"\0", 0, 8192) >= 0:
+                        return []
+                    return self._matching_lines(regex, data, path_name, limit)
+        except (OSError, ValueError):
+            # Directories, unreadable or vanished files
+            return []
+
+    @staticmethod
+    def _matching_lines(regex: Pattern, data: mmap.mmap, path_name: str, limit: int) -> List[ContentMatch]:
+        matches = []
+        line_number, counted = 1, 0
+        position = 0
+        while len(matches) < limit:
+            match = regex.search(data, position)
+            if match is None:
+                break
+            start = data.rfind(b"\n", 0, match.start()) + 1
+            end = data.find(b"\n", match.end())
+            end = end if end >= 0 else len(data)
+            line_number += data[counted:start].count(b"\n")
+            counted = start
+            matches.append(ContentMatch(path_name, line_number, _line_text(data[start:end])))
+            # One match per line, like ripgrep
+            position = end + 1
+        return matches
+
+    def cancel(self) -> None:
+        self._epoch += 1
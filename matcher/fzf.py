@@ -0,0 +1,112 @@
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from os import linesep
+from typing import List, Optional, Set, Tuple
+
+from matcher.base import MatchCancelledError, Matcher
+from scan.snapshot import ENCODING, ENCODING_ERRORS, FileSystemSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class FzfMatcher(Matcher):
+    """
+    Runs 'fzf --filter' for each query. The candidates are written once per snapshot into an
+    anonymous in-memory file that every fzf process reads as its stdin, instead of having the
+    whole snapshot copied through a pipe on every keystroke.
+    """
+
+    def __init__(self, cmd: List[str]):
+        self.cmd = cmd
+        self._lock = threading.Lock()
+        self._snapshot: Optional[FileSystemSnapshot] = None
+        self._candidates_fd = -1
+        self._candidates_file: Optional[str] = None
+        self._processes: Set[subprocess.Popen] = set()
+        self._epoch = 0
+
+    def load(self, snapshot: FileSystemSnapshot) -> None:
+        with self._lock:
+            if snapshot is self._snapshot:
+                return
+            self._release()
+            self._candidates_fd, self._candidates_file = self._write_candidates(snapshot.data)
+            self._snapshot = snapshot
+
+    @staticmethod
+    def _write_candidates(candidates: bytes) -> Tuple[int, str]:
+        if hasattr(os, "memfd_create"):
+            fd = os.memfd_create("ulauncher-fzf-candidates", os.MFD_CLOEXEC)
+            # Reopening through procfs gives every reader its own file offset
+            file_name = f"/proc/self/fd/{fd}"
+        else:
+            runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+            fd, file_name = tempfile.mkstemp(prefix="ulauncher-fzf-", dir=runtime_dir)
+        with memoryview(candidates) as view:
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        return fd, file_name
+
+    def _release(self) -> None:
+        if self._candidates_fd < 0:
+            return
+        os.close(self._candidates_fd)
+        if not self._candidates_file.startswith("/proc/"):
+            os.remove(self._candidates_file)
+        self._candidates_fd, self._candidates_file, self._snapshot = -1, None, None
+
+    def match(self, query: str, limit: int) -> List[str]:
+        fzf_cmd = self.cmd + [query]
+        with self._lock:
+            if self._candidates_file is None:
+                # Closed by a change of matcher while the query was running
+                raise MatchCancelledError(query)
+            epoch = self._epoch
+            candidates = open(self._candidates_file, "rb")
+        start = time.perf_counter()
+        with candidates:
+            fzf_process = subprocess.Popen(
+                fzf_cmd, stdin=candidates, stdout=subprocess.PIPE, encoding=ENCODING, errors=ENCODING_ERRORS
+            )
+        self.last_timings = {"spawn": time.perf_counter() - start}
+        with self._lock:
+            self._processes.add(fzf_process)
+            if epoch != self._epoch:
+                # Cancelled while spawning
+                fzf_process.kill()
+
+        # Stream only the first 'limit' results (head -n limit), the rest is never read nor decoded
+        results = []
+        with fzf_process:
+            for line in fzf_process.stdout:
+                results.append(line.rstrip(linesep))
+                if len(results) == limit:
+                    fzf_process.kill()
+                    break
+            returncode = fzf_process.wait()
+        with self._lock:
+            self._processes.discard(fzf_process)
+            if epoch != self._epoch:
+                raise MatchCancelledError(query)
+        if results:
+            return results
+
+        # fzf exits with status 1 when nothing matched
+        if returncode == 1:
+            return []
+        raise subprocess.CalledProcessError(returncode, fzf_cmd)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            for process in self._processes:
+                process.kill()
+
+    def close(self) -> None:
+        with self._lock:
+            self._release()
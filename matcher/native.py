@@ -0,0 +1,565 @@
+import ctypes
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from itertools import islice
+from typing import Callable, Dict, FrozenSet, Iterator, List, Optional, Pattern, Tuple
+
+from matcher.base import MatchCancelledError, Matcher
+from scan.snapshot import FileSystemSnapshot, decode, encode
+
+# Scoring constants of fzf's algorithm (src/algo/algo.go, default scheme)
+SCORE_MATCH = 16
+SCORE_GAP_START = -3
+SCORE_GAP_EXTENSION = -1
+BONUS_BOUNDARY = SCORE_MATCH // 2
+BONUS_NON_WORD = SCORE_MATCH // 2
+BONUS_CAMEL_123 = BONUS_BOUNDARY + SCORE_GAP_EXTENSION
+BONUS_CONSECUTIVE = -(SCORE_GAP_START + SCORE_GAP_EXTENSION)
+BONUS_FIRST_CHAR_MULTIPLIER = 2
+BONUS_BOUNDARY_WHITE = BONUS_BOUNDARY + 2
+BONUS_BOUNDARY_DELIMITER = BONUS_BOUNDARY + 1
+
+# Character classes, in the same order as fzf since bonusFor() compares them
+CHAR_WHITE, CHAR_NON_WORD, CHAR_DELIMITER, CHAR_LOWER, CHAR_UPPER, CHAR_LETTER, CHAR_NUMBER = range(7)
+INITIAL_CHAR_CLASS = CHAR_WHITE
+DELIMITER_CHARS = "/,:;|"
+WHITE_CHARS = " \t\n\v\f\r\x85\xa0"
+_LINE_WHITE = b"(?:[ \\t\\v\\f\\r]|" + b"|".join(re.escape(encode(c)) for c in "\x85\xa0") + b")"
+
+
+def _char_class(char: str) -> int:
+    if "a" <= char <= "z":
+        return CHAR_LOWER
+    if "A" <= char <= "Z":
+        return CHAR_UPPER
+    if "0" <= char <= "9":
+        return CHAR_NUMBER
+    if char in WHITE_CHARS:
+        return CHAR_WHITE
+    if char in DELIMITER_CHARS:
+        return CHAR_DELIMITER
+    if char < "\x80":
+        return CHAR_NON_WORD
+    category = unicodedata.category(char)
+    if category == "Ll":
+        return CHAR_LOWER
+    if category == "Lu":
+        return CHAR_UPPER
+    if category.startswith("N"):
+        return CHAR_NUMBER
+    if category.startswith("L"):
+        return CHAR_LETTER
+    if char.isspace():
+        return CHAR_WHITE
+    return CHAR_NON_WORD
+
+
+def _bonus_for(prev_class: int, char_class: int) -> int:
+    if char_class > CHAR_NON_WORD:
+        if prev_class == CHAR_WHITE:
+            return BONUS_BOUNDARY_WHITE
+        if prev_class == CHAR_DELIMITER:
+            return BONUS_BOUNDARY_DELIMITER
+        if prev_class == CHAR_NON_WORD:
+            return BONUS_BOUNDARY
+    if (prev_class == CHAR_LOWER and char_class == CHAR_UPPER) or (
+        prev_class != CHAR_NUMBER and char_class == CHAR_NUMBER
+    ):
+        return BONUS_CAMEL_123
+    if char_class in (CHAR_NON_WORD, CHAR_DELIMITER):
+        return BONUS_NON_WORD
+    if char_class == CHAR_WHITE:
+        return BONUS_BOUNDARY_WHITE
+    return 0
+
+
+_BONUS_MATRIX = [[_bonus_for(prev, cur) for cur in range(7)] for prev in range(7)]
+_ASCII_CLASSES = [_char_class(chr(i)) for i in range(128)]
+
+
+def _classes(text: str) -> List[int]:
+    ascii_classes = _ASCII_CLASSES
+    return [ascii_classes[ord(c)] if c < "\x80" else _char_class(c) for c in text]
+
+
+def _bonus_at(classes: List[int], idx: int) -> int:
+    if idx == 0:
+        return BONUS_BOUNDARY_WHITE
+    return _BONUS_MATRIX[classes[idx - 1]][classes[idx]]
+
+
+def fuzzy_score(text: str, chars: str, pattern: str) -> Optional[int]:
+    """
+    fzf's FuzzyMatchV2 (forward), returns the score or None if 'pattern' is not a subsequence
+    :param text: the candidate, used for the character classes
+    :param chars: the candidate as compared with 'pattern' (lowercase for case-insensitive terms)
+    """
+    m = len(pattern)
+    min_idx = chars.find(pattern[0])
+    if min_idx < 0:
+        return None
+    idx = min_idx + 1
+    for pchar in pattern[1:]:
+        idx = chars.find(pchar, idx)
+        if idx < 0:
+            return None
+        idx += 1
+    max_idx = chars.rfind(pattern[-1]) + 1
+
+    # Phase 2: bonus of every position, score of the first pattern character
+    prev_class = _char_class(text[min_idx - 1]) if min_idx > 0 else INITIAL_CHAR_CLASS
+    bonus_matrix = _BONUS_MATRIX
+    width = max_idx - min_idx
+    t = chars[min_idx:max_idx]
+    b = [0] * width
+    h0 = [0] * width
+    c0 = [0] * width
+    f = [0] * m
+    pchar0, pchar, pidx = pattern[0], pattern[0], 0
+    last_idx = 0
+    max_score, prev_h0, in_gap = 0, 0, False
+    for off, char_class in enumerate(_classes(text[min_idx:max_idx])):
+        char = t[off]
+        bonus = bonus_matrix[prev_class][char_class]
+        b[off] = bonus
+        prev_class = char_class
+        if char == pchar:
+            if pidx < m:
+                f[pidx] = off
+                pidx += 1
+                pchar = pattern[min(pidx, m - 1)]
+            last_idx = off
+        if char == pchar0:
+            score = SCORE_MATCH + bonus * BONUS_FIRST_CHAR_MULTIPLIER
+            h0[off] = score
+            c0[off] = 1
+            if m == 1 and score > max_score:
+                max_score = score
+                # Like fzf, the first occurrence at a word boundary is good enough
+                if bonus >= BONUS_BOUNDARY:
+                    break
+            in_gap = False
+        else:
+            h0[off] = max(prev_h0 + (SCORE_GAP_EXTENSION if in_gap else SCORE_GAP_START), 0)
+            in_gap = True
+        prev_h0 = h0[off]
+    if pidx != m:
+        return None
+    if m == 1:
+        return max_score
+
+    # Phase 3: fill in the score matrix, one pattern character (row) at a time
+    width = last_idx + 1
+    h_prev, c_prev = h0, c0
+    for pidx in range(1, m):
+        pchar = pattern[pidx]
+        h_cur = [0] * width
+        c_cur = [0] * width
+        in_gap = False
+        last_row = pidx == m - 1
+        for col in range(f[pidx], width):
+            s2 = h_cur[col - 1] + (SCORE_GAP_EXTENSION if in_gap else SCORE_GAP_START)
+            s1 = 0
+            consecutive = 0
+            if t[col] == pchar:
+                s1 = h_prev[col - 1] + SCORE_MATCH
+                bonus = b[col]
+                consecutive = c_prev[col - 1] + 1
+                if consecutive > 1:
+                    first_bonus = b[col - consecutive + 1]
+                    # Break consecutive chunk
+                    if bonus >= BONUS_BOUNDARY and bonus > first_bonus:
+                        consecutive = 1
+                    else:
+                        bonus = max(bonus, BONUS_CONSECUTIVE, first_bonus)
+                if s1 + bonus < s2:
+                    s1 += b[col]
+                    consecutive = 0
+                else:
+                    s1 += bonus
+            c_cur[col] = consecutive
+            in_gap = s1 < s2
+            score = max(s1, s2, 0)
+            if last_row and score > max_score:
+                max_score = score
+            h_cur[col] = score
+        h_prev, c_prev = h_cur, c_cur
+    return max_score
+
+
+def _calculate_score(classes: List[int], chars: str, pattern: str, sidx: int, eidx: int) -> int:
+    """ fzf's calculateScore, for terms that can only match a contiguous range """
+    pidx, score, in_gap, consecutive, first_bonus = 0, 0, False, 0, 0
+    prev_class = classes[sidx - 1] if sidx > 0 else INITIAL_CHAR_CLASS
+    for idx in range(sidx, eidx):
+        char_class = classes[idx]
+        if pidx < len(pattern) and chars[idx] == pattern[pidx]:
+            score += SCORE_MATCH
+            bonus = _BONUS_MATRIX[prev_class][char_class]
+            if consecutive == 0:
+                first_bonus = bonus
+            else:
+                # Break consecutive chunk
+                if bonus >= BONUS_BOUNDARY and bonus > first_bonus:
+                    first_bonus = bonus
+                bonus = max(bonus, first_bonus, BONUS_CONSECUTIVE)
+            score += bonus * BONUS_FIRST_CHAR_MULTIPLIER if pidx == 0 else bonus
+            in_gap, consecutive = False, consecutive + 1
+            pidx += 1
+        else:
+            score += SCORE_GAP_EXTENSION if in_gap else SCORE_GAP_START
+            in_gap, consecutive, first_bonus = True, 0, 0
+        prev_class = char_class
+    return score
+
+
+def exact_score(text: str, chars: str, pattern: str) -> Optional[int]:
+    """ fzf's ExactMatchNaive: the occurrence with the best bonus on its first character wins """
+    start = chars.find(pattern)
+    if start < 0:
+        return None
+    classes = _classes(text)
+    best_pos, best_bonus = -1, -1
+    while start >= 0:
+        bonus = _bonus_at(classes, start)
+        if bonus > best_bonus:
+            best_pos, best_bonus = start, bonus
+        if bonus >= BONUS_BOUNDARY:
+            break
+        start = chars.find(pattern, start + 1)
+    return _calculate_score(classes, chars, pattern, best_pos, best_pos + len(pattern))
+
+
+def prefix_score(text: str, chars: str, pattern: str) -> Optional[int]:
+    trimmed = 0 if pattern[0] in WHITE_CHARS else len(chars) - len(chars.lstrip(WHITE_CHARS))
+    if not chars.startswith(pattern, trimmed):
+        return None
+    return _calculate_score(_classes(text), chars, pattern, trimmed, trimmed + len(pattern))
+
+
+def suffix_score(text: str, chars: str, pattern: str) -> Optional[int]:
+    end = len(chars) if pattern[-1] in WHITE_CHARS else len(chars.rstrip(WHITE_CHARS))
+    start = end - len(pattern)
+    if start < 0 or chars[start:end] != pattern:
+        return None
+    return _calculate_score(_classes(text), chars, pattern, start, end)
+
+
+def equal_score(text: str, chars: str, pattern: str) -> Optional[int]:
+    start = len(chars) - len(chars.lstrip(WHITE_CHARS))
+    end = len(chars.rstrip(WHITE_CHARS))
+    if chars[start:end] != pattern:
+        return None
+    return _calculate_score(_classes(text), chars, pattern, start, end)
+
+
+class TermType(Enum):
+    FUZZY = 0
+    EXACT = 1
+    PREFIX = 2
+    SUFFIX = 3
+    EQUAL = 4
+
+
+_TERM_FUNCTIONS: Dict[TermType, Callable[[str, str, str], Optional[int]]] = {
+    TermType.FUZZY: fuzzy_score,
+    TermType.EXACT: exact_score,
+    TermType.PREFIX: prefix_score,
+    TermType.SUFFIX: suffix_score,
+    TermType.EQUAL: equal_score,
+}
+
+
+@dataclass
+class Term:
+    type: TermType
+    text: str
+    inverse: bool = False
+    case_sensitive: bool = False
+
+    def _char_regex(self, char: str) -> bytes:
+        # The ignore-case flag of bytes patterns only folds ASCII letters, list the other variants
+        variants = {char} if self.case_sensitive else {char} | _case_variants().get(char, frozenset())
+        encoded = sorted(re.escape(encode(variant)) for variant in variants)
+        return encoded[0] if len(encoded) == 1 else b"(?:" + b"|".join(encoded) + b")"
+
+    def regex(self) -> bytes:
+        """ Regular expression matching (at least) the encoded lines this term matches """
+        text = b"".join(self._char_regex(c) for c in self.text)
+        if self.type == TermType.FUZZY:
+            body = b"".join(
+                b"[^\\n" + re.escape(c.encode()) + b"]*" + self._char_regex(c) if c < "\x80"
+                else b"[^\\n]*?" + self._char_regex(c)
+                for c in self.text
+            ) + b"[^\\n]*"
+        elif self.type == TermType.PREFIX:
+            body = _LINE_WHITE + b"*" + text + b"[^\\n]*"
+        else:
+            body = b"[^\\n]*" + text + b"[^\\n]*"
+        return body if self.case_sensitive else b"(?i:" + body + b")"
+
+
+TermSet = List[Term]
+
+
+@lru_cache(maxsize=None)
+def _case_variants() -> Dict[str, FrozenSet[str]]:
+    """ Lowercase character -> characters that _lower() turns into it (e.g. 'i' -> 'I', 'İ') """
+    variants: Dict[str, set] = {}
+    for code in range(0x10000):
+        char = chr(code)
+        lower = char.lower()[:1]
+        if lower and lower != char:
+            variants.setdefault(lower, set()).add(char)
+    return {lower: frozenset(chars) for lower, chars in variants.items()}
+
+
+def parse_query(query: str) -> List[TermSet]:
+    """ fzf's extended-search syntax: AND of space separated terms, '|' for OR """
+    query = query.lstrip(" ")
+    if not query.endswith("\\ "):
+        query = query.rstrip(" ")
+    tokens = [token.replace("\t", " ") for token in query.replace("\\ ", "\t").split(" ") if token]
+
+    term_sets: List[TermSet] = []
+    term_set: TermSet = []
+    switch_set = False
+    after_bar = False
+    for token in tokens:
+        case_sensitive = token.lower() != token
+        text = token if case_sensitive else token.lower()
+        term_type, inverse = TermType.FUZZY, False
+
+        if term_set and not after_bar and text == "|":
+            switch_set = False
+            after_bar = True
+            continue
+        after_bar = False
+
+        if text.startswith("!"):
+            inverse, term_type, text = True, TermType.EXACT, text[1:]
+        if text != "$" and text.endswith("$"):
+            term_type, text = TermType.SUFFIX, text[:-1]
+        if text.startswith("'"):
+            # Flip exactness
+            term_type = TermType.EXACT if not inverse else TermType.FUZZY
+            text = text[1:]
+        elif text.startswith("^"):
+            term_type = TermType.EQUAL if term_type == TermType.SUFFIX else TermType.PREFIX
+            text = text[1:]
+
+        if text:
+            if switch_set:
+                term_sets.append(term_set)
+                term_set = []
+            term_set.append(Term(type=term_type, text=text, inverse=inverse, case_sensitive=case_sensitive))
+            switch_set = True
+    if term_set:
+        term_sets.append(term_set)
+    return term_sets
+
+
+def _lower(text: str) -> str:
+    lower = text.lower()
+    if len(lower) != len(text):
+        # Keep the positions aligned with 'text' (e.g. 'İ'.lower() has two characters)
+        lower = "".join(c.lower()[0] for c in text)
+    return lower
+
+
+def score_line(term_sets: List[TermSet], line: str) -> Optional[int]:
+    """ fzf's extendedMatch: every term set must match, the first matching term gives the score """
+    lower_line = None
+    total = 0
+    for term_set in term_sets:
+        matched = False
+        current = 0
+        for term in term_set:
+            if term.case_sensitive:
+                chars = line
+            else:
+                lower_line = lower_line if lower_line is not None else _lower(line)
+                chars = lower_line
+            score = _TERM_FUNCTIONS[term.type](line, chars, term.text)
+            if score is not None:
+                if term.inverse:
+                    continue
+                current, matched = score, True
+                break
+            if term.inverse:
+                current, matched = 0, True
+        if not matched:
+            return None
+        total += current
+    return total
+
+
+def _term_narrows(old: Term, new: Term) -> bool:
+    """ Whether every line matched by 'new' is also matched by 'old' """
+    if old == new:
+        return True
+    if old.inverse or new.inverse:
+        return False
+    new_text = new.text if old.case_sensitive else new.text.lower()
+    if not new_text.startswith(old.text):
+        return False
+    # Every term type implies a fuzzy match of its text
+    if old.type == TermType.FUZZY:
+        return True
+    # Contiguous terms imply a substring match
+    if old.type == TermType.EXACT:
+        return new.type != TermType.FUZZY
+    if old.type == TermType.PREFIX:
+        return new.type in (TermType.PREFIX, TermType.EQUAL)
+    return False
+
+
+def narrows(old_sets: List[TermSet], new_sets: List[TermSet]) -> bool:
+    """
+    Whether the lines matched by 'new_sets' are a subset of the ones matched by 'old_sets', e.g.
+    'proj' narrows 'pro', while '!proj' widens '!pro' and 'pro | x' widens 'pro'
+    """
+    if any(len(term_set) > 1 for term_set in old_sets + new_sets) or len(new_sets) < len(old_sets):
+        return False
+    return all(_term_narrows(old[0], new[0]) for old, new in zip(old_sets, new_sets))
+
+
+_LINE = re.compile(b"[^\\n]+")
+
+
+def _prefilter(term_sets: List[TermSet]) -> Optional[Pattern]:
+    """ Single regex that selects the candidate lines, so that only those get scored """
+    lookaheads = [
+        b"(?=" + term_set[0].regex() + b"$)"
+        for term_set in term_sets
+        if len(term_set) == 1 and not term_set[0].inverse
+    ]
+    if not lookaheads:
+        return None
+    return re.compile(b"^" + b"".join(lookaheads) + b"[^\\n]*$", re.MULTILINE)
+
+
+class NativeMatcher(Matcher):
+    """
+    In-process implementation of fzf's default ranking (algorithm v2, smart case, extended-search
+    syntax, sort by score then length then input order), without any external binary. As in fzf,
+    queries made only of negations keep the input order.
+    Unicode normalization of accented letters is not implemented.
+    The lines matched by recent queries are remembered, so that a query extending one of them
+    (e.g. typing 'proj' after 'pro') only scores the lines that can still match. They survive a
+    snapshot derived from the loaded one by a diff: removed lines are dropped, added ones become
+    candidates of every cached query.
+    """
+
+    def __init__(self, narrowing_cache_size: int = 8, cancel_epoch: Optional[ctypes.c_longlong] = None) -> None:
+        self._snapshot: Optional[FileSystemSnapshot] = None
+        # query -> (parsed query, offsets of the matched lines), valid for the loaded snapshot only
+        self._narrowing: "OrderedDict[str, Tuple[List[TermSet], array]]" = OrderedDict()
+        self._narrowing_cache_size = narrowing_cache_size
+        # Matches may run concurrently, the lock guards the loaded snapshot and the cache
+        self._lock = threading.Lock()
+        # Incremented by cancel(), a match stops as soon as it changes. Anything with a 'value'
+        # attribute works, e.g. a multiprocessing.RawValue shared with the matchers of other processes
+        self._cancel_epoch = cancel_epoch if cancel_epoch is not None else ctypes.c_longlong(0)
+
+    def load(self, snapshot: FileSystemSnapshot) -> None:
+        with self._lock:
+            if snapshot is self._snapshot:
+                return
+            diff = snapshot.diff
+            if diff is not None and self._snapshot is not None and diff.base == self._snapshot.generation:
+                # Candidates are scored again anyway, so the unverified added lines don't change any result
+                for query, (term_sets, offsets) in self._narrowing.items():
+                    self._narrowing[query] = (term_sets, diff.remap(offsets))
+            else:
+                self._narrowing.clear()
+            self._snapshot = snapshot
+
+    def _cached_superset(self, query: str, term_sets: List[TermSet]) -> Optional[array]:
+        """ Offsets matched by the longest cached query that 'query' extends, if any, called with the lock held """
+        best_query = None
+        for cached_query, (cached_sets, _) in self._narrowing.items():
+            if not query.startswith(cached_query) or not narrows(cached_sets, term_sets):
+                continue
+            if best_query is None or len(cached_query) > len(best_query):
+                best_query = cached_query
+        if best_query is None:
+            return None
+        self._narrowing.move_to_end(best_query)
+        return self._narrowing[best_query][1]
+
+    @staticmethod
+    def _lines_at(snapshot: FileSystemSnapshot, offsets: array) -> Iterator[Tuple[int, str]]:
+        for offset in offsets:
+            yield offset, snapshot.entry_at(offset)
+
+    def _candidate_lines(
+        self, snapshot: FileSystemSnapshot, offsets: Optional[array], term_sets: List[TermSet]
+    ) -> Iterator[Tuple[int, str]]:
+        if offsets is not None:
+            return self._lines_at(snapshot, offsets)
+        prefilter = _prefilter(term_sets) or _LINE
+        # Only the lines selected by the prefilter get decoded
+        return ((match.start(), decode(match.group())) for match in prefilter.finditer(snapshot.data))
+
+    def match(self, query: str, limit: int) -> List[str]:
+        return [line for _, _, _, line in self.ranked(query, limit)]
+
+    def ranked(self, query: str, limit: int, epoch: Optional[int] = None) -> List[Tuple[int, int, int, str]]:
+        """
+        Best 'limit' lines as (-score, length, offset, line) tuples, the sort key of fzf. The score and
+        the length are 0 for queries made only of negations, so that the key is the input order.
+        :param epoch: cancel epoch the match was requested in, the current one by default
+        """
+        term_sets = parse_query(query)
+        if not term_sets:
+            return []
+
+        with self._lock:
+            snapshot = self._snapshot
+            epoch = epoch if epoch is not None else self._cancel_epoch.value
+            offsets = self._cached_superset(query, term_sets)
+        if snapshot is None:
+            return []
+        matched = array("q")
+        sortable = any(not term.inverse for term_set in term_sets for term in term_set)
+
+        def scored() -> Iterator[Tuple[int, int, int, str]]:
+            for offset, line in self._candidate_lines(snapshot, offsets, term_sets):
+                if epoch != self._cancel_epoch.value:
+                    raise MatchCancelledError(query)
+                score = score_line(term_sets, line)
+                if score is not None:
+                    matched.append(offset)
+                    yield -score, len(line.strip(WHITE_CHARS)) if sortable else 0, offset, line
+
+        complete = True
+        if sortable:
+            # Bounded heap: memory and sorting cost depend on 'limit', not on the number of matches
+            best = heapq.nsmallest(limit, scored())
+        else:
+            # Input order, the first matches are enough
+            lines = scored()
+            best = list(islice(lines, limit))
+            complete = next(lines, None) is None
+
+        with self._lock:
+            # Offsets are only meaningful for the snapshot they were computed on, and only complete
+            # matches can be narrowed
+            if snapshot is self._snapshot and complete:
+                self._narrowing[query] = (term_sets, matched)
+                self._narrowing.move_to_end(query)
+                if len(self._narrowing) > self._narrowing_cache_size:
+                    self._narrowing.popitem(last=False)
+        return best
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancel_epoch.value += 1
@@ -0,0 +1,34 @@
+import threading
+from typing import Callable
+
+
+class QueryScheduler:
+    """
+    Ulauncher delivers every query event on its own thread, so while typing the searches of
+    superseded queries keep running next to the newest one. Each query takes a ticket: taking one
+    cancels the matches in progress, and a query waits for a debounce window before searching,
+    giving up if a newer query arrives meanwhile.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._latest = 0
+
+    def submit(self, cancel: Callable[[], None]) -> int:
+        """ Take a ticket for a new query, 'cancel' aborts the work of the previous ones """
+        with self._condition:
+            self._latest += 1
+            ticket = self._latest
+            self._condition.notify_all()
+        cancel()
+        return ticket
+
+    def wait(self, ticket: int, debounce: float) -> bool:
+        """ Wait 'debounce' seconds, return whether the query is still the newest one """
+        with self._condition:
+            if debounce > 0:
+                self._condition.wait_for(lambda: self._latest != ticket, timeout=debounce)
+            return self._latest == ticket
+
+    def is_latest(self, ticket: int) -> bool:
+        return self._latest == ticket
@@ -0,0 +1,184 @@
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from dataclasses import replace
+from multiprocessing.connection import Connection
+from typing import Any, List, Optional, Tuple
+
+from matcher.base import MatchCancelledError, Matcher
+from matcher.native import NativeMatcher
+from scan.snapshot import FileSystemSnapshot, SnapshotDiff
+
+logger = logging.getLogger(__name__)
+
+
+def split_shards(data: bytes, shards: int) -> List[Tuple[int, int]]:
+    """ (start, end) of 'shards' contiguous chunks of about the same size, cut after a newline """
+    bounds = [0]
+    for i in range(1, shards):
+        cut = data.find(b"\n", max(len(data) * i // shards, bounds[-1]))
+        cut = cut + 1 if cut >= 0 else len(data)
+        if cut > bounds[-1] and cut < len(data):
+            bounds.append(cut)
+    bounds.append(len(data))
+    return list(zip(bounds, bounds[1:]))
+
+
+def _serve(conn: Connection, cancel_epoch: Any) -> None:
+    """ Worker process: keeps its shard loaded in a NativeMatcher and answers the queries on it """
+    matcher = NativeMatcher(cancel_epoch=cancel_epoch)
+    snapshot = FileSystemSnapshot()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        kind, payload = request
+        if kind == "load":
+            snapshot = FileSystemSnapshot(data=payload, timestamp=0)
+            matcher.load(snapshot)
+            conn.send(("ok", None))
+        elif kind == "patch":
+            # The diff of this shard, the matcher patches its state instead of starting over
+            snapshot = snapshot.apply(replace(payload, base=snapshot.generation), timestamp=0)
+            matcher.load(snapshot)
+            conn.send(("ok", None))
+        elif kind == "match":
+            query, limit, epoch = payload
+            try:
+                conn.send(("ok", matcher.ranked(query, limit, epoch)))
+            except MatchCancelledError:
+                conn.send(("cancelled", None))
+
+
+class ShardedMatcher(Matcher):
+    """
+    Native matching spread over CPU cores: the snapshot is split into contiguous shards, each one
+    sent once to a worker process that keeps it loaded, then every query runs on all the shards in
+    parallel and the per-shard best results are merged by fzf's sort key.
+    Only the query and the best 'limit' lines of each shard cross the process boundary, and a
+    snapshot derived from the loaded one by a diff only sends each shard its part of the diff.
+    """
+
+    def __init__(self, shards: Optional[int] = None) -> None:
+        self.shards = shards or os.cpu_count() or 1
+        # The forkserver doesn't duplicate the threads (and the state) of the extension process
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(method)
+        self._cancel_epoch = self._context.RawValue("q", 0)
+        self._lock = threading.Lock()
+        self._workers: List[Tuple[Any, Connection]] = []
+        self._bases: List[int] = []
+        self._snapshot: Optional[FileSystemSnapshot] = None
+
+    def _start_workers(self) -> None:
+        for _ in range(self.shards):
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(
+                target=_serve, args=(child_conn, self._cancel_epoch), name="sharded-matcher", daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self._workers.append((process, parent_conn))
+
+    def load(self, snapshot: FileSystemSnapshot) -> None:
+        with self._lock:
+            if snapshot is self._snapshot:
+                return
+            diff = snapshot.diff
+            if (
+                diff is not None
+                and self._snapshot is not None
+                and diff.base == self._snapshot.generation
+                and self._balanced(diff, len(snapshot.data))
+            ):
+                self._patch(diff)
+                self._snapshot = snapshot
+                return
+            if not self._workers:
+                self._start_workers()
+            bounds = split_shards(snapshot.data, len(self._workers))
+            # Workers without a shard get an empty one
+            bounds += [(len(snapshot.data), len(snapshot.data))] * (len(self._workers) - len(bounds))
+            for (_, conn), (start, end) in zip(self._workers, bounds):
+                conn.send(("load", snapshot.data[start:end]))
+            for _, conn in self._workers:
+                conn.recv()
+            self._bases = [start for start, _ in bounds]
+            self._snapshot = snapshot
+            logger.debug("Snapshot split in %d shards", len(bounds))
+
+    def _balanced(self, diff: SnapshotDiff, size: int) -> bool:
+        """ Whether the last shard, which gets the added lines, stays within twice the average shard size """
+        last_shard = len(self._snapshot.data) - self._bases[-1] + len(diff.added)
+        return last_shard <= 2 * size / len(self._workers)
+
+    def _patch(self, diff: SnapshotDiff) -> None:
+        """ Apply the diff shard by shard, the added lines go to the last one, called with the lock held """
+        ends = self._bases[1:] + [len(self._snapshot.data)]
+        bases, removed_before, patched = [], 0, []
+        for i, ((_, conn), start, end) in enumerate(zip(self._workers, self._bases, ends)):
+            first, last = bisect_left(diff.removed, start), bisect_left(diff.removed, end)
+            removed = array("Q", (offset - start for offset in diff.removed[first:last]))
+            removed_ends = array("Q", (offset - start for offset in diff.removed_ends[first:last]))
+            removed_bytes = sum(line_end - offset for offset, line_end in zip(removed, removed_ends))
+            is_last = i == len(self._workers) - 1
+            shard_diff = SnapshotDiff(
+                base=-1,
+                kept_bytes=end - start - removed_bytes,
+                removed=removed,
+                removed_ends=removed_ends,
+                added=diff.added if is_last else b"",
+                added_count=diff.added_count if is_last else 0,
+            )
+            if shard_diff:
+                conn.send(("patch", shard_diff))
+                patched.append(conn)
+            bases.append(start - removed_before)
+            removed_before += removed_bytes
+        for conn in patched:
+            conn.recv()
+        self._bases = bases
+        logger.debug("Snapshot diff applied to %d shards", len(patched))
+
+    def match(self, query: str, limit: int) -> List[str]:
+        epoch = self._cancel_epoch.value
+        with self._lock:
+            for _, conn in self._workers:
+                conn.send(("match", (query, limit, epoch)))
+            # Every answer is received, even after a cancellation, to keep the pipes in sync
+            answers = [conn.recv() for _, conn in self._workers]
+            bases = self._bases
+        if any(status == "cancelled" for status, _ in answers):
+            raise MatchCancelledError(query)
+
+        # Offsets are made global so that ties are still broken by input order
+        ranked = (
+            (score, length, base + offset, line)
+            for (_, results), base in zip(answers, bases)
+            for score, length, offset, line in results
+        )
+        return [line for _, _, _, line in heapq.nsmallest(limit, ranked)]
+
+    def cancel(self) -> None:
+        self._cancel_epoch.value += 1
+
+    def close(self) -> None:
+        with self._lock:
+            for process, conn in self._workers:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                conn.close()
+            for process, _ in self._workers:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+            self._workers, self._bases, self._snapshot = [], [], None
@@ -3,8 +3,10 @@ import logging
 from ulauncher.api.client.EventListener import EventListener
 from ulauncher.api.shared.event import PreferencesEvent, PreferencesUpdateEvent
 
-from main import FuzzyFinderExtension, Actions, SearchType
-from preferences.preferences import Preference, PathPreference, IntPreference, FloatPreference, KeywordPreference
+from main import FuzzyFinderExtension, Actions, SearchType, MatcherType, ScannerType
+from preferences.preferences import (
+    PathPreference, IntPreference, FloatPreference, KeywordPreference, ListPreference, SelectPreference
+)
 
 logger = logging.getLogger(__name__)
 
@@ -14,15 +16,23 @@ class PreferencesInitEventListener(EventListener):
     @staticmethod
     def add_secure_preferences(event: PreferencesEvent, extension: FuzzyFinderExtension):
         """ Preferences that do not cause errors (trusting ulauncher) """
-        prefs = {
-            "alt_enter_action": Actions(int(event.preferences["alt_enter_action"])),
-            "search_type": SearchType(int(event.preferences["search_type"])),
-            "allow_hidden": bool(int(event.preferences["allow_hidden"])),
-            "follow_symlinks": bool(int(event.preferences["follow_symlinks"])),
-            "trim_display_path": bool(int(event.preferences["trim_display_path"]))
+        parsers = {
+            "alt_enter_action": Actions,
+            "search_type": SearchType,
+            "matcher": MatcherType,
+            "scanner": ScannerType,
+            "allow_hidden": bool,
+            "follow_symlinks": bool,
+            "trim_display_path": bool,
+            "background_scan": bool,
+            "watch_filesystem": bool,
+            "cache_snapshot": bool,
+            "frecency": bool,
+            "debug_timings": bool
         }
-        for key, value in prefs.items():
-            extension.prefs[key] = Preference(name=key, value=value, mandatory=True)
+        for key, parser in parsers.items():
+            extension.prefs[key] = SelectPreference(name=key, parser=parser, mandatory=True)
+            extension.prefs[key].set(value=event.preferences[key], parse=True)
 
     @staticmethod
     def add_base_dir(event: PreferencesEvent, extension: FuzzyFinderExtension):
@@ -38,6 +48,13 @@ class PreferencesInitEventListener(EventListener):
         value = event.preferences[key] if key in event.preferences else None
         extension.prefs[key].set(value=value, parse=True)
 
+    @staticmethod
+    def add_roots_file(event: PreferencesEvent, extension: FuzzyFinderExtension):
+        key = "roots_file"
+        extension.prefs[key] = PathPreference(name=key, mandatory=False, is_dir=False)
+        value = event.preferences[key] if key in event.preferences else None
+        extension.prefs[key].set(value=value, parse=True)
+
     @staticmethod
     def add_result_limit(event: PreferencesEvent, extension: FuzzyFinderExtension):
         key = "result_limit"
@@ -46,6 +63,30 @@ class PreferencesInitEventListener(EventListener):
         value = event.preferences[key] if key in event.preferences else None
         extension.prefs[key].set(value=value, parse=True)
 
+    @staticmethod
+    def add_parallel_threshold(event: PreferencesEvent, extension: FuzzyFinderExtension):
+        key = "parallel_threshold"
+        constraint = lambda x: "value must be >= 0" if x < 0 else None
+        extension.prefs[key] = IntPreference(name=key, mandatory=True, constraints=[constraint])
+        value = event.preferences[key] if key in event.preferences else None
+        extension.prefs[key].set(value=value, parse=True)
+
+    @staticmethod
+    def add_scan_limits(event: PreferencesEvent, extension: FuzzyFinderExtension):
+        # 0 means no limit
+        for key in ["max_depth", "max_entries", "max_children"]:
+            constraint = lambda x: "value must be >= 0" if x < 0 else None
+            extension.prefs[key] = IntPreference(name=key, mandatory=True, constraints=[constraint])
+            value = event.preferences[key] if key in event.preferences else None
+            extension.prefs[key].set(value=value, parse=True)
+
+    @staticmethod
+    def add_excludes(event: PreferencesEvent, extension: FuzzyFinderExtension):
+        key = "excludes"
+        extension.prefs[key] = ListPreference(name=key, mandatory=False)
+        value = event.preferences[key] if key in event.preferences else None
+        extension.prefs[key].set(value=value, parse=True)
+
     @staticmethod
     def add_scan_period(event: PreferencesEvent, extension: FuzzyFinderExtension):
         key = "scan_period"
@@ -62,9 +103,25 @@ class PreferencesInitEventListener(EventListener):
         value = event.preferences[key] if key in event.preferences else None
         extension.prefs[key].set(value=value, parse=True)
 
+    @staticmethod
+    def add_content_timeout(event: PreferencesEvent, extension: FuzzyFinderExtension):
+        key = "content_timeout"
+        constraint = lambda x: "value must be > 0" if x <= 0 else None
+        extension.prefs[key] = FloatPreference(name=key, mandatory=False, constraints=[constraint])
+        value = event.preferences[key] if key in event.preferences else None
+        extension.prefs[key].set(value=value, parse=True)
+
+    @staticmethod
+    def add_debounce(event: PreferencesEvent, extension: FuzzyFinderExtension):
+        key = "debounce"
+        constraint = lambda x: "value must be >= 0" if x < 0 else None
+        extension.prefs[key] = FloatPreference(name=key, mandatory=True, constraints=[constraint])
+        value = event.preferences[key] if key in event.preferences else None
+        extension.prefs[key].set(value=value, parse=True)
+
     @staticmethod
     def add_keywords(event: PreferencesEvent, extension: FuzzyFinderExtension):
-        for key in ["fzf_kw", "term_kw"]:
+        for key in ["fzf_kw", "term_kw", "grep_kw"]:
             extension.prefs[key] = KeywordPreference(name=key, mandatory=True, keyword_id=key)
             value = event.preferences[key] if key in event.preferences else None
             extension.prefs[key].set(value=value, parse=False)
@@ -75,9 +132,15 @@ class PreferencesInitEventListener(EventListener):
         self.add_secure_preferences(event, extension)
         self.add_base_dir(event, extension)
         self.add_ignore_file(event, extension)
+        self.add_roots_file(event, extension)
         self.add_result_limit(event, extension)
+        self.add_parallel_threshold(event, extension)
+        self.add_scan_limits(event, extension)
+        self.add_excludes(event, extension)
         self.add_scan_period(event, extension)
         self.add_scan_timeout(event, extension)
+        self.add_content_timeout(event, extension)
+        self.add_debounce(event, extension)
         self.add_keywords(event, extension)
 
         # Register errors and warnings
@@ -99,9 +162,10 @@ class PreferencesInitEventListener(EventListener):
         # Store the reference to keywords preferences in another structure
         extension.keyword_prefs = [p for p in extension.prefs.values() if isinstance(p, KeywordPreference)]
 
-        # Generate commands after the preference setup
+        # Generate commands after the preference setup, then scan before the first query arrives
         extension.generate_fzf_cmd()
         extension.generate_fd_cmd()
+        extension.warm_up()
 
 
 # Event listener for the "PreferencesUpdateEvent"
@@ -124,5 +188,9 @@ class PreferencesUpdateEventListener(EventListener):
             extension.prefs_have_errors = True
             logger.error(f"'{event.id}' new_value '{event.new_value}' is not valid")
 
-        # Update fdfind command since it holds some user preferences
+        # Update fdfind command and matcher since they hold some user preferences. The matcher only
+        # depends on its own preference, replacing it would close the one used by running queries
+        if event.id == "matcher":
+            extension.generate_fzf_cmd()
         extension.generate_fd_cmd()
+        extension.warm_up()
@@ -84,6 +84,33 @@ class FloatPreference(IntPreference):
         return float(str_value)
 
 
+class SelectPreference(Preference):
+    def __init__(self, name: str, parser: Callable, value=None, mandatory=False):
+        """
+        :param parser: converts the option value sent by ulauncher (e.g. an enum or bool from "0")
+        """
+        super().__init__(name, value, mandatory)
+        self.parser = parser
+
+    def parse_from_str(self, str_value: str):
+        return self.parser(int(str_value))
+
+    def check_error(self, parsed_value) -> Optional[str]:
+        return None
+
+
+class ListPreference(Preference):
+    """ Comma-separated values, blank ones are dropped """
+
+    def parse_from_str(self, str_value: str):
+        if str_value is None:
+            return ()
+        return tuple(value.strip() for value in str_value.split(",") if value.strip())
+
+    def check_error(self, parsed_value) -> Optional[str]:
+        return None
+
+
 class KeywordPreference(Preference):
     def __init__(self, name: str, keyword_id: str, value=None, mandatory=False):
         super().__init__(name, value, mandatory)
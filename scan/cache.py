@@ -0,0 +1,116 @@
+import dataclasses
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from os import path
+from typing import Any, List, Optional
+
+from scan.snapshot import FileSystemSnapshot
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+_MAGIC = b"UFZF"
+# magic, version, key digest, scan timestamp, payload length, payload crc32
+_HEADER = struct.Struct("<4sH32sdQI")
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return path.join(cache_home, "ulauncher-fzf")
+
+
+class SnapshotCache:
+    """
+    On-disk copy of the latest snapshot, so that the first query after a restart can be served
+    without waiting for a scan. A cache file is only valid for the scan command, scan rules (and
+    ignore-file version) it was generated with, anything unexpected in it is treated as a cache miss.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    @staticmethod
+    def key(cmd: List[str], rules: Optional[Any] = None) -> bytes:
+        """
+        Digest of the scan command, including the modification time of its ignore-file
+        :param rules: dataclass of the scan rules the command was built from, some of them (e.g. the
+            maximum directory size) are applied to its output instead of being part of it
+        """
+        rule_fields = dataclasses.asdict(rules) if rules is not None else None
+        ignore_mtime = None
+        if "--ignore-file" in cmd:
+            try:
+                ignore_mtime = os.stat(cmd[cmd.index("--ignore-file") + 1]).st_mtime_ns
+            except (OSError, IndexError):
+                pass
+        return hashlib.sha256(json.dumps([cmd, rule_fields, ignore_mtime]).encode()).digest()
+
+    def _file_name(self, key: bytes) -> str:
+        return path.join(self.cache_dir, f"snapshot-{key.hex()[:16]}.bin")
+
+    def load(self, key: bytes) -> Optional[FileSystemSnapshot]:
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                snapshot = self._parse(data, key)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            logger.warning("Discarding unreadable snapshot cache '%s': %s", file_name, error)
+            self._remove(file_name)
+            return None
+
+        if snapshot is None:
+            logger.warning("Discarding invalid snapshot cache '%s'", file_name)
+            self._remove(file_name)
+        return snapshot
+
+    @staticmethod
+    def _parse(data: mmap.mmap, key: bytes) -> Optional[FileSystemSnapshot]:
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, digest, timestamp, length, crc = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != CACHE_VERSION or digest != key:
+            return None
+        if len(data) != _HEADER.size + length:
+            return None
+        payload = data[_HEADER.size:]
+        if zlib.crc32(payload) != crc:
+            return None
+        return FileSystemSnapshot(data=payload, timestamp=timestamp)
+
+    def save(self, key: bytes, snapshot: FileSystemSnapshot) -> None:
+        file_name = self._file_name(key)
+        payload = snapshot.data
+        header = _HEADER.pack(_MAGIC, CACHE_VERSION, key, snapshot.timestamp, len(payload), zlib.crc32(payload))
+        tmp_name = f"{file_name}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_name, "wb") as file:
+                file.write(header)
+                file.write(payload)
+            # Readers either see the old file or the complete new one
+            os.replace(tmp_name, file_name)
+        except OSError as error:
+            logger.warning("Unable to write snapshot cache '%s': %s", file_name, error)
+            self._remove(tmp_name)
+
+    def prune(self, keys: List[bytes]) -> None:
+        """ Only the caches of the current configuration (one per scanned root) are worth keeping """
+        keep = {self._file_name(key) for key in keys}
+        for old_file in glob.glob(path.join(self.cache_dir, "snapshot-*.bin")):
+            if old_file not in keep:
+                self._remove(old_file)
+
+    @staticmethod
+    def _remove(file_name: str) -> None:
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
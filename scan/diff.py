@@ -0,0 +1,265 @@
+import heapq
+import io
+import time
+from array import array
+from bisect import bisect_left
+from itertools import compress, count, islice, repeat
+from operator import eq, not_
+from typing import Iterator, List, Optional, Set, Tuple
+
+from scan.snapshot import FileSystemSnapshot, SnapshotDiff
+
+# Lines are hashed a chunk at a time, so that only the lines of one chunk exist as objects at once
+CHUNK_SIZE = 2**20
+# Approximate cost of a line in a set of hashes: the int object and its hash table slot
+SET_BYTES_PER_LINE = 64
+# Approximate cost of a line in a list of hashes: the int object and its pointer
+LIST_BYTES_PER_LINE = 40
+# Memory allowed to the sets of hashes, larger snapshots are compared one partition of hashes at a time
+DIFF_MEMORY_BUDGET = 32 * 2**20
+# Beyond this fraction of changed lines, the new output simply replaces the snapshot
+MAX_CHANGED_RATIO = 0.25
+
+
+def _line_hashes(data: bytes) -> array:
+    """ Hash of every line of 'data', which ends with a newline """
+    hashes = array("q")
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", min(start + CHUNK_SIZE, len(data)) - 1) + 1
+        lines = data[start:end].split(b"\n")
+        lines.pop()
+        hashes.extend(map(hash, lines))
+        start = end
+    return hashes
+
+
+def _iter_lines(data: bytes) -> Iterator[bytes]:
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start)
+        yield data[start:end]
+        start = end + 1
+
+
+def sort_lines(data: bytes) -> bytes:
+    """
+    Lines of 'data', which ends with a newline, sorted bytewise. Each chunk is sorted on its own
+    and the sorted chunks are merged, so that only the lines of one chunk exist as objects at once.
+    """
+    runs = []
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", min(start + CHUNK_SIZE, len(data)) - 1) + 1
+        lines = data[start:end].split(b"\n")
+        lines.pop()
+        lines.sort()
+        runs.append(b"\n".join(lines) + b"\n")
+        start = end
+    if len(runs) <= 1:
+        return runs[0] if runs else b""
+
+    merged = heapq.merge(*(_iter_lines(run) for run in runs))
+    outs = io.BytesIO()
+    while True:
+        lines = list(islice(merged, 2**16))
+        if not lines:
+            break
+        outs.write(b"\n".join(lines) + b"\n")
+    return outs.getvalue()
+
+
+def find_line(data: bytes, key: bytes, start: int, end: int) -> int:
+    """
+    Offset of the first line not lower than 'key' among the bytewise sorted lines of
+    data[start:end] ('end' if there is none), where both bounds are line boundaries
+    """
+    while start < end:
+        line = data.rfind(b"\n", start, (start + end) // 2) + 1 or start
+        line_end = data.find(b"\n", line)
+        if data[line:line_end] < key:
+            start = line_end + 1
+        else:
+            end = line
+    return start
+
+
+def _changed_hashes(
+    old_hashes: array, new_hashes: array, partitions: int, limit: int
+) -> Optional[Tuple[Set[int], Set[int]]]:
+    """
+    Hashes of the removed and of the added lines, None if there are more than 'limit' of them.
+    Each partition is a range of hash values, so that only its sets exist at a time.
+    """
+    removed: Set[int] = set()
+    added: Set[int] = set()
+    step = -(-2**64 // partitions)
+    for low in range(-2**63, 2**63, step):
+        # Filtered by a builtin, without any Python code run per line
+        in_partition = range(low, low + step).__contains__
+        old_set = set(filter(in_partition, old_hashes))
+        new_set = set(filter(in_partition, new_hashes))
+        removed |= old_set - new_set
+        added |= new_set - old_set
+        del old_set, new_set
+        if len(removed) + len(added) > limit:
+            return None
+    return removed, added
+
+
+def _indexes(hashes: array, selected: Set[int]) -> List[int]:
+    return list(compress(count(), map(selected.__contains__, hashes)))
+
+
+def diff_snapshot(
+    snapshot: FileSystemSnapshot,
+    data: bytes,
+    memory_budget: int = DIFF_MEMORY_BUDGET,
+    max_changed_ratio: float = MAX_CHANGED_RATIO,
+) -> Optional[SnapshotDiff]:
+    """
+    Changes turning 'snapshot' into the output of a new scan, whatever the order of its lines (fd
+    lists the entries of a tree in a different order on every run). Lines are compared by hash,
+    the extra memory is about 16 bytes per line (the hashes of both sides) plus 'memory_budget'.
+    None when there are too many changes for a diff to pay off, or when the outputs can't be diffed.
+    """
+    start = time.perf_counter()
+    old = snapshot.data
+    if data == old:
+        return SnapshotDiff(base=snapshot.generation, kept_bytes=len(old), duration=time.perf_counter() - start)
+    if not old or not old.endswith(b"\n") or not data.endswith(b"\n"):
+        return None
+
+    old_hashes, new_hashes = _line_hashes(old), _line_hashes(data)
+    lines = max(len(old_hashes), len(new_hashes))
+    # Two sets, of the old and of the new hashes of a partition
+    partitions = max(1, -(-lines * 2 * SET_BYTES_PER_LINE // memory_budget))
+    changed = _changed_hashes(old_hashes, new_hashes, partitions, int(lines * max_changed_ratio))
+    if changed is None:
+        return None
+    removed, added = _indexes(old_hashes, changed[0]), _indexes(new_hashes, changed[1])
+    del old_hashes, new_hashes
+
+    old_offsets = snapshot.offsets
+    removed_offsets = array("Q", (old_offsets[i] for i in removed))
+    removed_ends = array("Q", (old_offsets[i + 1] if i + 1 < len(old_offsets) else len(old) for i in removed))
+    new_lines = FileSystemSnapshot(data=data)
+    added_lines = b"".join(bytes(new_lines.view(new_lines.offsets[i])) + b"\n" for i in added)
+    kept_bytes = len(old) - sum(end - offset for offset, end in zip(removed_offsets, removed_ends))
+    if kept_bytes + len(added_lines) != len(data):
+        # Hash collision or duplicated lines
+        return None
+    return SnapshotDiff(
+        base=snapshot.generation,
+        kept_bytes=kept_bytes,
+        removed=removed_offsets,
+        removed_ends=removed_ends,
+        added=added_lines,
+        added_count=len(added),
+        duration=time.perf_counter() - start,
+    )
+
+
+def _sorted_hashes(hashes: array, memory_budget: int) -> array:
+    """ 'hashes' sorted, a range of hash values at a time so that only its list exists at once """
+    partitions = max(1, -(-len(hashes) * LIST_BYTES_PER_LINE // memory_budget))
+    sorted_hashes = array("q")
+    step = -(-2**64 // partitions)
+    for low in range(-2**63, 2**63, step):
+        sorted_hashes.extend(sorted(filter(range(low, low + step).__contains__, hashes)))
+    return sorted_hashes
+
+
+class StreamingDiff(io.RawIOBase):
+    """
+    Writable diffing a scan output against 'snapshot' while it's streamed, so that the output is
+    never held in full: the lines of the snapshot are checked off by hash, only the other ones are
+    kept, as added lines. The extra memory is about 9 bytes per line of the snapshot (its sorted
+    hashes and their marks) plus the added lines, and 8 more bytes per line while finishing.
+    """
+
+    def __init__(self, snapshot: FileSystemSnapshot, memory_budget: int = DIFF_MEMORY_BUDGET):
+        super().__init__()
+        started = time.perf_counter()
+        self.snapshot = snapshot
+        self.lines = 0
+        self._memory_budget = memory_budget
+        self._hashes = _sorted_hashes(_line_hashes(snapshot.data), memory_budget)
+        # Found by the hashes past the last one, a hash equal to it shows up as a collision
+        self._hashes.append(2**63 - 1)
+        self._seen = bytearray(len(self._hashes))
+        self._added = io.BytesIO()
+        self._added_count = 0
+        self._size = 0
+        # Start of a line not terminated yet
+        self._partial = b""
+        self._duration = time.perf_counter() - started
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, chunk: bytes) -> int:  # type: ignore[override]
+        started = time.perf_counter()
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        hashes = array("q", map(hash, lines))
+        sorted_hashes = self._hashes
+        positions = list(map(bisect_left, repeat(sorted_hashes), hashes))
+        found = list(map(eq, map(sorted_hashes.__getitem__, positions), hashes))
+        seen = self._seen
+        for position in compress(positions, found):
+            seen[position] = 1
+        added = list(compress(lines, map(not_, found)))
+        if added:
+            self._added.write(b"\n".join(added) + b"\n")
+            self._added_count += len(added)
+        self.lines += len(lines)
+        self._size += len(chunk)
+        self._duration += time.perf_counter() - started
+        return len(chunk)
+
+    def finish(
+        self, timestamp: float, max_changed_ratio: float = MAX_CHANGED_RATIO
+    ) -> Optional[Tuple[FileSystemSnapshot, Optional[SnapshotDiff]]]:
+        """
+        Snapshot of the streamed output: the snapshot itself when nothing changed, otherwise its
+        next generation and the diff it was patched with, or a new snapshot (and no diff) when there
+        are too many changes for a diff to pay off. None when the output can't be rebuilt from the
+        snapshot (an unterminated last line, duplicated lines or a hash collision).
+        """
+        started = time.perf_counter()
+        snapshot, sorted_hashes, seen = self.snapshot, self._hashes, self._seen
+        if self._partial:
+            return None
+        # Lines of the snapshot whose hash wasn't checked off
+        old_hashes = _line_hashes(snapshot.data)
+        if seen.count(0) * SET_BYTES_PER_LINE <= self._memory_budget:
+            removed = _indexes(old_hashes, set(compress(sorted_hashes, map(not_, seen))))
+        else:
+            positions = map(bisect_left, repeat(sorted_hashes), old_hashes)
+            removed = list(compress(count(), map(not_, map(seen.__getitem__, positions))))
+        del self._hashes, self._seen, sorted_hashes, seen, old_hashes
+
+        old, old_offsets = snapshot.data, snapshot.offsets
+        removed_offsets = array("Q", (old_offsets[i] for i in removed))
+        removed_ends = array("Q", (old_offsets[i + 1] if i + 1 < len(old_offsets) else len(old) for i in removed))
+        kept_bytes = len(old) - sum(end - offset for offset, end in zip(removed_offsets, removed_ends))
+        added = self._added.getvalue()
+        self._added = io.BytesIO()
+        if kept_bytes + len(added) != self._size:
+            # Hash collision or duplicated lines
+            return None
+        diff = SnapshotDiff(
+            base=snapshot.generation,
+            kept_bytes=kept_bytes,
+            removed=removed_offsets,
+            removed_ends=removed_ends,
+            added=added,
+            added_count=self._added_count,
+            duration=self._duration + time.perf_counter() - started,
+        )
+        if not diff:
+            return snapshot, diff
+        if len(removed) + self._added_count > max(len(old_offsets), self.lines) * max_changed_ratio:
+            return FileSystemSnapshot(data=diff.patch(old), timestamp=timestamp), None
+        return snapshot.apply(diff, timestamp), diff
@@ -0,0 +1,34 @@
+import threading
+import time
+from collections import OrderedDict
+from os import path
+from typing import Tuple
+
+
+class FileTypeCache:
+    """
+    Whether paths are directories, for the entries whose type wasn't captured by the scan.
+    Answers are reused for 'ttl' seconds, so rendering the same results again issues no syscall.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_size: int = 4096) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # path -> (expiration time, is a directory), least recently added first
+        self._entries: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()
+
+    def is_dir(self, path_name: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path_name)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        is_dir = path.isdir(path_name)
+        with self._lock:
+            self._entries[path_name] = (now + self.ttl, is_dir)
+            self._entries.move_to_end(path_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return is_dir
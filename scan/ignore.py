@@ -0,0 +1,111 @@
+import logging
+import re
+from typing import List, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+IgnorePattern = Tuple[Pattern, bool, bool]  # (regex, negated, directories only)
+
+
+class IgnoreRules:
+    """
+    Matcher for ignore-files in '.gitignore' format, applied to paths relative to the search root.
+    As in git, the last pattern matching a path decides whether it is ignored.
+    """
+
+    def __init__(self, lines: List[str]):
+        self.patterns: List[IgnorePattern] = []
+        for line in lines:
+            pattern = self._compile(line)
+            if pattern is not None:
+                self.patterns.append(pattern)
+
+    @classmethod
+    def from_file(cls, file_name: Optional[str]) -> "IgnoreRules":
+        if file_name is None:
+            return cls([])
+        try:
+            with open(file_name, encoding="utf-8", errors="replace") as file:
+                return cls(file.read().splitlines())
+        except OSError as error:
+            logger.warning("Unable to read ignore-file '%s': %s", file_name, error)
+            return cls([])
+
+    @staticmethod
+    def _compile(line: str) -> Optional[IgnorePattern]:
+        if line.endswith("\\ "):
+            line = line.rstrip() + " "
+        else:
+            line = line.rstrip()
+        if not line or line.startswith("#"):
+            return None
+
+        negated = line.startswith("!")
+        if negated or line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            return None
+
+        regex, i = "", 0
+        while i < len(line):
+            if line.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif line.startswith("/**", i) and i + 3 == len(line):
+                regex += "/.*"
+                i += 3
+            elif line.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif line[i] == "*":
+                regex += "[^/]*"
+                i += 1
+            elif line[i] == "?":
+                regex += "[^/]"
+                i += 1
+            elif line[i] == "[" and "]" in line[i + 2:]:
+                end = line.index("]", i + 2)
+                content = line[i + 1:end].replace("\\", "\\\\")
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                regex += f"[{content}]"
+                i = end + 1
+            elif line[i] == "\\" and i + 1 < len(line):
+                regex += re.escape(line[i + 1])
+                i += 2
+            else:
+                regex += re.escape(line[i])
+                i += 1
+
+        prefix = "^" if anchored else "^(?:.*/)?"
+        return re.compile(prefix + regex + "$"), negated, dir_only
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """ Check a single path, callers are expected to have already pruned ignored parents """
+        return bool(self.match(rel_path, is_dir))
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """ Whether the last pattern matching a path ignores it, None if no pattern matches it """
+        ignored = None
+        for regex, negated, dir_only in self.patterns:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                ignored = not negated
+        return ignored
+
+
+# Ignore files read in every directory and its parents, in increasing order of precedence.
+# As in fd, '.gitignore' files only apply inside git repositories.
+GIT_IGNORE_FILE = ".gitignore"
+IGNORE_FILES = (".ignore", ".fdignore")
+
+# (directory, its ignore file rules), outermost first
+IgnoreChain = Tuple[Tuple[str, IgnoreRules], ...]
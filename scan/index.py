@@ -0,0 +1,558 @@
+import logging
+import os
+import stat
+import subprocess
+import threading
+import time
+from array import array
+from dataclasses import dataclass, replace
+from os import path
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+
+from scan.cache import SnapshotCache
+from scan.ignore import GIT_IGNORE_FILE, IGNORE_FILES, IgnoreChain, IgnoreRules
+from scan.prune import PruneStats, prune_crowded
+from scan.diff import StreamingDiff, find_line, sort_lines
+from scan.refresher import SnapshotRefresher
+from scan.snapshot import FileSystemSnapshot, SnapshotDiff, decode, encode
+from scan.watcher import (
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_IGNORED,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    InotifyEvent,
+    InotifyWatcher,
+    WatchLimitError,
+    inotify_available,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lines added by filesystem events are appended to the sorted ones, past this many bytes (or this
+# share of the snapshot) the whole snapshot is sorted again
+MIN_UNSORTED_BYTES = 2**20
+MAX_UNSORTED_RATIO = 0.125
+# Entries whose creation or deletion changes what's ignored below their directory
+_RESCAN_NAMES = frozenset((GIT_IGNORE_FILE, ".git") + IGNORE_FILES)
+
+
+@dataclass(frozen=True)
+class ScanRules:
+    """ The user preferences encoded in the fd command, needed to filter filesystem events """
+
+    base_dir: str
+    files: bool = True
+    dirs: bool = True
+    allow_hidden: bool = False
+    follow_symlinks: bool = False
+    ignore_file: Optional[str] = None
+    # Scan limits, None for no limit
+    max_depth: Optional[int] = None
+    excludes: Tuple[str, ...] = ()
+    max_entries: Optional[int] = None
+    max_children: Optional[int] = None
+
+
+class IncrementalIndex(SnapshotRefresher):
+    """
+    Snapshot refresher that, after a full scan, keeps the snapshot up to date by applying inotify
+    create/delete/move events instead of rescanning the whole tree every 'scan_period' seconds.
+    While watching, the snapshot lines are kept sorted (except the ones added since the last sort,
+    at its end), so that the entries below a deleted directory are found by bisection without
+    decoding the snapshot. Each batch of events is published by the watcher thread as the diff of
+    a new snapshot generation, queries never wait for it.
+    When inotify is unavailable, its watch limit is exhausted or its event queue overflows,
+    it falls back to the periodic rescans of SnapshotRefresher.
+    """
+
+    def __init__(self, cache: Optional[SnapshotCache] = None) -> None:
+        super().__init__(cache)
+        self._rules: Optional[ScanRules] = None
+        self._ignore = IgnoreRules([])
+        self._excludes = IgnoreRules([])
+        # Watched directory -> the ignore files that apply to its entries, and whether it's in a git repository
+        self._ignore_chains: Dict[str, Tuple[IgnoreChain, bool]] = {}
+        # Directories (with a trailing "/") whose contents are left out for having too many children
+        self._crowded: Set[str] = set()
+        self._prune_stats: Optional[PruneStats] = None
+        # Crowded directories skipped by the last native scan, and their number of children
+        self._skipped: Tuple[Tuple[str, ...], int] = ((), 0)
+        self._watch = False
+        self._watch_exhausted = False
+        self._watching = False
+        self._stop_event = threading.Event()
+        self._wds: Dict[int, str] = {}
+        # Generation of the watched snapshot and the end of its sorted lines
+        self._sorted: Tuple[int, int] = (-1, 0)
+        self._dir_suffix = ""
+
+    @property
+    def watching(self) -> bool:
+        return self._watching
+
+    @property
+    def prune_stats(self) -> Optional[PruneStats]:
+        """ What the last full scan left out """
+        return self._prune_stats
+
+    def set_command(self, cmd: List[str], rules: Optional[ScanRules] = None, watch: bool = False) -> None:
+        watch = watch and rules is not None and inotify_available()
+        with self._lock:
+            if cmd == self._cmd and rules == self._rules and watch == self._watch:
+                return
+            self._stop_watching()
+            self._rules = rules
+            self._watch = watch
+            self._watch_exhausted = False
+            if cmd == self._cmd:
+                # Only the rules applied after the scan (e.g. max_children) or the watching changed:
+                # the current snapshot is served while a full scan, which also sets up the watches, runs.
+                # A scan already running uses the old rules, its result is dropped.
+                self._generation += 1
+                self._snapshot.timestamp = min(self._snapshot.timestamp, 0)
+                self._cache_key = self._key_for(cmd)
+                self._failure = None
+                return
+        super().set_command(cmd)
+
+    def _key_for(self, cmd: List[str]) -> Optional[bytes]:
+        return self.cache.key(cmd, self._rules) if self.cache is not None else None
+
+    def close(self) -> None:
+        """ Stop watching, the index is no longer used """
+        with self._lock:
+            self._watch = False
+            self._stop_watching()
+
+    def refresh(
+        self, scan_period: float, timeout: Optional[float], background: bool = True
+    ) -> FileSystemSnapshot:
+        if not self._watching:
+            return super().refresh(scan_period, timeout, background)
+        # Kept up to date by the watcher thread
+        return self._snapshot
+
+    def _stream_diff(self, cmd: List[str], previous: FileSystemSnapshot) -> Optional[StreamingDiff]:
+        from scan.native import NATIVE_SCANNER
+
+        rules = self._rules
+        if rules is not None and rules.max_children and cmd[0] != NATIVE_SCANNER:
+            # Crowded directories are found in the whole output of fd
+            return None
+        return super()._stream_diff(cmd, previous)
+
+    def _run_scan(self, cmd: List[str], kill_timeout: Optional[float], outs: BinaryIO) -> None:
+        # Imported here since scan.native depends on this module
+        from scan.native import NATIVE_SCANNER, NativeScanner
+
+        if cmd[0] != NATIVE_SCANNER:
+            super()._run_scan(cmd, kill_timeout, outs)
+            return
+        scanner = NativeScanner(self._rules)
+        scanner.scan_into(outs, kill_timeout)
+        self._skipped = (tuple(scanner.crowded_dirs), scanner.skipped)
+
+    def _prune(self, outs: bytes) -> bytes:
+        rules = self._rules
+        if rules is None:
+            return outs
+        outs, stats = prune_crowded(outs, rules.base_dir, rules.max_children, rules.max_entries)
+        self._record(stats)
+        return outs
+
+    def _streamed(self, entries: int) -> None:
+        rules = self._rules
+        if rules is not None:
+            max_entries = rules.max_entries
+            self._record(PruneStats(entries=entries, truncated=max_entries is not None and entries >= max_entries))
+
+    def _record(self, stats: PruneStats) -> None:
+        # The native scanner doesn't descend into crowded directories in the first place
+        crowded_dirs, skipped = self._skipped
+        if crowded_dirs:
+            stats = replace(stats, crowded_dirs=stats.crowded_dirs + crowded_dirs, dropped=stats.dropped + skipped)
+        self._skipped = ((), 0)
+        self._crowded = {dir_name + "/" for dir_name in stats.crowded_dirs}
+        self._prune_stats = stats
+        logger.info("Scan of '%s': %s", self._rules.base_dir, stats)
+
+    def _scan(self, cmd: List[str], kill_timeout: Optional[float]) -> None:
+        super()._scan(cmd, kill_timeout)
+        if self._watch and not self._watch_exhausted and self._error is None and not self._outdated:
+            self._start_watching(cmd)
+
+    @staticmethod
+    def _dirs_cmd(cmd: List[str]) -> List[str]:
+        """ Same fd command (and filters) as 'cmd', restricted to the directories to be watched """
+        dirs_cmd = []
+        args = iter(cmd)
+        for arg in args:
+            # Every directory is watched, even the ones beyond the maximum number of entries
+            if arg in ("--type", "--max-results"):
+                next(args, None)
+                continue
+            dirs_cmd.append(arg)
+        return dirs_cmd + ["--type", "d"]
+
+    def _list_dirs(self, cmd: List[str]) -> bytes:
+        from scan.native import NATIVE_SCANNER, NativeScanner
+
+        if cmd[0] == NATIVE_SCANNER:
+            return NativeScanner(replace(self._rules, files=False, dirs=True, max_entries=None)).scan()
+        return subprocess.run(self._dirs_cmd(cmd), stdout=subprocess.PIPE, check=True).stdout
+
+    def _start_watching(self, cmd: List[str]) -> None:
+        rules = self._rules
+        started = time.time()
+        try:
+            outs = self._list_dirs(cmd)
+        except (OSError, subprocess.SubprocessError) as error:
+            logger.warning("Unable to list directories to watch, using periodic scans: %s", error)
+            return
+
+        try:
+            watcher = InotifyWatcher()
+        except OSError as error:
+            logger.warning("Unable to create a filesystem watcher, using periodic scans: %s", error)
+            self._watch_exhausted = True
+            return
+
+        wds: Dict[int, str] = {}
+        try:
+            for dir_name in [rules.base_dir] + decode(outs).split("\n"):
+                if not dir_name or self._in_crowded_dir(dir_name):
+                    continue
+                dir_name = dir_name.rstrip("/") or "/"
+                try:
+                    wds[watcher.add_watch(dir_name, rules.follow_symlinks)] = dir_name
+                except WatchLimitError:
+                    raise
+                except OSError as error:
+                    logger.debug("Unable to watch '%s': %s", dir_name, error)
+        except WatchLimitError:
+            watcher.close()
+            self._watch_exhausted = True
+            logger.warning(
+                "inotify watch limit reached after %d directories, falling back to periodic scans", len(wds)
+            )
+            return
+
+        # Sorted once, the lines added by events are then appended to it
+        snapshot = self._snapshot
+        sorted_snapshot = FileSystemSnapshot(data=sort_lines(snapshot.data), timestamp=snapshot.timestamp)
+        dir_suffix = "/" if sorted_snapshot.marks_dirs else ""
+        with self._lock:
+            if self._scan_generation != self._generation or not self._watch or self._snapshot is not snapshot:
+                watcher.close()
+                return
+            self._snapshot = sorted_snapshot
+            self._last_diff = None
+            self._sorted = (sorted_snapshot.generation, len(sorted_snapshot.data))
+            self._dir_suffix = dir_suffix
+            self._ignore = IgnoreRules.from_file(rules.ignore_file)
+            self._excludes = IgnoreRules(list(rules.excludes))
+            self._ignore_chains = {}
+            self._wds = wds
+            self._stop_event = threading.Event()
+            self._watching = True
+            threading.Thread(
+                target=self._watch_loop, args=(watcher, self._stop_event), name="snapshot-watcher", daemon=True
+            ).start()
+        logger.debug("Watching %d directories (set up in %.3f s)", len(wds), time.time() - started)
+
+    def _stop_watching(self, rescan: bool = False) -> None:
+        """ Called with the lock held, 'rescan' forces a full scan while the current snapshot is served """
+        if not self._watching:
+            return
+        self._watching = False
+        self._stop_event.set()
+        self._wds = {}
+        if rescan:
+            self._snapshot.timestamp = 0
+
+    def _fall_back(self, stop_event: threading.Event) -> None:
+        """ Stop watching from the watcher thread, periodic scans take over """
+        with self._lock:
+            if not stop_event.is_set():
+                self._stop_watching(rescan=True)
+
+    def _watch_loop(self, watcher: InotifyWatcher, stop_event: threading.Event) -> None:
+        try:
+            while not stop_event.is_set():
+                events = watcher.read_events(timeout=1.0)
+                if events:
+                    self._apply_events(watcher, events, stop_event)
+        except OSError as error:
+            logger.error("Filesystem watcher failed, falling back to periodic scans: %s", error)
+            self._fall_back(stop_event)
+        finally:
+            watcher.close()
+
+    def _apply_events(self, watcher: InotifyWatcher, events: List[InotifyEvent], stop_event: threading.Event) -> None:
+        """ Turn a batch of events into the next snapshot generation, called from the watcher thread """
+        base_dir = self._rules.base_dir.rstrip("/") or "/"
+        removed: Set[str] = set()
+        added: Dict[str, None] = {}
+        try:
+            for event in events:
+                if event.mask & IN_Q_OVERFLOW:
+                    logger.warning("inotify event queue overflowed, running a full scan")
+                    self._fall_back(stop_event)
+                    return
+                parent = self._wds.get(event.wd)
+                if parent is None:
+                    continue
+                if event.mask & IN_IGNORED:
+                    del self._wds[event.wd]
+                    continue
+                if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if parent == base_dir:
+                        logger.warning("Base directory '%s' was moved or deleted, running a full scan", parent)
+                        self._fall_back(stop_event)
+                        return
+                    continue
+
+                if event.name in _RESCAN_NAMES:
+                    # The ignore rules of a whole tree may have changed, as after 'git init'
+                    logger.info("'%s' changed in '%s', running a full scan", event.name, parent)
+                    self._fall_back(stop_event)
+                    return
+                full_path = path.join(parent, event.name)
+                if event.mask & (IN_DELETE | IN_MOVED_FROM):
+                    removed.add(full_path)
+                    if added:
+                        self._discard_tree(added, full_path)
+                    if event.is_dir:
+                        self._forget_dir(watcher, full_path, moved=bool(event.mask & IN_MOVED_FROM))
+                elif event.mask & (IN_CREATE | IN_MOVED_TO) and not self._is_excluded(full_path, event.is_dir):
+                    self._add_tree(watcher, full_path, added)
+        except WatchLimitError:
+            logger.warning("inotify watch limit reached, falling back to periodic scans")
+            self._watch_exhausted = True
+            self._fall_back(stop_event)
+            return
+        if removed or added:
+            self._publish(removed, added, stop_event)
+
+    def _publish(self, removed: Set[str], added: Dict[str, None], stop_event: threading.Event) -> None:
+        """ Publish the next snapshot generation, without the 'removed' trees and with the 'added' entries """
+        start = time.perf_counter()
+        snapshot = self._snapshot
+        generation, sorted_end = self._sorted
+        if generation != snapshot.generation:
+            sorted_end = 0
+        data = snapshot.data
+
+        # Offset -> end of the removed lines: a removed path, with or without the directory suffix,
+        # and the range of the sorted lines below it
+        removed_lines: Dict[int, int] = {}
+        roots = self._outermost(removed)
+        for root in roots:
+            line = find_line(data, root, 0, sorted_end)
+            if data.startswith(root + b"\n", line):
+                removed_lines[line] = line + len(root) + 1
+            line = find_line(data, root + b"/", line, sorted_end)
+            end = find_line(data, root + b"0", line, sorted_end)
+            while line < end:
+                line_end = data.find(b"\n", line) + 1
+                removed_lines[line] = line_end
+                line = line_end
+
+        # The unsorted lines are checked one by one
+        unsorted: Set[bytes] = set()
+        root_set = set(roots)
+        line = sorted_end
+        while line < len(data):
+            line_end = data.find(b"\n", line) + 1
+            entry = data[line:line_end - 1]
+            if root_set and self._in_tree(entry.rstrip(b"/"), root_set):
+                removed_lines[line] = line_end
+            else:
+                unsorted.add(entry)
+            line = line_end
+
+        max_entries = self._rules.max_entries
+        entries = data.count(b"\n") - len(removed_lines) if max_entries is not None else 0
+        added_lines = []
+        for entry in map(encode, added):
+            if entry in unsorted:
+                continue
+            line = find_line(data, entry, 0, sorted_end)
+            if data.startswith(entry + b"\n", line) and line not in removed_lines:
+                continue
+            if max_entries is not None and entries >= max_entries:
+                break
+            added_lines.append(entry + b"\n")
+            entries += 1
+        if not removed_lines and not added_lines:
+            return
+
+        offsets = sorted(removed_lines)
+        ends = [removed_lines[offset] for offset in offsets]
+        diff = SnapshotDiff(
+            base=snapshot.generation,
+            kept_bytes=len(data) - sum(ends) + sum(offsets),
+            removed=array("Q", offsets),
+            removed_ends=array("Q", ends),
+            added=b"".join(added_lines),
+            added_count=len(added_lines),
+            duration=time.perf_counter() - start,
+        )
+        sorted_end -= sum(end - offset for offset, end in removed_lines.items() if offset < sorted_end)
+        timestamp = time.time()
+        next_snapshot: FileSystemSnapshot = snapshot.apply(diff, timestamp)
+        unsorted_bytes = len(next_snapshot.data) - sorted_end
+        if unsorted_bytes > max(MIN_UNSORTED_BYTES, len(next_snapshot.data) * MAX_UNSORTED_RATIO):
+            # A generation that can't be patched, as after a full scan
+            next_snapshot = FileSystemSnapshot(data=sort_lines(next_snapshot.data), timestamp=timestamp)
+            diff, sorted_end = None, len(next_snapshot.data)
+        with self._lock:
+            # Replaced when watching stopped
+            if stop_event.is_set() or self._snapshot is not snapshot:
+                return
+            self._snapshot = next_snapshot
+            self._last_diff = diff
+            self._sorted = (next_snapshot.generation, sorted_end)
+        logger.debug("Filesystem changes: %s", diff if diff is not None else "snapshot sorted again")
+
+    @staticmethod
+    def _outermost(paths: Set[str]) -> List[bytes]:
+        """ Encoded 'paths', without the ones below another one """
+        outermost: List[str] = []
+        for path_name in sorted(paths):
+            if not outermost or not path_name.startswith(outermost[-1] + "/"):
+                outermost.append(path_name)
+        return [encode(path_name) for path_name in outermost]
+
+    @staticmethod
+    def _in_tree(entry: bytes, roots: Set[bytes]) -> bool:
+        """ Whether 'entry' is one of 'roots' or below one of them """
+        while entry:
+            if entry in roots:
+                return True
+            entry = entry.rpartition(b"/")[0]
+        return False
+
+    @staticmethod
+    def _discard_tree(added: Dict[str, None], root: str) -> None:
+        """ Drop from 'added' the entries of a tree removed in the same batch """
+        prefix = root + "/"
+        for key in [key for key in added if key == root or key.startswith(prefix)]:
+            del added[key]
+
+    def _forget_dir(self, watcher: InotifyWatcher, root: str, moved: bool) -> None:
+        prefix = root + "/"
+        if self._crowded:
+            self._crowded = {dir_name for dir_name in self._crowded if not dir_name.startswith(prefix)}
+        for dir_name in list(self._ignore_chains):
+            if dir_name == root or dir_name.startswith(prefix):
+                del self._ignore_chains[dir_name]
+        if not moved:
+            # The kernel drops the watches of deleted directories itself (IN_IGNORED)
+            return
+        # The watches of a moved directory follow it out of the tree
+        for wd, dir_name in list(self._wds.items()):
+            if dir_name == root or dir_name.startswith(prefix):
+                watcher.rm_watch(wd)
+                del self._wds[wd]
+
+    def _in_crowded_dir(self, full_path: str) -> bool:
+        return any(full_path.startswith(dir_name) for dir_name in self._crowded)
+
+    def _is_excluded(self, full_path: str, is_dir: bool) -> bool:
+        """ Apply the filters and limits of fd to a path, its parent is expected to be included """
+        rules = self._rules
+        if not rules.allow_hidden and path.basename(full_path).startswith("."):
+            return True
+        rel_path = path.relpath(full_path, rules.base_dir)
+        if rules.max_depth is not None and rel_path.count("/") >= rules.max_depth:
+            return True
+        if self._crowded and self._in_crowded_dir(full_path):
+            return True
+        if self._excludes and self._excludes.is_ignored(rel_path, is_dir):
+            return True
+        # As in the native scanner, the innermost ignore files take precedence, then the ignore-file
+        ignores, _ = self._ignore_chain(path.dirname(full_path))
+        for dir_name, dir_rules in reversed(ignores):
+            ignored = dir_rules.match(full_path[len(dir_name.rstrip("/")) + 1:], is_dir)
+            if ignored is not None:
+                return ignored
+        return bool(self._ignore) and self._ignore.is_ignored(rel_path, is_dir)
+
+    def _ignore_chain(self, dir_name: str) -> Tuple[IgnoreChain, bool]:
+        """ Ignore files that apply to the entries of 'dir_name', read as fd and the native scanner do """
+        chain = self._ignore_chains.get(dir_name)
+        if chain is not None:
+            return chain
+        from scan.native import NativeScanner
+
+        base_dir = self._rules.base_dir.rstrip("/") or "/"
+        if len(dir_name) <= len(base_dir):
+            ignores, in_repo = NativeScanner(self._rules)._parent_ignores()
+            dir_name = base_dir
+        else:
+            ignores, in_repo = self._ignore_chain(path.dirname(dir_name))
+        in_repo = in_repo or path.exists(path.join(dir_name, ".git"))
+        names = [name for name in NativeScanner._ignore_file_names(in_repo) if path.isfile(path.join(dir_name, name))]
+        chain = (ignores + tuple(NativeScanner._read_ignore_files(dir_name, names)), in_repo)
+        self._ignore_chains[dir_name] = chain
+        return chain
+
+    def _classify(self, full_path: str) -> Optional[Tuple[bool, bool]]:
+        """ Return (is_dir, is_file) as fd would see the path, None if it vanished already """
+        try:
+            info = os.stat(full_path) if self._rules.follow_symlinks else os.lstat(full_path)
+        except OSError:
+            return None
+        return stat.S_ISDIR(info.st_mode), stat.S_ISREG(info.st_mode)
+
+    def _add_entry(self, added: Dict[str, None], full_path: str, is_dir: bool, is_file: bool) -> None:
+        rules = self._rules
+        if (is_dir and rules.dirs) or (is_file and rules.files) or (rules.files and rules.dirs):
+            added[full_path + self._dir_suffix if is_dir else full_path] = None
+
+    def _add_tree(self, watcher: InotifyWatcher, root: str, added: Dict[str, None]) -> None:
+        kind = self._classify(root)
+        if kind is None:
+            return
+        self._add_entry(added, root, *kind)
+        if not kind[0]:
+            return
+
+        follow = self._rules.follow_symlinks
+        visited = set()
+        stack = [root]
+        while stack:
+            dir_name = stack.pop()
+            try:
+                self._wds[watcher.add_watch(dir_name, follow)] = dir_name
+                entries = list(os.scandir(dir_name))
+            except WatchLimitError:
+                raise
+            except OSError:
+                continue
+            if self._rules.max_children is not None and len(entries) > self._rules.max_children:
+                # Don't descend, as done after full scans
+                self._crowded.add(dir_name + "/")
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=follow)
+                    is_file = entry.is_file(follow_symlinks=follow)
+                    if is_dir and follow:
+                        # Protect from symlink loops
+                        info = entry.stat()
+                        if (info.st_dev, info.st_ino) in visited:
+                            continue
+                        visited.add((info.st_dev, info.st_ino))
+                except OSError:
+                    continue
+                if self._is_excluded(entry.path, is_dir):
+                    continue
+                self._add_entry(added, entry.path, is_dir, is_file)
+                if is_dir:
+                    stack.append(entry.path)
@@ -0,0 +1,188 @@
+import io
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from os import path
+from typing import BinaryIO, List, Optional, Set, Tuple
+
+from scan.ignore import GIT_IGNORE_FILE, IGNORE_FILES, IgnoreChain, IgnoreRules
+from scan.index import ScanRules
+from scan.snapshot import decode
+
+logger = logging.getLogger(__name__)
+
+# Stands for the binary in the command of native scans, which is otherwise built like the fd one
+NATIVE_SCANNER = "native-scanner"
+# (directory, depth of its entries, ignore files that apply to it, whether it's in a git repository)
+DirTask = Tuple[bytes, int, IgnoreChain, bool]
+
+
+class NativeScanner:
+    """
+    fd replacement walking the tree with os.scandir, one directory per task of a thread pool
+    (readdir and stat release the GIL). Paths stay bytes from the system calls to the snapshot,
+    directories end with "/" like in the output of fd 9.
+    The scan rules are applied as fd does: hidden files, symbolic links (with loop detection),
+    the ignore-file, '.gitignore', '.ignore' and '.fdignore' files, excludes and limits. Global
+    git excludes and '.git/info/exclude' are not read.
+    """
+
+    def __init__(self, rules: ScanRules, workers: Optional[int] = None):
+        self.rules = rules
+        # Mostly waiting for the filesystem, so more threads than cores
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self._excludes = IgnoreRules(list(rules.excludes))
+        self._ignore = IgnoreRules.from_file(rules.ignore_file)
+        self._lock = threading.Lock()
+        self._stop = False
+        self._visited: Set[Tuple[int, int]] = set()
+        # Directories not descended for having more than 'max_children' children, and how many they had
+        self.crowded_dirs: List[str] = []
+        self.skipped = 0
+
+    def scan(self, timeout: Optional[float] = None) -> bytes:
+        """
+        Return the scanned paths, one per line
+        :raises subprocess.TimeoutExpired: after 'timeout' seconds, as for an fd command
+        """
+        # Written into a single growing buffer, joining a list of chunks would need twice the memory
+        outs = io.BytesIO()
+        self.scan_into(outs, timeout)
+        return outs.getvalue()
+
+    def scan_into(self, outs: BinaryIO, timeout: Optional[float] = None) -> None:
+        """ Write the scanned paths to 'outs', one per line, a directory at a time """
+        rules = self.rules
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        base_dir = os.fsencode(rules.base_dir)
+        if rules.follow_symlinks:
+            info = os.stat(base_dir)
+            self._visited.add((info.st_dev, info.st_ino))
+        ignores, in_repo = self._parent_ignores()
+
+        entries = 0
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="native-scanner") as pool:
+            pending: Set[Future] = {pool.submit(self._scan_dir, (base_dir, 1, ignores, in_repo))}
+            try:
+                while pending:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                    if not done:
+                        raise subprocess.TimeoutExpired(self._description(), timeout)
+                    for future in done:
+                        chunk, subdirs = future.result()
+                        if rules.max_entries is not None and entries + chunk.count(b"\n") >= rules.max_entries:
+                            lines = chunk.split(b"\n", rules.max_entries - entries)[: rules.max_entries - entries]
+                            outs.write(b"\n".join(lines) + b"\n" if lines else b"")
+                            return
+                        outs.write(chunk)
+                        entries += chunk.count(b"\n")
+                        pending.update(pool.submit(self._scan_dir, task) for task in subdirs)
+            finally:
+                self._stop = True
+                for future in pending:
+                    future.cancel()
+
+    def _description(self) -> List[str]:
+        return [NATIVE_SCANNER, self.rules.base_dir]
+
+    def _parent_ignores(self) -> Tuple[IgnoreChain, bool]:
+        """ The ignore files of the parents of the base directory, and whether it's in a git repository """
+        dir_name = path.abspath(self.rules.base_dir)
+        parents = []
+        while path.dirname(dir_name) != dir_name:
+            dir_name = path.dirname(dir_name)
+            parents.append(dir_name)
+        parents.reverse()
+        repo_root = max((i for i, d in enumerate(parents) if path.exists(path.join(d, ".git"))), default=None)
+
+        ignores: List[Tuple[str, IgnoreRules]] = []
+        for i, dir_name in enumerate(parents):
+            in_repo = repo_root is not None and i >= repo_root
+            names = [name for name in self._ignore_file_names(in_repo) if path.isfile(path.join(dir_name, name))]
+            ignores.extend(self._read_ignore_files(dir_name, names))
+        return tuple(ignores), repo_root is not None
+
+    @staticmethod
+    def _ignore_file_names(in_repo: bool) -> Tuple[str, ...]:
+        return (GIT_IGNORE_FILE,) + IGNORE_FILES if in_repo else IGNORE_FILES
+
+    @staticmethod
+    def _read_ignore_files(dir_name: str, names: List[str]) -> List[Tuple[str, IgnoreRules]]:
+        rules = [IgnoreRules.from_file(path.join(dir_name, name)) for name in names]
+        return [(dir_name, file_rules) for file_rules in rules if file_rules]
+
+    def _is_ignored(self, full_path: str, is_dir: bool, ignores: IgnoreChain) -> bool:
+        base_dir = self.rules.base_dir.rstrip("/")
+        rel_path = full_path[len(base_dir) + 1:]
+        if self._excludes and self._excludes.is_ignored(rel_path, is_dir):
+            return True
+        # The innermost ignore files take precedence, then the ignore-file of the preferences
+        for dir_name, rules in reversed(ignores):
+            ignored = rules.match(full_path[len(dir_name.rstrip("/")) + 1:], is_dir)
+            if ignored is not None:
+                return ignored
+        return bool(self._ignore) and self._ignore.is_ignored(rel_path, is_dir)
+
+    def _scan_dir(self, task: DirTask) -> Tuple[bytes, List[DirTask]]:
+        """ List a directory, return its entries as lines and the subdirectories to scan """
+        dir_path, depth, ignores, in_repo = task
+        if self._stop:
+            return b"", []
+        try:
+            with os.scandir(dir_path) as iterator:
+                entries = list(iterator)
+        except OSError as error:
+            logger.debug("Unable to scan '%s': %s", decode(dir_path), error)
+            return b"", []
+
+        rules = self.rules
+        # The base directory is never considered crowded
+        if rules.max_children is not None and depth > 1 and len(entries) > rules.max_children:
+            with self._lock:
+                self.crowded_dirs.append(decode(dir_path))
+                self.skipped += len(entries)
+            return b"", []
+
+        names = {entry.name for entry in entries}
+        in_repo = in_repo or b".git" in names
+        ignore_files = [name for name in self._ignore_file_names(in_repo) if os.fsencode(name) in names]
+        if ignore_files:
+            ignores += tuple(self._read_ignore_files(decode(dir_path), ignore_files))
+        check_ignored = bool(ignores) or bool(self._excludes) or bool(self._ignore)
+        follow = rules.follow_symlinks
+        descend = rules.max_depth is None or depth < rules.max_depth
+
+        lines: List[bytes] = []
+        subdirs: List[DirTask] = []
+        for entry in entries:
+            if not rules.allow_hidden and entry.name.startswith(b"."):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=follow)
+                is_file = entry.is_file(follow_symlinks=follow)
+            except OSError:
+                continue
+            if check_ignored and self._is_ignored(decode(entry.path), is_dir, ignores):
+                continue
+            if (is_dir and rules.dirs) or (is_file and rules.files) or (rules.files and rules.dirs):
+                lines.append(entry.path + b"/" if is_dir else entry.path)
+            if is_dir and descend and (not follow or self._first_visit(entry)):
+                subdirs.append((entry.path, depth + 1, ignores, in_repo))
+        return b"\n".join(lines) + b"\n" if lines else b"", subdirs
+
+    def _first_visit(self, entry: os.DirEntry) -> bool:
+        """ Protect from symbolic link loops, every directory is entered once """
+        try:
+            info = entry.stat()
+        except OSError:
+            return False
+        key = (info.st_dev, info.st_ino)
+        with self._lock:
+            if key in self._visited:
+                return False
+            self._visited.add(key)
+            return True
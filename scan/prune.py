@@ -0,0 +1,87 @@
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional, Set, Tuple
+
+from scan.snapshot import decode
+
+# Parent directory of an output line, directories may end with "/"
+_PARENT = re.compile(rb"^(.*)/[^/\n]+/?$", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class PruneStats:
+    """ What a scan left out because of the limits of its root """
+
+    # Entries in the snapshot
+    entries: int
+    # Directories whose children were dropped because they had more than 'max_children' of them
+    crowded_dirs: Tuple[str, ...] = ()
+    # Entries dropped after the scan (or direct children never listed by the native scanner) and the
+    # snapshot bytes (plus offsets) of the dropped ones
+    dropped: int = 0
+    saved_bytes: int = 0
+    # Whether the scan stopped at 'max_entries'
+    truncated: bool = False
+    # Seconds spent looking for crowded directories
+    prune_time: float = 0.0
+
+    def __str__(self) -> str:
+        parts = [f"{self.entries} entries"]
+        if self.truncated:
+            parts.append("truncated at the maximum number of entries")
+        if self.crowded_dirs:
+            parts.append(
+                f"{self.dropped} entries ({self.saved_bytes / 2**20:.1f} MiB) of {len(self.crowded_dirs)} crowded "
+                f"directories dropped in {self.prune_time:.3f} s"
+            )
+        return ", ".join(parts)
+
+
+def prune_crowded(
+    outs: bytes, base_dir: str, max_children: Optional[int], max_entries: Optional[int] = None
+) -> Tuple[bytes, PruneStats]:
+    """
+    Drop the contents of the directories with more than 'max_children' children from a scan output,
+    for scanners (like fd) that can't stop descending into them. 'base_dir' is never pruned.
+    """
+    entries = outs.count(b"\n")
+    truncated = max_entries is not None and entries >= max_entries
+    if not max_children or not outs:
+        return outs, PruneStats(entries=entries, truncated=truncated)
+
+    start = time.perf_counter()
+    base = base_dir.rstrip("/").encode()
+    children = Counter(_PARENT.findall(outs))
+    crowded = {
+        parent for parent, count in children.items() if count > max_children and parent.rstrip(b"/") != base
+    }
+    if not crowded:
+        return outs, PruneStats(entries=entries, truncated=truncated, prune_time=time.perf_counter() - start)
+
+    # Crowded directories nested in other crowded ones go away with their ancestor
+    outermost = sorted(parent for parent in crowded if not _has_ancestor(parent, crowded))
+    descendants = re.compile(
+        rb"^(?:" + b"|".join(re.escape(parent) for parent in outermost) + rb")/.+\n", re.MULTILINE
+    )
+    pruned, dropped = descendants.subn(b"", outs)
+    # Plus the 4-byte offset of every entry
+    saved_bytes = len(outs) - len(pruned) + dropped * 4
+    return pruned, PruneStats(
+        entries=entries - dropped,
+        crowded_dirs=tuple(decode(parent) for parent in outermost),
+        dropped=dropped,
+        saved_bytes=saved_bytes,
+        truncated=truncated,
+        prune_time=time.perf_counter() - start,
+    )
+
+
+def _has_ancestor(dir_name: bytes, dirs: Set[bytes]) -> bool:
+    parent = dir_name.rpartition(b"/")[0]
+    while parent:
+        if parent in dirs:
+            return True
+        parent = parent.rpartition(b"/")[0]
+    return False
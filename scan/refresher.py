@@ -0,0 +1,288 @@
+import io
+import logging
+import shutil
+import subprocess
+import threading
+import time
+from typing import BinaryIO, List, Optional, Tuple
+
+from scan.cache import SnapshotCache
+from scan.diff import StreamingDiff, diff_snapshot
+from scan.snapshot import FileSystemSnapshot, SnapshotDiff
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at once from the output of a scan
+READ_SIZE = 2**20
+
+
+class ScanPendingError(Exception):
+    """ Raised when no snapshot is available yet and the first scan is still running """
+
+    def __init__(self, cmd: List[str], timeout: Optional[float]):
+        super().__init__(f"Scan '{' '.join(cmd)}' still running after {timeout} seconds")
+        self.cmd = cmd
+        self.timeout = timeout
+
+
+class SnapshotRefresher:
+    """
+    Keeps the filesystem snapshot warm by running the scan command in a background thread.
+    Queries always read the most recent finished snapshot, a new one is swapped in atomically
+    as soon as its scan completes.
+    When a cache is set, finished snapshots are persisted and restored on a command change.
+    The output of a scan is diffed against the current snapshot while it's streamed, instead of being
+    held in full: a scan that found no changes keeps the current snapshot (and everything derived
+    from it), otherwise the next generation is built by patching the current one, so that its users
+    can patch their state too.
+    A failed scan is not retried before the scan period runs out.
+    """
+
+    def __init__(self, cache: Optional[SnapshotCache] = None) -> None:
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._snapshot = FileSystemSnapshot()
+        self._cmd: Optional[List[str]] = None
+        self._cache_key: Optional[bytes] = None
+        self._thread: Optional[threading.Thread] = None
+        self._done = threading.Event()
+        self._error: Optional[Exception] = None
+        # Bumped when the command, or how its output is handled, changes: a scan started before is outdated
+        self._generation = 0
+        self._scan_generation = 0
+        # Whether the last scan finished after such a change, so its result was dropped
+        self._outdated = False
+        # When the last scan failed, and why
+        self._failure: Optional[Tuple[float, Exception]] = None
+        self._scan_duration: Optional[float] = None
+        self._last_diff: Optional[SnapshotDiff] = None
+
+    @property
+    def snapshot(self) -> FileSystemSnapshot:
+        return self._snapshot
+
+    @property
+    def cache(self) -> Optional[SnapshotCache]:
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache: Optional[SnapshotCache]) -> None:
+        """ A new cache gets the current snapshot right away, there may be no scan to save it for a while """
+        with self._lock:
+            was_cached = self._cache is not None
+            self._cache = cache
+            self._cache_key = self._key_for(self._cmd) if self._cmd is not None else None
+            snapshot, cache_key = self._snapshot, self._cache_key
+        if cache is not None and not was_cached and cache_key is not None and not snapshot.is_cold:
+            threading.Thread(target=cache.save, args=(cache_key, snapshot), name="snapshot-cache", daemon=True).start()
+
+    @property
+    def scan_duration(self) -> Optional[float]:
+        """ Seconds taken by the last successful scan """
+        return self._scan_duration
+
+    @property
+    def last_diff(self) -> Optional[SnapshotDiff]:
+        """ Changes found by the last successful scan, None when its output replaced the snapshot """
+        return self._last_diff
+
+    @property
+    def cache_key(self) -> Optional[bytes]:
+        return self._cache_key
+
+    def set_command(self, cmd: List[str]) -> None:
+        """ A different scan command makes the current snapshot meaningless, so drop it """
+        with self._lock:
+            if cmd == self._cmd:
+                return
+
+        cache = self.cache
+        cache_key = self._key_for(cmd)
+        # A stale cached snapshot is served while the refresh runs
+        snapshot = cache.load(cache_key) if cache is not None else None
+        with self._lock:
+            self._cmd = cmd
+            self._generation += 1
+            self._cache_key = cache_key
+            self._failure = None
+            if snapshot is not None:
+                logger.debug("Scan command changed, using the cached snapshot from %s", time.ctime(snapshot.timestamp))
+                self._snapshot = snapshot
+            else:
+                logger.debug("Scan command changed, discarding the current snapshot")
+                self._snapshot = FileSystemSnapshot()
+
+    def _key_for(self, cmd: List[str]) -> Optional[bytes]:
+        """ Cache key of the snapshots of a scan command """
+        return self.cache.key(cmd) if self.cache is not None else None
+
+    def refresh(
+        self, scan_period: float, timeout: Optional[float], background: bool = True
+    ) -> FileSystemSnapshot:
+        """
+        Return a snapshot usable by a query, starting a new scan if the current one is stale.
+        :param scan_period: seconds a snapshot is considered fresh
+        :param timeout: seconds a query is allowed to wait for a scan
+        :param background: serve the stale snapshot while the refresh runs (stale-while-revalidate),
+            otherwise wait for the refresh and kill it on timeout
+        """
+        snapshot = self._snapshot
+        elapsed = time.time() - snapshot.timestamp
+        if not snapshot.is_cold and elapsed < scan_period:
+            logger.debug(f"Reusing previous snapshot - elapsed_time ({elapsed}) < refresh_period ({scan_period})")
+            return snapshot
+
+        failure = self._failure
+        if failure is not None and time.time() - failure[0] < scan_period:
+            # Back off instead of starting a scan on every query
+            if not snapshot.is_cold:
+                return snapshot
+            raise failure[1]
+
+        logger.debug(f"Updating snapshot - elapsed time ({elapsed}) >= refresh_period ({scan_period})")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            if background:
+                self._start_scan(kill_timeout=None)
+                if not snapshot.is_cold:
+                    return snapshot
+            elif self._start_scan(kill_timeout=remaining):
+                # The scan kills itself on timeout and reports it as an error
+                remaining = None
+
+            # Nothing to serve (or the caller asked for fresh results): wait for the running scan
+            self._wait(remaining)
+            snapshot = self._snapshot
+            if not self._outdated and not snapshot.is_cold:
+                return snapshot
+            # The command changed while scanning and the result was dropped, scan for the current one
+            logger.debug("Scan command changed while scanning, scanning again")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise ScanPendingError(self._cmd or [], timeout)
+
+    def _wait(self, timeout: Optional[float]) -> None:
+        if not self._done.wait(timeout):
+            raise ScanPendingError(self._cmd or [], timeout)
+        error = self._error
+        if error is not None:
+            raise error
+
+    def _start_scan(self, kill_timeout: Optional[float]) -> bool:
+        """ Start a scan unless one is already running, return whether a new one was started """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._done.clear()
+            self._error = None
+            self._outdated = False
+            self._scan_generation = self._generation
+            self._thread = threading.Thread(
+                target=self._scan, args=(self._cmd, kill_timeout), name="snapshot-refresher", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _scan(self, cmd: List[str], kill_timeout: Optional[float]) -> None:
+        timestamp = time.time()
+        previous = self._snapshot
+        streamed = None
+        try:
+            stream = self._stream_diff(cmd, previous)
+            if stream is not None:
+                self._run_scan(cmd, kill_timeout, stream)
+                streamed = stream.finish(timestamp)
+                if streamed is None:
+                    logger.warning("Scan output can't be diffed (duplicated lines?), scanning again")
+                else:
+                    self._streamed(stream.lines)
+            if streamed is None:
+                buffer = io.BytesIO()
+                self._run_scan(cmd, kill_timeout, buffer)
+                # No copy, the buffer becomes the output
+                outs = buffer.getvalue()
+                del buffer
+        except (OSError, subprocess.SubprocessError) as error:
+            logger.error("Scan '%s' failed: %s", " ".join(cmd), error)
+            with self._lock:
+                self._outdated = self._scan_generation != self._generation
+                if not self._outdated:
+                    self._error = error
+                    self._failure = (time.time(), error)
+            self._done.set()
+            return
+
+        duration = time.time() - timestamp
+        logger.debug("Scan completed in %.3f s", duration)
+        if streamed is not None:
+            snapshot, diff = streamed
+            if diff:
+                logger.debug("Scan changes: %s", diff)
+        else:
+            outs = self._prune(outs)
+            diff = diff_snapshot(previous, outs)
+            if diff is None:
+                snapshot = FileSystemSnapshot(data=outs, timestamp=timestamp)
+            elif diff:
+                logger.debug("Scan changes: %s", diff)
+                # The scan output is released before the next generation is built
+                del outs
+                snapshot = previous.apply(diff, timestamp)
+            else:
+                snapshot = previous
+        with self._lock:
+            # The command may have changed while scanning, in that case this result is outdated
+            outdated = self._outdated = self._scan_generation != self._generation
+            if not outdated:
+                if self._snapshot is not previous:
+                    # Replaced while scanning, the diff doesn't apply
+                    diff, snapshot = None, FileSystemSnapshot(data=snapshot.data, timestamp=timestamp)
+                elif snapshot is previous:
+                    previous.timestamp = timestamp
+                self._swap(snapshot)
+                self._scan_duration = duration
+                self._last_diff = diff
+                self._failure = None
+            cache, cache_key = self.cache, self._cache_key
+        self._done.set()
+
+        # Unless nothing changed, the cached copy would only miss the newer timestamp
+        if not outdated and cache is not None and cache_key is not None and (diff is None or diff):
+            cache.save(cache_key, snapshot)
+
+    def _stream_diff(self, cmd: List[str], previous: FileSystemSnapshot) -> Optional[StreamingDiff]:
+        """ Where the output of a scan is streamed to be diffed against 'previous', None to get it in full """
+        return StreamingDiff(previous) if previous.data.endswith(b"\n") else None
+
+    @staticmethod
+    def _run_scan(cmd: List[str], kill_timeout: Optional[float], outs: BinaryIO) -> None:
+        # The output is kept as bytes, entries are decoded only when needed. It's streamed into
+        # 'outs' as it's read: communicate() holds all the chunks read and then their concatenation.
+        fd_process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        timed_out = threading.Event()
+
+        def kill() -> None:
+            timed_out.set()
+            fd_process.kill()
+
+        timer = threading.Timer(kill_timeout, kill) if kill_timeout is not None else None
+        if timer is not None:
+            timer.start()
+        with fd_process:
+            shutil.copyfileobj(fd_process.stdout, outs, READ_SIZE)
+            fd_process.wait()
+        if timer is not None:
+            timer.cancel()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, kill_timeout)
+
+    def _prune(self, outs: bytes) -> bytes:
+        """ Filter the output of a finished scan before it's published, called without the lock """
+        return outs
+
+    def _streamed(self, entries: int) -> None:
+        """ Called instead of _prune() for an output diffed while streamed, with its number of entries """
+
+    def _swap(self, snapshot: FileSystemSnapshot) -> None:
+        """ Publish the snapshot of a finished scan, called with the lock held """
+        self._snapshot = snapshot
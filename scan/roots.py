@@ -0,0 +1,372 @@
+import json
+import logging
+import subprocess
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from itertools import accumulate
+from os import path
+from typing import Dict, List, Optional, Tuple
+
+from scan.cache import SnapshotCache
+from scan.index import IncrementalIndex, ScanRules
+from scan.prune import PruneStats
+from scan.refresher import ScanPendingError
+from scan.snapshot import FileSystemSnapshot, SnapshotDiff
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TYPES = {"both": (True, True), "files": (True, False), "dirs": (False, True)}
+# Past this many runs of lines of a root scattered in the merged snapshot, it's rebuilt in root order
+MAX_ROOT_SEGMENTS = 32
+
+# A run of lines of a root snapshot: its start and end in the root data, and its start in the merged data
+Segment = Tuple[int, int, int]
+
+
+@dataclass(frozen=True)
+class ScanRoot:
+    """ A directory to be scanned, with its own scan policy """
+
+    rules: ScanRules
+    cmd: Tuple[str, ...]
+    scan_period: float
+    scan_timeout: Optional[float] = None
+
+
+def build_fd_cmd(fd_bin: str, rules: ScanRules) -> Tuple[str, ...]:
+    cmd = [fd_bin, ".", rules.base_dir]
+    if not rules.dirs:
+        cmd.extend(["--type", "f"])
+    elif not rules.files:
+        cmd.extend(["--type", "d"])
+
+    if rules.allow_hidden:
+        cmd.extend(["--hidden"])
+
+    if rules.follow_symlinks:
+        cmd.extend(["--follow"])
+
+    if rules.ignore_file is not None:
+        cmd.extend(["--ignore-file", rules.ignore_file])
+
+    if rules.max_depth is not None:
+        cmd.extend(["--max-depth", str(rules.max_depth)])
+    for pattern in rules.excludes:
+        cmd.extend(["--exclude", pattern])
+    if rules.max_entries is not None:
+        cmd.extend(["--max-results", str(rules.max_entries)])
+    # fd can't skip crowded directories (max_children), their contents are dropped from its output
+    return tuple(cmd)
+
+
+def load_roots(file_name: str, fd_bin: str, default: ScanRoot) -> List[ScanRoot]:
+    """
+    Read the roots listed in a JSON file, options missing from a root are taken from 'default':
+        [{"path": "~/projects", "search_type": "files", "allow_hidden": true, "follow_symlinks": false,
+          "ignore_file": "~/.fdignore", "scan_period": 60, "scan_timeout": 10, "max_depth": 8,
+          "excludes": ["node_modules", ".cache"], "max_entries": 500000, "max_children": 5000}, ...]
+    A limit of 0 (or null) removes the default one.
+    :raises ValueError: if the file can't be read or is malformed
+    """
+    try:
+        with open(file_name, encoding="utf-8") as file:
+            entries = json.load(file)
+    except (OSError, json.JSONDecodeError) as error:
+        raise ValueError(f"unable to read roots file: {error}")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("roots file must contain a non-empty list of roots")
+
+    roots: List[ScanRoot] = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get("path"), str):
+            raise ValueError(f"root #{i} must be an object with a 'path'")
+        base_dir = path.expanduser(entry["path"])
+        if not path.isdir(base_dir):
+            raise ValueError(f"root #{i}: '{base_dir}' is not a directory")
+        if any(root.rules.base_dir == base_dir for root in roots):
+            raise ValueError(f"root #{i}: '{base_dir}' is listed more than once")
+        search_type = entry.get("search_type")
+        if search_type is not None and search_type not in SEARCH_TYPES:
+            raise ValueError(f"root #{i}: search_type must be one of {', '.join(SEARCH_TYPES)}")
+        files, dirs = SEARCH_TYPES[search_type] if search_type else (default.rules.files, default.rules.dirs)
+        ignore_file = entry.get("ignore_file", default.rules.ignore_file)
+        excludes = entry.get("excludes", list(default.rules.excludes))
+        if not isinstance(excludes, list) or not all(isinstance(pattern, str) for pattern in excludes):
+            raise ValueError(f"root #{i}: excludes must be a list of glob patterns")
+        limits = {}
+        for key in ["max_depth", "max_entries", "max_children"]:
+            limit = entry.get(key, getattr(default.rules, key))
+            if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+                raise ValueError(f"root #{i}: {key} must be a non-negative integer")
+            limits[key] = limit or None
+
+        rules = replace(
+            default.rules,
+            base_dir=base_dir,
+            files=files,
+            dirs=dirs,
+            allow_hidden=bool(entry.get("allow_hidden", default.rules.allow_hidden)),
+            follow_symlinks=bool(entry.get("follow_symlinks", default.rules.follow_symlinks)),
+            ignore_file=path.expanduser(ignore_file) if ignore_file else None,
+            excludes=tuple(excludes),
+            **limits,
+        )
+        try:
+            scan_period = float(entry.get("scan_period", default.scan_period))
+            scan_timeout = entry.get("scan_timeout", default.scan_timeout)
+            scan_timeout = float(scan_timeout) if scan_timeout is not None else None
+        except (TypeError, ValueError):
+            raise ValueError(f"root #{i}: scan_period and scan_timeout must be numbers")
+        roots.append(
+            ScanRoot(rules=rules, cmd=build_fd_cmd(fd_bin, rules), scan_period=scan_period, scan_timeout=scan_timeout)
+        )
+    return roots
+
+
+class MultiRootIndex:
+    """
+    One IncrementalIndex per root, refreshed concurrently and merged into a single snapshot.
+    A root that times out or fails is left out of the results instead of failing the query.
+    In background mode, the roots still running their first scan are only waited for when no root
+    is ready, and only until the first of them is.
+    The changes found in the roots are merged into a diff of the merged snapshot, so matchers
+    patch their state instead of rebuilding it on every change of any root.
+    """
+
+    def __init__(self) -> None:
+        self._roots: List[ScanRoot] = []
+        self._indexes: Dict[str, IncrementalIndex] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._merged_from: Tuple[FileSystemSnapshot, ...] = ()
+        self._merged = FileSystemSnapshot()
+        # Where the lines of each root of '_merged_from' are in the merged snapshot
+        self._segments: Tuple[List[Segment], ...] = ()
+
+    @property
+    def roots(self) -> List[ScanRoot]:
+        return self._roots
+
+    @property
+    def scan_duration(self) -> Optional[float]:
+        """ Seconds taken by the last scan of the slowest root """
+        durations = [index.scan_duration for index in self._indexes.values() if index.scan_duration is not None]
+        return max(durations) if durations else None
+
+    @property
+    def prune_stats(self) -> Dict[str, PruneStats]:
+        """ What the last scan of every root left out, by base directory """
+        return {
+            base_dir: index.prune_stats for base_dir, index in self._indexes.items() if index.prune_stats is not None
+        }
+
+    @property
+    def last_diffs(self) -> Dict[str, SnapshotDiff]:
+        """ Changes found by the last scan of every root that was patched (or kept) instead of replaced """
+        return {
+            base_dir: index.last_diff for base_dir, index in self._indexes.items() if index.last_diff is not None
+        }
+
+    def is_dir(self, path_name: str) -> Optional[bool]:
+        """ Type of an entry as known from its scan, without any syscall (None when unknown) """
+        if path_name.endswith("/"):
+            return True
+        root, root_length = None, -1
+        for candidate in self._roots:
+            # The innermost root holding the entry
+            base_dir = candidate.rules.base_dir.rstrip("/") + "/"
+            if path_name.startswith(base_dir) and len(base_dir) > root_length:
+                root, root_length = candidate, len(base_dir)
+        if root is None:
+            return None
+        if root.rules.files != root.rules.dirs:
+            # Only one type was scanned
+            return root.rules.dirs
+        index = self._indexes.get(root.rules.base_dir)
+        if index is not None and index.snapshot.marks_dirs and not root.rules.follow_symlinks:
+            # Followed, a symbolic link to a directory may be listed without the mark
+            return False
+        return None
+
+    def index(self, root: ScanRoot) -> IncrementalIndex:
+        return self._indexes[root.rules.base_dir]
+
+    def set_roots(self, roots: List[ScanRoot], watch: bool = False, cache: bool = False) -> None:
+        indexes = {}
+        for root in roots:
+            base_dir = root.rules.base_dir
+            index = self._indexes.pop(base_dir, None) or IncrementalIndex()
+            index.cache = SnapshotCache() if cache else None
+            index.set_command(list(root.cmd), root.rules, watch=watch)
+            indexes[base_dir] = index
+        for index in self._indexes.values():
+            index.close()
+        self._indexes = indexes
+        self._roots = roots
+
+        keys = [index.cache_key for index in indexes.values() if index.cache is not None]
+        if cache and keys:
+            SnapshotCache().prune(keys)
+        if len(roots) > 1 and (self._pool is None or self._pool._max_workers != len(roots)):
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(max_workers=len(roots), thread_name_prefix="root-refresh")
+
+    def refresh(self, background: bool = True) -> FileSystemSnapshot:
+        if len(self._roots) == 1:
+            root = self._roots[0]
+            return self.index(root).refresh(root.scan_period, root.scan_timeout, background)
+
+        snapshots, errors = [], []
+        roots = self._roots
+        if background:
+            # Serve the ready roots right away, the others keep scanning in background
+            pending = []
+            for root in roots:
+                try:
+                    snapshots.append(self.index(root).refresh(root.scan_period, 0, background))
+                except ScanPendingError:
+                    pending.append(root)
+                except (OSError, subprocess.SubprocessError) as error:
+                    logger.warning("Skipping root '%s': %s", root.rules.base_dir, error)
+                    errors.append(error)
+            if snapshots:
+                for root in pending:
+                    logger.info("Skipping root '%s': first scan still running", root.rules.base_dir)
+                return self._merge(tuple(snapshots))
+            if not pending:
+                raise errors[0]
+            roots = pending
+
+        # Roots are refreshed (and waited for) concurrently, each one with its own timeout
+        futures: Dict[Future, ScanRoot] = {
+            self._pool.submit(self.index(root).refresh, root.scan_period, root.scan_timeout, background): root
+            for root in roots
+        }
+        ready: Dict[str, FileSystemSnapshot] = {}
+        pending = set(futures)
+        while pending and not (background and ready):
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root = futures[future]
+                try:
+                    ready[root.rules.base_dir] = future.result()
+                except ScanPendingError as error:
+                    logger.info("Skipping root '%s': %s", root.rules.base_dir, error)
+                    errors.append(error)
+                except (OSError, subprocess.SubprocessError) as error:
+                    logger.warning("Skipping root '%s': %s", root.rules.base_dir, error)
+                    errors.append(error)
+        for future in pending:
+            logger.info("Skipping root '%s': first scan still running", futures[future].rules.base_dir)
+        snapshots += [ready[root.rules.base_dir] for root in roots if root.rules.base_dir in ready]
+        if not snapshots:
+            raise errors[0]
+        return self._merge(tuple(snapshots))
+
+    def _merge(self, snapshots: Tuple[FileSystemSnapshot, ...]) -> FileSystemSnapshot:
+        timestamp = min(snapshot.timestamp for snapshot in snapshots)
+        # Rebuild only when a root snapshot changed, so matchers keep their per-snapshot state
+        unchanged = len(snapshots) == len(self._merged_from) and all(
+            new is old for new, old in zip(snapshots, self._merged_from)
+        )
+        if unchanged:
+            # Roots rescanned without changes keep their snapshot, only its timestamp moves on
+            self._merged.timestamp = timestamp
+            return self._merged
+
+        merged = self._merged_diff(snapshots)
+        if merged is not None:
+            diff, self._segments = merged
+            logger.debug("Merged changes: %s", diff)
+            self._merged = self._merged.apply(diff, timestamp)
+        else:
+            data = b"".join(snapshot.data for snapshot in snapshots)
+            self._merged = FileSystemSnapshot(data=data, timestamp=timestamp)
+            starts = accumulate((len(snapshot.data) for snapshot in snapshots), initial=0)
+            self._segments = tuple(
+                [(0, len(snapshot.data), start)] if snapshot.data else [] for snapshot, start in zip(snapshots, starts)
+            )
+        self._merged_from = snapshots
+        return self._merged
+
+    def _merged_diff(
+        self, snapshots: Tuple[FileSystemSnapshot, ...]
+    ) -> Optional[Tuple[SnapshotDiff, Tuple[List[Segment], ...]]]:
+        """
+        Diff of the merged snapshot built from the diffs of the changed roots, and where the lines of
+        every root end up. None when a root was replaced (or added, or left out) and the merged
+        snapshot has to be rebuilt.
+        The lines removed from a root are mapped through its segments, the lines it added are
+        appended to the merged data as a new segment of the root.
+        """
+        if self._merged.is_cold or len(snapshots) != len(self._merged_from):
+            return None
+        diffs: List[Optional[SnapshotDiff]] = []
+        for new, old in zip(snapshots, self._merged_from):
+            if new is old:
+                diffs.append(None)
+            elif new.diff is not None and new.diff.base == old.generation:
+                diffs.append(new.diff)
+            else:
+                return None
+
+        removed: List[Tuple[int, int]] = []
+        for diff, segments in zip(diffs, self._segments):
+            if diff is None:
+                continue
+            starts = [segment[0] for segment in segments]
+            for offset, end in zip(diff.removed, diff.removed_ends):
+                root_start, _, merged_start = segments[bisect_right(starts, offset) - 1]
+                removed.append((offset - root_start + merged_start, end - root_start + merged_start))
+        removed.sort()
+        removed_offsets = array("Q", (offset for offset, _ in removed))
+        # Bytes removed before each removed line, and in total
+        shifts = list(accumulate((end - offset for offset, end in removed), initial=0))
+        kept_bytes = len(self._merged.data) - shifts[-1]
+
+        all_segments = []
+        added = []
+        added_end = kept_bytes
+        for diff, segments in zip(diffs, self._segments):
+            root_removed = diff.removed if diff is not None else array("Q")
+            root_shifts = (
+                list(accumulate((end - offset for offset, end in zip(diff.removed, diff.removed_ends)), initial=0))
+                if diff is not None
+                else [0]
+            )
+            moved: List[Segment] = []
+            for root_start, root_end, merged_start in segments:
+                root_start -= root_shifts[bisect_left(root_removed, root_start)]
+                root_end -= root_shifts[bisect_left(root_removed, root_end)]
+                merged_start -= shifts[bisect_left(removed_offsets, merged_start)]
+                if root_start < root_end:
+                    moved.append((root_start, root_end, merged_start))
+            if diff is not None and diff.added:
+                moved.append((diff.kept_bytes, diff.kept_bytes + len(diff.added), added_end))
+                added.append(diff.added)
+                added_end += len(diff.added)
+            # Runs left contiguous in both the root and the merged data are joined
+            joined: List[Segment] = []
+            for root_start, root_end, merged_start in moved:
+                last_start, last_end, last_merged_start = joined[-1] if joined else (0, -1, 0)
+                if last_end == root_start and last_merged_start + root_start - last_start == merged_start:
+                    joined[-1] = (last_start, root_end, last_merged_start)
+                else:
+                    joined.append((root_start, root_end, merged_start))
+            if len(joined) > MAX_ROOT_SEGMENTS:
+                return None
+            all_segments.append(joined)
+
+        changed = [diff for diff in diffs if diff is not None]
+        diff = SnapshotDiff(
+            base=self._merged.generation,
+            kept_bytes=kept_bytes,
+            removed=removed_offsets,
+            removed_ends=array("Q", (end for _, end in removed)),
+            added=b"".join(added),
+            added_count=sum(diff.added_count for diff in changed),
+            duration=sum(diff.duration for diff in changed),
+        )
+        return diff, tuple(all_segments)
@@ -0,0 +1,169 @@
+import re
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from itertools import chain, count
+from typing import Iterable, Iterator, List, Optional
+
+ENCODING = "utf-8"
+_NEWLINE = re.compile(b"\n")
+# Undecodable file names survive a decode/encode round trip
+ENCODING_ERRORS = "surrogateescape"
+# Every snapshot gets a new generation number, diffs refer to the generation they apply to
+_generations = count()
+
+
+def decode(raw: bytes) -> str:
+    """ Works on any bytes-like object, e.g. the zero-copy views of a snapshot """
+    return str(raw, ENCODING, ENCODING_ERRORS)
+
+
+def encode(text: str) -> bytes:
+    return text.encode(ENCODING, ENCODING_ERRORS)
+
+
+@dataclass(frozen=True)
+class SnapshotDiff:
+    """
+    Changes from a snapshot generation to the next one: the next data is the base data without the
+    removed lines, followed by the added ones. Entries keep their order, offsets only move backwards.
+    """
+
+    # Generation of the snapshot the diff applies to
+    base: int
+    # Number of bytes of the base data that are kept, where the added lines start in the next data
+    kept_bytes: int
+    # Sorted offsets, in the base data, of the removed lines and of the line after each one
+    removed: array = field(default_factory=lambda: array("Q"))
+    removed_ends: array = field(default_factory=lambda: array("Q"))
+    added: bytes = b""
+    added_count: int = 0
+    # Seconds spent computing the diff
+    duration: float = 0.0
+
+    @property
+    def removed_count(self) -> int:
+        return len(self.removed)
+
+    def __bool__(self) -> bool:
+        return bool(self.removed) or bool(self.added)
+
+    def __str__(self) -> str:
+        if not self:
+            return f"no changes ({self.duration:.3f} s)"
+        return f"+{self.added_count} -{self.removed_count} entries ({self.duration:.3f} s)"
+
+    def patch(self, data: bytes) -> bytes:
+        """ Data of the next generation from the data of the base one, copied once """
+        view = memoryview(data)
+        pieces = []
+        start = 0
+        for offset, end in zip(self.removed, self.removed_ends):
+            pieces.append(view[start:offset])
+            start = end
+        pieces.append(view[start:])
+        pieces.append(self.added)
+        return b"".join(pieces)
+
+    def added_offsets(self) -> Iterator[int]:
+        """ Offsets of the added lines in the next data """
+        if self.added:
+            yield self.kept_bytes
+            for match in _NEWLINE.finditer(self.added, 0, len(self.added) - 1):
+                yield self.kept_bytes + match.end()
+
+    def remap(self, offsets: array) -> array:
+        """
+        Offsets in the next data of the lines at the sorted 'offsets' of the base data, removed
+        lines are dropped and the added ones are appended
+        """
+        remapped = array(offsets.typecode)
+        start, shift = 0, 0
+        for offset, end in zip(self.removed, self.removed_ends):
+            stop = bisect_left(offsets, offset, start)
+            kept = offsets[start:stop]
+            remapped.extend(kept if not shift else (kept_offset - shift for kept_offset in kept))
+            start = bisect_left(offsets, end, stop)
+            shift += end - offset
+        kept = offsets[start:]
+        remapped.extend(kept if not shift else (kept_offset - shift for kept_offset in kept))
+        remapped.extend(self.added_offsets())
+        return remapped
+
+
+class FileSystemSnapshot:
+    """
+    Entries of a scan, one per line, stored as the raw bytes printed by the scanner.
+    Entries are only decoded when needed, and the offsets of their beginning are computed on
+    first use, so a snapshot costs about one byte per path character.
+    A snapshot derived from the previous generation keeps the diff it was built with, so that the
+    state computed on the previous one can be patched instead of rebuilt.
+    """
+
+    def __init__(self, data: bytes = b"", timestamp: float = -1, diff: Optional[SnapshotDiff] = None):
+        self.data = data
+        self.timestamp = timestamp
+        self.generation = next(_generations)
+        self.diff = diff
+        self._offsets: Optional[array] = None
+        self._marks_dirs: Optional[bool] = None
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[str], timestamp: float) -> "FileSystemSnapshot":
+        data = b"".join(encode(entry) + b"\n" for entry in entries)
+        return cls(data=data, timestamp=timestamp)
+
+    def apply(self, diff: SnapshotDiff, timestamp: float) -> "FileSystemSnapshot":
+        """ Next generation of this snapshot, 'diff' must have been computed against it """
+        return FileSystemSnapshot(data=diff.patch(self.data), timestamp=timestamp, diff=diff)
+
+    @property
+    def is_cold(self) -> bool:
+        return self.timestamp < 0
+
+    @property
+    def offsets(self) -> array:
+        if self._offsets is None:
+            # Each line starts right after the newline of the previous one, streamed to avoid
+            # materializing one bytes object per line
+            ends = (match.end() for match in _NEWLINE.finditer(self.data))
+            offsets = array("I" if len(self.data) < 2**32 else "Q", chain([0], ends) if self.data else [])
+            if offsets and offsets[-1] == len(self.data):
+                offsets.pop()
+            self._offsets = offsets
+        return self._offsets
+
+    @property
+    def marks_dirs(self) -> bool:
+        """ Whether directories are listed with a trailing '/' (as fd >= 9 does), so other entries are files """
+        if self._marks_dirs is None:
+            self._marks_dirs = b"/\n" in self.data
+        return self._marks_dirs
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def view(self, offset: int) -> memoryview:
+        """ Zero-copy slice of the entry starting at byte 'offset' """
+        end = self.data.find(b"\n", offset)
+        return memoryview(self.data)[offset:end if end >= 0 else len(self.data)]
+
+    def entry_at(self, offset: int) -> str:
+        """ Decoded entry starting at byte 'offset' """
+        return decode(self.view(offset))
+
+    def entry(self, index: int) -> str:
+        return self.entry_at(self.offsets[index])
+
+    def _lines(self) -> List[bytes]:
+        # Not splitlines(), a '\r' is a valid file name character
+        lines = self.data.split(b"\n")
+        if lines[-1] == b"":
+            lines.pop()
+        return lines
+
+    def entries(self) -> Iterator[str]:
+        return (decode(line) for line in self._lines())
+
+    def __repr__(self) -> str:
+        return f"FileSystemSnapshot(bytes={len(self.data)}, timestamp={self.timestamp}, generation={self.generation})"
@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from os import path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+# Stages of a query, in the order they run
+STAGES = ("refresh", "load", "spawn", "filter", "rerank", "render", "total")
+# Not durations of the query itself but of the snapshot it was served from
+SNAPSHOT_STAGES = ("snapshot_age", "scan", "diff")
+PERCENTILES = (50, 95, 99)
+
+
+class QueryTimer:
+    """ Seconds spent by one query in each stage """
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    """ Nearest-rank percentile of a sorted list """
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+class LatencyStats:
+    """
+    Rolling window of the last 'window' samples of each stage, to compute their percentiles.
+    Samples are only sorted when a summary is requested, recording one is an append.
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def add(self, timer: QueryTimer) -> None:
+        with self._lock:
+            for name, seconds in timer.durations.items():
+                samples = self._samples.get(name)
+                if samples is None:
+                    samples = self._samples[name] = deque(maxlen=self.window)
+                samples.append(seconds)
+
+    def percentiles(self, name: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            ordered = sorted(self._samples.get(name, ()))
+        if not ordered:
+            return None
+        stats = {f"p{percent}": _percentile(ordered, percent) for percent in PERCENTILES}
+        stats.update(count=len(ordered), max=ordered[-1])
+        return stats
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        names = [name for name in STAGES + SNAPSHOT_STAGES if name in self._samples]
+        names += sorted(set(self._samples) - set(names))
+        return {name: self.percentiles(name) for name in names}
+
+    def dump(self, file_name: str) -> None:
+        """ Write the summary (in seconds) as JSON, atomically """
+        os.makedirs(path.dirname(file_name), exist_ok=True)
+        tmp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(tmp_name, "w") as file:
+            json.dump({"window": self.window, "stages": self.summary()}, file, indent=2)
+        os.replace(tmp_name, file_name)
+
+
+def format_timer(timer: QueryTimer, stats: LatencyStats, changes: Optional[Tuple[int, int]] = None) -> str:
+    """
+    One line breakdown of a query, in milliseconds, followed by the rolling percentiles of its total
+    :param changes: entries added and removed by the last scan of the snapshot, if it was diffed
+    """
+    parts = [f"{name} {timer.durations[name] * 1000:.1f}" for name in STAGES if name in timer.durations]
+    line = " · ".join(parts) + " ms"
+    total = stats.percentiles("total")
+    if total is not None:
+        line += " | total " + " ".join(f"p{p} {total[f'p{p}'] * 1000:.1f}" for p in PERCENTILES)
+    if "snapshot_age" in timer.durations:
+        line += f" | snapshot age {timer.durations['snapshot_age']:.0f} s"
+    if changes is not None and "diff" in timer.durations:
+        added, removed = changes
+        line += f" | scan diff +{added} -{removed} in {timer.durations['diff'] * 1000:.1f} ms"
+    return line
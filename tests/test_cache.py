@@ -0,0 +1,122 @@
+import glob
+import os
+import time
+
+import pytest
+
+from scan import cache as cache_module
+from scan.cache import SnapshotCache
+from scan.index import ScanRules
+from scan.native import NATIVE_SCANNER
+from scan.roots import MultiRootIndex, ScanRoot, build_fd_cmd
+from scan.snapshot import FileSystemSnapshot
+
+KEY = SnapshotCache.key(["fd", ".", "/base"])
+
+
+def _cache_files(cache_dir):
+    return glob.glob(f"{cache_dir}/snapshot-*.bin")
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.fixture
+def saved(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.save(KEY, FileSystemSnapshot(data=b"/base/a\n/base/b/\n", timestamp=123.5))
+    return cache, cache._file_name(KEY)
+
+
+def test_round_trip(saved):
+    cache, _ = saved
+    snapshot = cache.load(KEY)
+    assert snapshot.data == b"/base/a\n/base/b/\n"
+    assert snapshot.timestamp == 123.5
+    assert cache.load(SnapshotCache.key(["fd", ".", "/other"])) is None
+
+
+def _corrupt_payload(data):
+    return data[:-2] + b"x\n"
+
+
+def _wrong_version(data):
+    header = cache_module._HEADER
+    fields = list(header.unpack_from(data))
+    fields[1] += 1
+    return header.pack(*fields) + data[header.size:]
+
+
+def _wrong_key(data):
+    return data[:6] + bytes(32) + data[38:]
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [
+        lambda data: data[:-3],
+        lambda data: data[:10],
+        lambda data: b"",
+        lambda data: data + b"/base/c\n",
+        _corrupt_payload,
+        _wrong_version,
+        _wrong_key,
+    ],
+    ids=["truncated", "truncated-header", "empty", "extra-bytes", "bad-crc", "wrong-version", "wrong-key"],
+)
+def test_invalid_file_is_a_miss(saved, corrupt):
+    cache, file_name = saved
+    with open(file_name, "rb") as file:
+        data = file.read()
+    with open(file_name, "wb") as file:
+        file.write(corrupt(data))
+    assert cache.load(KEY) is None
+    # Removed, the next scan writes a valid one
+    assert not os.path.exists(file_name)
+
+
+def test_key_depends_on_the_ignore_file(tmp_path):
+    ignore_file = tmp_path / "ignore"
+    ignore_file.write_text("a\n")
+    cmd = ["fd", "--ignore-file", str(ignore_file)]
+    key = SnapshotCache.key(cmd)
+    os.utime(ignore_file, ns=(0, 0))
+    assert SnapshotCache.key(cmd) != key
+    assert SnapshotCache.key(cmd, ScanRules(base_dir="/base")) != SnapshotCache.key(cmd)
+
+
+def test_prune(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    keys = [SnapshotCache.key(["fd", str(i)]) for i in range(3)]
+    for key in keys:
+        cache.save(key, FileSystemSnapshot(data=b"/a\n", timestamp=0))
+    (tmp_path / "unrelated.txt").touch()
+    cache.prune(keys[:1])
+    assert _cache_files(tmp_path) == [cache._file_name(keys[0])]
+    assert (tmp_path / "unrelated.txt").exists()
+
+
+def test_cache_enabled_at_runtime(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "tree").mkdir()
+    (tmp_path / "tree/file").touch()
+    rules = ScanRules(base_dir=str(tmp_path / "tree"))
+    roots = [ScanRoot(rules=rules, cmd=build_fd_cmd(NATIVE_SCANNER, rules), scan_period=60)]
+    index = MultiRootIndex()
+    index.set_roots(roots)
+    snapshot = index.refresh(background=False)
+    assert index.index(roots[0]).cache_key is None
+
+    # Same roots, only the cache preference changed: the warm snapshot is saved without a scan
+    index.set_roots(roots, cache=True)
+    cache_key = index.index(roots[0]).cache_key
+    assert cache_key is not None
+    assert _wait_for(lambda: SnapshotCache().load(cache_key) is not None)
+    assert SnapshotCache().load(cache_key).data == snapshot.data
+    assert len(_cache_files(tmp_path / "cache/ulauncher-fzf")) == 1
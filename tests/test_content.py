@@ -0,0 +1,45 @@
+from matcher.content import ContentMatch, MmapSearch, RipgrepSearch
+from scan.index import ScanRules
+from scan.snapshot import FileSystemSnapshot
+
+
+def test_mmap_search(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.txt").write_text("first\nNeedle here\nno\nneedle again\n")
+    (tmp_path / "sub/b.txt").write_text("needle\n")
+    (tmp_path / "binary").write_bytes(b"needle\0")
+    entries = [f"{tmp_path}/sub/", f"{tmp_path}/a.txt", f"{tmp_path}/binary", f"{tmp_path}/sub/b.txt"]
+    snapshot = FileSystemSnapshot.from_entries(entries, timestamp=0)
+    rules = [ScanRules(base_dir=str(tmp_path))]
+
+    matches = MmapSearch().search("needle", rules, lambda: snapshot, 10, None)
+    assert matches == [
+        ContentMatch(f"{tmp_path}/a.txt", 2, "Needle here"),
+        ContentMatch(f"{tmp_path}/a.txt", 4, "needle again"),
+        ContentMatch(f"{tmp_path}/sub/b.txt", 1, "needle"),
+    ]
+    # Smart case, and the search stops at the limit
+    assert MmapSearch().search("Needle", rules, lambda: snapshot, 10, None) == matches[:1]
+    assert MmapSearch().search("needle", rules, lambda: snapshot, 2, None) == matches[:2]
+
+
+def test_ripgrep_cmd():
+    rules = ScanRules(
+        base_dir="/base", allow_hidden=True, ignore_file="/ignore", max_depth=3, excludes=("node_modules", "*.min.js")
+    )
+    cmd = RipgrepSearch("rg")._cmd("needle", rules)
+    assert cmd[0] == "rg"
+    assert cmd[cmd.index("--max-depth") + 1] == "3"
+    assert cmd[cmd.index("--ignore-file") + 1] == "/ignore"
+    assert [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "--glob"] == ["!node_modules", "!*.min.js"]
+    assert "--hidden" in cmd and "--follow" not in cmd
+    assert cmd[-3:] == ["--", "needle", "/base"]
+
+
+def test_ripgrep_skips_directory_roots(monkeypatch):
+    search = RipgrepSearch("rg")
+    searched = []
+    monkeypatch.setattr(search, "_search_root", lambda cmd, *args: searched.append(cmd[-1]) or [])
+    roots = [ScanRules(base_dir="/dirs", files=False), ScanRules(base_dir="/files", dirs=False)]
+    assert search.search("needle", roots, FileSystemSnapshot, 10, None) == []
+    assert searched == ["/files"]
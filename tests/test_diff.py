@@ -0,0 +1,141 @@
+import random
+from array import array
+
+import pytest
+
+from scan import diff as diff_module
+from scan.diff import StreamingDiff, diff_snapshot, find_line, sort_lines
+from scan.snapshot import FileSystemSnapshot, SnapshotDiff
+
+
+def _data(lines):
+    return b"".join(line + b"\n" for line in lines)
+
+
+def _lines(data):
+    return data.split(b"\n")[:-1]
+
+
+def test_unchanged_scan():
+    snapshot = FileSystemSnapshot(data=b"/a\n/b\n")
+    diff = diff_snapshot(snapshot, b"/a\n/b\n")
+    assert diff is not None and not diff
+    assert diff.kept_bytes == len(snapshot.data)
+
+
+def test_diff_ignores_order():
+    snapshot = FileSystemSnapshot(data=b"/a\n/b\n/c\n")
+    diff = diff_snapshot(snapshot, b"/c\n/a\n/b\n")
+    assert diff is not None and not diff
+
+
+def test_diff_patch():
+    lines = [b"/dir/%d" % i for i in range(100)]
+    snapshot = FileSystemSnapshot(data=_data(lines))
+    new_lines = [line for line in lines if not line.endswith(b"7")] + [b"/new/1", b"/new/2"]
+    random.Random(0).shuffle(new_lines)
+    diff = diff_snapshot(snapshot, _data(new_lines))
+
+    assert diff.removed_count == 10
+    assert diff.added_count == 2
+    patched = diff.patch(snapshot.data)
+    assert sorted(_lines(patched)) == sorted(new_lines)
+    # Entries keep their order, the added ones come last
+    assert _lines(patched)[:-2] == [line for line in lines if not line.endswith(b"7")]
+
+
+def test_too_many_changes():
+    snapshot = FileSystemSnapshot(data=_data([b"/a", b"/b", b"/c", b"/d"]))
+    assert diff_snapshot(snapshot, _data([b"/e", b"/f", b"/g", b"/h"])) is None
+
+
+def test_remap():
+    snapshot = FileSystemSnapshot(data=b"/a\n/bb\n/ccc\n/dddd\n")
+    offsets = snapshot.offsets
+    # Remove '/bb' and '/dddd', add '/e'
+    diff = SnapshotDiff(
+        base=snapshot.generation,
+        kept_bytes=len(b"/a\n/ccc\n"),
+        removed=array("Q", [offsets[1], offsets[3]]),
+        removed_ends=array("Q", [offsets[2], len(snapshot.data)]),
+        added=b"/e\n",
+        added_count=1,
+    )
+    patched = snapshot.apply(diff, timestamp=0)
+    assert patched.data == b"/a\n/ccc\n/e\n"
+
+    selected = array("I", [offsets[0], offsets[1], offsets[2]])
+    remapped = diff.remap(selected)
+    assert [patched.entry_at(offset) for offset in remapped] == ["/a", "/ccc", "/e"]
+    assert list(diff.remap(array("I"))) == [patched.offsets[2]]
+
+
+def test_sort_lines(monkeypatch):
+    lines = [b"/a/b", b"/a", b"/a\tb", b"/a/", b"/b", b"/a b", b"/"] * 3 + [b"/z%d" % i for i in range(200)]
+    random.Random(1).shuffle(lines)
+    data = _data(lines)
+    assert _lines(sort_lines(data)) == sorted(lines)
+    # Sorted a chunk at a time, then merged
+    monkeypatch.setattr(diff_module, "CHUNK_SIZE", 64)
+    assert _lines(sort_lines(data)) == sorted(lines)
+    assert sort_lines(b"") == b""
+
+
+@pytest.mark.parametrize("key", [b"", b"/", b"/a", b"/a/", b"/a0", b"/b", b"/c/d", b"/zz"])
+def test_find_line(key):
+    lines = sorted([b"/a", b"/a/x", b"/a/y", b"/ab", b"/b", b"/c/d", b"/c/e"])
+    data = _data(lines)
+    offsets = FileSystemSnapshot(data=data).offsets
+    expected = next((offset for offset, line in zip(offsets, lines) if line >= key), len(data))
+    assert find_line(data, key, 0, len(data)) == expected
+
+
+def test_find_line_in_range():
+    data = _data([b"/a", b"/b", b"/c", b"/a"])
+    # Only the first three lines are sorted
+    assert find_line(data, b"/b", 0, 9) == 3
+    assert find_line(data, b"/d", 0, 9) == 9
+
+
+def _stream(snapshot, data, size=7):
+    stream = StreamingDiff(snapshot)
+    for start in range(0, len(data), size):
+        stream.write(data[start:start + size])
+    return stream.finish(timestamp=1)
+
+
+def test_streamed_unchanged_scan():
+    snapshot = FileSystemSnapshot(data=b"/a\n/b\n/c\n")
+    streamed, diff = _stream(snapshot, b"/c\n/a\n/b\n")
+    assert streamed is snapshot
+    assert diff is not None and not diff
+
+
+def test_streamed_diff():
+    lines = [b"/dir/%d" % i for i in range(100)]
+    snapshot = FileSystemSnapshot(data=_data(lines))
+    new_lines = [line for line in lines if not line.endswith(b"7")] + [b"/new/1", b"/new/2"]
+    random.Random(0).shuffle(new_lines)
+    patched, diff = _stream(snapshot, _data(new_lines))
+
+    assert diff.removed_count == 10
+    assert diff.added_count == 2
+    assert patched.diff is diff
+    assert sorted(_lines(patched.data)) == sorted(new_lines)
+    assert _lines(patched.data)[:-2] == [line for line in lines if not line.endswith(b"7")]
+
+
+def test_streamed_replacement():
+    snapshot = FileSystemSnapshot(data=_data([b"/a", b"/b", b"/c", b"/d"]))
+    replaced, diff = _stream(snapshot, _data([b"/e", b"/a", b"/f"]))
+    assert diff is None
+    assert sorted(_lines(replaced.data)) == [b"/a", b"/e", b"/f"]
+    # From an empty snapshot too
+    replaced, diff = _stream(FileSystemSnapshot(), _data([b"/a"]))
+    assert diff is None and replaced.data == b"/a\n"
+
+
+@pytest.mark.parametrize("data", [b"/a\n/b\n/b\n", b"/a\n/b"])
+def test_streamed_output_not_rebuilt(data):
+    # Duplicated lines, an unterminated last line
+    assert _stream(FileSystemSnapshot(data=b"/a\n/b\n"), data) is None
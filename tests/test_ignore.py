@@ -0,0 +1,54 @@
+import pytest
+
+from scan.ignore import IgnoreRules
+
+
+@pytest.mark.parametrize(
+    "line, rel_path, is_dir, expected",
+    [
+        ("*.pyc", "a.pyc", False, True),
+        ("*.pyc", "src/a.pyc", False, True),
+        ("*.pyc", "a.pyc/b", False, False),
+        ("build/", "build", True, True),
+        ("build/", "build", False, False),
+        ("build/", "src/build", True, True),
+        ("/build", "build", False, True),
+        ("/build", "src/build", False, False),
+        ("doc/*.md", "doc/a.md", False, True),
+        ("doc/*.md", "x/doc/a.md", False, False),
+        ("doc/*.md", "doc/sub/a.md", False, False),
+        ("**/logs", "a/b/logs", True, True),
+        ("logs/**", "logs/a/b", False, True),
+        ("a/**/b", "a/b", False, True),
+        ("a/**/b", "a/x/y/b", False, True),
+        ("file?.txt", "file1.txt", False, True),
+        ("file?.txt", "file10.txt", False, False),
+        ("[abc].txt", "b.txt", False, True),
+        ("[!abc].txt", "b.txt", False, False),
+        ("[!abc].txt", "d.txt", False, True),
+        ("\\#hash", "#hash", False, True),
+        ("\\!bang", "!bang", False, True),
+        ("trailing\\ ", "trailing ", False, True),
+    ],
+)
+def test_pattern(line, rel_path, is_dir, expected):
+    assert IgnoreRules([line]).is_ignored(rel_path, is_dir) is expected
+
+
+@pytest.mark.parametrize("line", ["", "   ", "# comment", "/", "!"])
+def test_no_pattern(line):
+    assert IgnoreRules._compile(line) is None
+
+
+def test_last_match_wins():
+    rules = IgnoreRules(["*.log", "!keep.log"])
+    assert rules.is_ignored("a.log", False)
+    assert not rules.is_ignored("keep.log", False)
+    assert rules.match("a.txt", False) is None
+    assert rules.match("keep.log", False) is False
+    assert not IgnoreRules([])
+
+
+def test_from_missing_file(tmp_path):
+    assert not IgnoreRules.from_file(str(tmp_path / "missing"))
+    assert not IgnoreRules.from_file(None)
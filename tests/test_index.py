@@ -0,0 +1,135 @@
+import os
+import shutil
+import threading
+import time
+from dataclasses import replace
+
+import pytest
+
+from scan.index import IncrementalIndex, ScanRules
+from scan.native import NATIVE_SCANNER
+from scan.roots import build_fd_cmd
+from scan.watcher import inotify_available
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.fixture
+def watched(tmp_path):
+    for dir_name in ["a/b", "c"]:
+        (tmp_path / dir_name).mkdir(parents=True)
+    for file_name in ["a/x", "a/b/y", "c/z"]:
+        (tmp_path / file_name).touch()
+    rules = ScanRules(base_dir=str(tmp_path))
+    index = IncrementalIndex()
+    index.set_command(list(build_fd_cmd(NATIVE_SCANNER, rules)), rules, watch=True)
+    index.refresh(60, 10, background=False)
+    assert _wait_for(lambda: index.watching)
+    yield index, str(tmp_path)
+    index.close()
+
+
+def _entries(index):
+    return set(index.refresh(60, 10).entries())
+
+
+@pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+def test_watch_events(watched):
+    index, base = watched
+    assert _entries(index) == {f"{base}/{name}" for name in ["a/", "a/b/", "a/x", "a/b/y", "c/", "c/z"]}
+
+    os.makedirs(f"{base}/a/new/deep")
+    open(f"{base}/a/new/deep/f", "w").close()
+    assert _wait_for(lambda: f"{base}/a/new/deep/f" in _entries(index))
+    assert {f"{base}/a/new/", f"{base}/a/new/deep/"} <= _entries(index)
+    # Published as the diff of a new generation
+    assert index.snapshot.diff is not None
+
+    shutil.rmtree(f"{base}/a")
+    assert _wait_for(lambda: _entries(index) == {f"{base}/c/", f"{base}/c/z"})
+
+    os.rename(f"{base}/c", f"{base}/d")
+    assert _wait_for(lambda: _entries(index) == {f"{base}/d/", f"{base}/d/z"})
+    open(f"{base}/d/again", "w").close()
+    assert _wait_for(lambda: f"{base}/d/again" in _entries(index))
+
+
+def test_rescan_is_streamed_and_patched(tmp_path):
+    (tmp_path / "a").mkdir()
+    for i in range(10):
+        (tmp_path / f"a/{i}").touch()
+    rules = ScanRules(base_dir=str(tmp_path))
+    index = IncrementalIndex()
+    index.set_command(list(build_fd_cmd(NATIVE_SCANNER, rules)), rules)
+    first = index.refresh(0, None, background=False)
+
+    (tmp_path / "a/y").touch()
+    patched = index.refresh(0, None, background=False)
+    assert patched.diff is not None and patched.diff.added == f"{tmp_path}/a/y\n".encode()
+    assert set(patched.entries()) == set(first.entries()) | {f"{tmp_path}/a/y"}
+    assert index.prune_stats.entries == 12
+    # Unchanged, the snapshot is kept
+    assert index.refresh(0, None, background=False) is patched
+    assert first.generation == patched.diff.base
+
+
+@pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+def test_watch_applies_ignore_files(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / ".git").mkdir(parents=True)
+    (repo / ".gitignore").write_text("node_modules/\n*.log\n")
+    (tmp_path / ".ignore").write_text("tmp/\n")
+    rules = ScanRules(base_dir=str(tmp_path))
+    index = IncrementalIndex()
+    index.set_command(list(build_fd_cmd(NATIVE_SCANNER, rules)), rules, watch=True)
+    index.refresh(60, 10, background=False)
+    assert _wait_for(lambda: index.watching)
+    base = str(tmp_path)
+
+    try:
+        os.makedirs(f"{base}/repo/node_modules/pkg")
+        open(f"{base}/repo/debug.log", "w").close()
+        os.makedirs(f"{base}/repo/src/tmp")
+        open(f"{base}/repo/src/main.py", "w").close()
+        assert _wait_for(lambda: f"{base}/repo/src/main.py" in _entries(index))
+        assert _entries(index) == {f"{base}/repo/", f"{base}/repo/src/", f"{base}/repo/src/main.py"}
+        # Not watched either
+        assert not any("node_modules" in dir_name for dir_name in index._wds.values())
+    finally:
+        index.close()
+
+
+def test_rules_changed_while_scanning(tmp_path):
+    (tmp_path / "a").mkdir()
+    for i in range(5):
+        (tmp_path / f"a/{i}").touch()
+    rules = ScanRules(base_dir=str(tmp_path))
+    cmd = list(build_fd_cmd(NATIVE_SCANNER, rules))
+    index = IncrementalIndex()
+    index.set_command(cmd, rules)
+    assert len(list(index.refresh(0, None, background=False).entries())) == 6
+
+    run_scan, release = index._run_scan, threading.Event()
+
+    def blocked_run_scan(*args):
+        run_scan(*args)
+        release.wait(5)
+
+    index._run_scan = blocked_run_scan
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(snapshot=index.refresh(0, 10, background=False)))
+    thread.start()
+    time.sleep(0.1)
+    # Only the rules applied to the output changed, the running scan used the old ones
+    index.set_command(cmd, replace(rules, max_children=2))
+    release.set()
+    thread.join(5)
+    assert set(result["snapshot"].entries()) == {f"{tmp_path}/a/"}
+    assert index.prune_stats.crowded_dirs == (f"{tmp_path}/a",)
@@ -0,0 +1,257 @@
+import shutil
+import subprocess
+
+import pytest
+
+from benchmarks.fzf_parity import QUERIES, generate_corpus, run_fzf
+from matcher.native import (
+    BONUS_BOUNDARY,
+    BONUS_BOUNDARY_DELIMITER,
+    BONUS_BOUNDARY_WHITE,
+    BONUS_CAMEL_123,
+    BONUS_CONSECUTIVE,
+    BONUS_FIRST_CHAR_MULTIPLIER,
+    BONUS_NON_WORD,
+    SCORE_GAP_EXTENSION,
+    SCORE_GAP_START,
+    SCORE_MATCH,
+    NativeMatcher,
+    Term,
+    TermType,
+    _term_narrows,
+    exact_score,
+    fuzzy_score,
+    narrows,
+    parse_query,
+    prefix_score,
+    score_line,
+    suffix_score,
+)
+from scan.diff import diff_snapshot
+from scan.snapshot import FileSystemSnapshot
+
+# Expected scores of fzf's own tests (src/algo/algo_test.go), case-insensitive
+SCORES = [
+    (fuzzy_score, "fooBarbaz1", "obz", SCORE_MATCH * 3 + BONUS_CAMEL_123 + SCORE_GAP_START + SCORE_GAP_EXTENSION * 3),
+    (
+        fuzzy_score,
+        "foo bar baz",
+        "fbb",
+        SCORE_MATCH * 3
+        + BONUS_BOUNDARY_WHITE * BONUS_FIRST_CHAR_MULTIPLIER
+        + BONUS_BOUNDARY_WHITE * 2
+        + SCORE_GAP_START * 2
+        + SCORE_GAP_EXTENSION * 4,
+    ),
+    (fuzzy_score, "/AutomatorDocument.icns", "rdoc", SCORE_MATCH * 4 + BONUS_CAMEL_123 + BONUS_CONSECUTIVE * 2),
+    (
+        fuzzy_score,
+        "/man1/zshcompctl.1",
+        "zshc",
+        SCORE_MATCH * 4 + BONUS_BOUNDARY_DELIMITER * BONUS_FIRST_CHAR_MULTIPLIER + BONUS_BOUNDARY_DELIMITER * 3,
+    ),
+    (
+        fuzzy_score,
+        "/.oh-my-zsh/cache",
+        "zshc",
+        SCORE_MATCH * 4
+        + BONUS_BOUNDARY * BONUS_FIRST_CHAR_MULTIPLIER
+        + BONUS_BOUNDARY * 2
+        + SCORE_GAP_START
+        + BONUS_BOUNDARY_DELIMITER,
+    ),
+    (fuzzy_score, "ab0123 456", "12356", SCORE_MATCH * 5 + BONUS_CONSECUTIVE * 3 + SCORE_GAP_START + SCORE_GAP_EXTENSION),
+    (
+        fuzzy_score,
+        "abc123 456",
+        "12356",
+        SCORE_MATCH * 5
+        + BONUS_CAMEL_123 * BONUS_FIRST_CHAR_MULTIPLIER
+        + BONUS_CAMEL_123 * 2
+        + BONUS_CONSECUTIVE
+        + SCORE_GAP_START
+        + SCORE_GAP_EXTENSION,
+    ),
+    (
+        fuzzy_score,
+        "foo/bar/baz",
+        "fbb",
+        SCORE_MATCH * 3
+        + BONUS_BOUNDARY_WHITE * BONUS_FIRST_CHAR_MULTIPLIER
+        + BONUS_BOUNDARY_DELIMITER * 2
+        + SCORE_GAP_START * 2
+        + SCORE_GAP_EXTENSION * 4,
+    ),
+    (
+        fuzzy_score,
+        "fooBarBaz",
+        "fbb",
+        SCORE_MATCH * 3
+        + BONUS_BOUNDARY_WHITE * BONUS_FIRST_CHAR_MULTIPLIER
+        + BONUS_CAMEL_123 * 2
+        + SCORE_GAP_START * 2
+        + SCORE_GAP_EXTENSION * 2,
+    ),
+    (
+        fuzzy_score,
+        "fooBar Baz",
+        "foob",
+        SCORE_MATCH * 4 + BONUS_BOUNDARY_WHITE * BONUS_FIRST_CHAR_MULTIPLIER + BONUS_BOUNDARY_WHITE * 3,
+    ),
+    (
+        fuzzy_score,
+        "xFoo-Bar Baz",
+        "foo-b",
+        SCORE_MATCH * 5
+        + BONUS_CAMEL_123 * BONUS_FIRST_CHAR_MULTIPLIER
+        + BONUS_CAMEL_123 * 2
+        + BONUS_NON_WORD
+        + BONUS_BOUNDARY,
+    ),
+    # One character: the first occurrence at a boundary wins, even if a later one scores more
+    (fuzzy_score, "/p/a-f/f", "f", SCORE_MATCH + BONUS_BOUNDARY * BONUS_FIRST_CHAR_MULTIPLIER),
+    (fuzzy_score, "/p/xf/f", "f", SCORE_MATCH + BONUS_BOUNDARY_DELIMITER * BONUS_FIRST_CHAR_MULTIPLIER),
+    (exact_score, "fooBarbaz", "oba", SCORE_MATCH * 3 + BONUS_CAMEL_123 + BONUS_CONSECUTIVE),
+    (exact_score, "/AutomatorDocument.icns", "rdoc", SCORE_MATCH * 4 + BONUS_CAMEL_123 + BONUS_CONSECUTIVE * 2),
+    (
+        exact_score,
+        "/man1/zshcompctl.1",
+        "zshc",
+        SCORE_MATCH * 4 + BONUS_BOUNDARY_DELIMITER * (BONUS_FIRST_CHAR_MULTIPLIER + 3),
+    ),
+    (
+        exact_score,
+        "/.oh-my-zsh/cache",
+        "zsh/c",
+        SCORE_MATCH * 5 + BONUS_BOUNDARY * (BONUS_FIRST_CHAR_MULTIPLIER + 3) + BONUS_BOUNDARY_DELIMITER,
+    ),
+    (
+        prefix_score,
+        "fooBarbaz",
+        "foo",
+        SCORE_MATCH * 3 + BONUS_BOUNDARY_WHITE * BONUS_FIRST_CHAR_MULTIPLIER + BONUS_BOUNDARY_WHITE * 2,
+    ),
+    (suffix_score, "fooBarBaz", "baz", SCORE_MATCH * 3 + BONUS_CAMEL_123 * (BONUS_FIRST_CHAR_MULTIPLIER + 2)),
+]
+
+
+@pytest.mark.parametrize("function, text, pattern, expected", SCORES)
+def test_scores_match_fzf(function, text, pattern, expected):
+    assert function(text, text.lower(), pattern) == expected
+
+
+@pytest.mark.parametrize("function", [fuzzy_score, exact_score, prefix_score, suffix_score])
+def test_no_match(function):
+    assert function("foo/bar", "foo/bar", "baz") is None
+
+
+def test_parse_query():
+    assert parse_query("'exact ^pre suf$ !neg") == [
+        [Term(TermType.EXACT, "exact")],
+        [Term(TermType.PREFIX, "pre")],
+        [Term(TermType.SUFFIX, "suf")],
+        [Term(TermType.EXACT, "neg", inverse=True)],
+    ]
+    assert parse_query("a | B") == [[Term(TermType.FUZZY, "a"), Term(TermType.FUZZY, "B", case_sensitive=True)]]
+    assert parse_query("^eq$ !'fuzzy") == [
+        [Term(TermType.EQUAL, "eq")],
+        [Term(TermType.FUZZY, "fuzzy", inverse=True)],
+    ]
+
+
+def test_score_line():
+    assert score_line(parse_query("!bar"), "/foo/bar") is None
+    assert score_line(parse_query("!bar"), "/foo/baz") == 0
+    assert score_line(parse_query("bar | qux"), "/foo/qux") == score_line(parse_query("qux"), "/foo/qux")
+    # Smart case
+    assert score_line(parse_query("Foo"), "/foo") is None
+    assert score_line(parse_query("foo"), "/Foo") is not None
+
+
+@pytest.mark.parametrize(
+    "old, new, expected",
+    [
+        ("pro", "proj", True),
+        ("pro", "'proj", True),
+        ("pro", "^proj", True),
+        ("'pro", "'proj", True),
+        ("'pro", "^proj", True),
+        ("'pro", "proj", False),
+        ("^pro", "^proj", True),
+        ("^pro", "^proj$", True),
+        ("^pro", "'proj", False),
+        ("pro$", "proj$", False),
+        ("proj", "pro", False),
+        ("pro", "Pro", True),
+        ("Pro", "pro", False),
+        ("!pro", "!pro", True),
+        ("!pro", "!proj", False),
+    ],
+)
+def test_term_narrows(old, new, expected):
+    assert _term_narrows(parse_query(old)[0][0], parse_query(new)[0][0]) is expected
+
+
+def test_narrows():
+    assert narrows(parse_query("pro"), parse_query("proj x"))
+    assert not narrows(parse_query("pro x"), parse_query("proj"))
+    assert not narrows(parse_query("pro"), parse_query("pro | x"))
+
+
+def _snapshot(lines):
+    return FileSystemSnapshot(data="".join(line + "\n" for line in lines).encode(), timestamp=0)
+
+
+def test_ranking():
+    matcher = NativeMatcher()
+    matcher.load(_snapshot(["/a/src/x", "/src", "/b/s/r/c", "/a/src"]))
+    # Score, then length, then input order
+    assert matcher.match("src", 10) == ["/src", "/a/src", "/a/src/x", "/b/s/r/c"]
+    assert matcher.match("src", 2) == ["/src", "/a/src"]
+
+
+def test_single_character_ranking():
+    matcher = NativeMatcher()
+    matcher.load(_snapshot(["/p/a-f/f", "/p/f0123456"]))
+    assert matcher.match("f", 10) == ["/p/f0123456", "/p/a-f/f"]
+
+
+def test_negations_keep_input_order():
+    matcher = NativeMatcher()
+    matcher.load(_snapshot(["/long/path/a", "/test/b", "/c", "/d/test", "/ee"]))
+    assert matcher.match("!test", 10) == ["/long/path/a", "/c", "/ee"]
+    assert matcher.match("!test", 2) == ["/long/path/a", "/c"]
+    # Sorted as soon as a term is positive
+    assert matcher.match("!test /", 10) == ["/c", "/ee", "/long/path/a"]
+
+
+def test_narrowing_survives_diffs():
+    matcher = NativeMatcher()
+    others = [f"/x{i}" for i in range(20)]
+    snapshot = _snapshot(["/pro/a", "/project", "/prologue"] + others)
+    matcher.load(snapshot)
+    assert matcher.match("pro", 10) == ["/pro/a", "/project", "/prologue"]
+
+    data = _snapshot(["/pro/a", "/prologue"] + others + ["/project/b", "/y"]).data
+    diff = diff_snapshot(snapshot, data)
+    patched = snapshot.apply(diff, timestamp=1)
+    matcher.load(patched)
+    assert matcher.match("proj", 10) == ["/project/b"]
+    assert matcher.match("pro", 10) == ["/pro/a", "/prologue", "/project/b"]
+
+
+@pytest.mark.skipif(shutil.which("fzf") is None, reason="fzf is not installed")
+@pytest.mark.parametrize("seed", [0, 3])
+def test_fzf_parity(seed):
+    candidates = "\n".join(generate_corpus(5000, seed)) + "\n"
+    matcher = NativeMatcher()
+    matcher.load(FileSystemSnapshot(data=candidates.encode(), timestamp=0))
+    mismatches = []
+    for query in QUERIES:
+        try:
+            expected = run_fzf(candidates, query)[:15]
+        except subprocess.SubprocessError:
+            pytest.skip("fzf failed")
+        if matcher.match(query, 15) != expected:
+            mismatches.append(query)
+    assert mismatches == []
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from scan.index import ScanRules
+from scan.native import NativeScanner
+
+
+def _scan(base_dir, **kwargs):
+    data = NativeScanner(ScanRules(base_dir=str(base_dir), **kwargs)).scan(timeout=10)
+    base = os.fsencode(str(base_dir)) + b"/"
+    return {line[len(base):].decode() for line in data.split(b"\n") if line}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for name in ["src/main.py", "src/debug.log", "build/out.o", "notes.txt"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    (tmp_path / ".gitignore").write_text("*.log\nbuild/\n")
+    return tmp_path
+
+
+def test_gitignore_only_applies_in_a_repo(tree):
+    assert _scan(tree) == {"src/", "src/main.py", "src/debug.log", "build/", "build/out.o", "notes.txt"}
+    (tree / ".git").mkdir()
+    assert _scan(tree) == {"src/", "src/main.py", "notes.txt"}
+
+
+def test_ignore_files_apply_outside_a_repo(tree):
+    (tree / "src/.ignore").write_text("main.py\n")
+    (tree / ".fdignore").write_text("notes.txt\n")
+    assert _scan(tree) == {"src/", "src/debug.log", "build/", "build/out.o"}
+
+
+def test_parent_ignore_files(tree):
+    (tree / ".git").mkdir()
+    # The ignore files above the base directory apply to it
+    assert _scan(tree / "src") == {"main.py"}
+    # The innermost ones take precedence
+    (tree / "src/.gitignore").write_text("!debug.log\n")
+    assert _scan(tree / "src") == {"main.py", "debug.log"}
+
+
+def test_symlink_loops(tmp_path):
+    (tmp_path / "a/b").mkdir(parents=True)
+    (tmp_path / "a/b/file").touch()
+    os.symlink(tmp_path / "a", tmp_path / "a/b/up")
+    os.symlink(tmp_path / "a/b", tmp_path / "a/same")
+    assert _scan(tmp_path) == {"a/", "a/b/", "a/b/file", "a/b/up", "a/same"}
+    # Followed, every directory is entered once
+    entries = _scan(tmp_path, follow_symlinks=True)
+    assert {"a/", "a/b/", "a/b/file", "a/b/up/"} <= entries
+    assert len([entry for entry in entries if entry.endswith("/file")]) == 1
@@ -0,0 +1,43 @@
+from scan.prune import prune_crowded
+
+
+def _data(lines):
+    return "".join(line + "\n" for line in lines).encode()
+
+
+TREE = (
+    ["/r/src/", "/r/src/a.py", "/r/node_modules/"]
+    + [f"/r/node_modules/p{i}/" for i in range(5)]
+    + [f"/r/node_modules/p0/f{i}" for i in range(4)]
+    + [f"/r/f{i}" for i in range(6)]
+)
+
+
+def test_no_limit():
+    outs, stats = prune_crowded(_data(TREE), "/r", None)
+    assert outs == _data(TREE)
+    assert stats.entries == len(TREE)
+    assert not stats.crowded_dirs
+
+
+def test_crowded_directories():
+    outs, stats = prune_crowded(_data(TREE), "/r", 3)
+    # The crowded directory is still listed, its nested crowded directory goes away with it
+    assert outs == _data(["/r/src/", "/r/src/a.py", "/r/node_modules/"] + [f"/r/f{i}" for i in range(6)])
+    assert stats.crowded_dirs == ("/r/node_modules",)
+    assert stats.dropped == 9
+    assert stats.entries == len(TREE) - 9
+    assert stats.saved_bytes == len(_data(TREE)) - len(outs) + 9 * 4
+
+
+def test_base_dir_is_never_pruned():
+    outs, stats = prune_crowded(_data(TREE), "/r/", 5)
+    assert outs == _data(TREE)
+    assert not stats.crowded_dirs
+
+
+def test_truncated():
+    _, stats = prune_crowded(_data(TREE), "/r", None, max_entries=len(TREE))
+    assert stats.truncated
+    _, stats = prune_crowded(_data(TREE), "/r", None, max_entries=len(TREE) + 1)
+    assert not stats.truncated
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from scan.refresher import SnapshotRefresher
+
+
+def _refresh_in_thread(refresher, **kwargs):
+    result = {}
+
+    def run():
+        try:
+            result["snapshot"] = refresher.refresh(60, 5, **kwargs)
+        except Exception as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_command_changed_while_scanning():
+    refresher = SnapshotRefresher()
+    refresher.set_command(["sh", "-c", "sleep 0.5; printf '/old\\n'"])
+    thread, result = _refresh_in_thread(refresher, background=True)
+    time.sleep(0.1)
+    # The running scan is outdated, the waiter gets a snapshot of the new command instead of a cold one
+    refresher.set_command(["sh", "-c", "printf '/new\\n'"])
+    thread.join(5)
+    assert "error" not in result
+    assert result["snapshot"].data == b"/new\n"
+    assert refresher.snapshot.data == b"/new\n"
+
+
+def test_failed_outdated_scan_is_not_an_error():
+    refresher = SnapshotRefresher()
+    refresher.set_command(["sh", "-c", "sleep 0.5; exit 1"])
+    thread, result = _refresh_in_thread(refresher, background=False)
+    time.sleep(0.1)
+    refresher.set_command(["sh", "-c", "printf '/new\\n'"])
+    thread.join(5)
+    assert "error" not in result
+    assert result["snapshot"].data == b"/new\n"
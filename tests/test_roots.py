@@ -0,0 +1,214 @@
+import json
+import random
+import time
+
+import pytest
+
+from scan.diff import diff_snapshot
+from scan.index import ScanRules
+from scan.native import NATIVE_SCANNER
+from scan.roots import MultiRootIndex, ScanRoot, build_fd_cmd, load_roots
+from scan.snapshot import FileSystemSnapshot
+
+DEFAULT = ScanRoot(
+    rules=ScanRules(base_dir="/", excludes=(".cache",), max_depth=10, max_entries=1000), cmd=(), scan_period=60
+)
+
+
+def _write_roots(tmp_path, roots):
+    file_name = tmp_path / "roots.json"
+    file_name.write_text(roots if isinstance(roots, str) else json.dumps(roots))
+    return str(file_name)
+
+
+def test_load_roots(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    file_name = _write_roots(
+        tmp_path,
+        [
+            {"path": str(tmp_path / "a")},
+            {
+                "path": str(tmp_path / "b"),
+                "search_type": "dirs",
+                "excludes": ["node_modules"],
+                "max_depth": 3,
+                "max_entries": 0,
+                "scan_period": 5,
+                "scan_timeout": 2,
+            },
+        ],
+    )
+    first, second = load_roots(file_name, "fd", DEFAULT)
+    # Missing options are the default ones
+    assert first.rules == ScanRules(base_dir=str(tmp_path / "a"), excludes=(".cache",), max_depth=10, max_entries=1000)
+    assert (first.scan_period, first.scan_timeout) == (60, None)
+    assert first.cmd[3:] == ("--max-depth", "10", "--exclude", ".cache", "--max-results", "1000")
+
+    assert (second.rules.files, second.rules.dirs) == (False, True)
+    assert second.rules.excludes == ("node_modules",)
+    assert second.rules.max_depth == 3
+    # A limit of 0 removes the default one
+    assert second.rules.max_entries is None
+    assert (second.scan_period, second.scan_timeout) == (5, 2)
+    assert second.cmd[3:] == ("--type", "d", "--max-depth", "3", "--exclude", "node_modules")
+
+
+@pytest.mark.parametrize(
+    "roots",
+    [
+        "[{",
+        "{}",
+        [],
+        ["~"],
+        [{"search_type": "files"}],
+        [{"path": "/nonexistent/root"}],
+        [{"path": "{tmp}"}, {"path": "{tmp}"}],
+        [{"path": "{tmp}", "search_type": "links"}],
+        [{"path": "{tmp}", "excludes": "node_modules"}],
+        [{"path": "{tmp}", "max_depth": -1}],
+        [{"path": "{tmp}", "max_children": True}],
+        [{"path": "{tmp}", "scan_period": "often"}],
+    ],
+    ids=[
+        "malformed-json",
+        "not-a-list",
+        "empty",
+        "not-an-object",
+        "no-path",
+        "missing-directory",
+        "duplicated",
+        "search-type",
+        "excludes",
+        "max-depth",
+        "max-children",
+        "scan-period",
+    ],
+)
+def test_load_roots_validation(tmp_path, roots):
+    if not isinstance(roots, str):
+        roots = json.loads(json.dumps(roots).replace("{tmp}", str(tmp_path)))
+    with pytest.raises(ValueError):
+        load_roots(_write_roots(tmp_path, roots), "fd", DEFAULT)
+
+
+def test_load_roots_missing_file(tmp_path):
+    with pytest.raises(ValueError):
+        load_roots(str(tmp_path / "missing.json"), "fd", DEFAULT)
+
+
+def _native_root(base_dir, **kwargs):
+    rules = ScanRules(base_dir=str(base_dir))
+    return ScanRoot(rules=rules, cmd=build_fd_cmd(NATIVE_SCANNER, rules), **{"scan_period": 60, **kwargs})
+
+
+@pytest.fixture
+def two_trees(tmp_path):
+    for name in ["a/sub/x", "b/y"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    return tmp_path
+
+
+def _a_entries(base):
+    return {f"{base}/a/sub/", f"{base}/a/sub/x"}
+
+
+def test_multi_root_merge(two_trees):
+    index = MultiRootIndex()
+    index.set_roots([_native_root(two_trees / "a"), _native_root(two_trees / "b")])
+    merged = index.refresh(background=False)
+    assert set(merged.entries()) == _a_entries(two_trees) | {f"{two_trees}/b/y"}
+    # Fresh roots are served as they are
+    assert index.refresh() is merged
+    assert index.is_dir(f"{two_trees}/a/sub/x") is False
+    assert index.is_dir(f"{two_trees}/a/sub/") is True
+    # Directories aren't marked in the snapshot of the second root
+    assert index.is_dir(f"{two_trees}/b/y") is None
+    assert index.is_dir("/elsewhere/x") is None
+
+
+def test_is_dir_with_followed_links(two_trees):
+    rules = ScanRules(base_dir=str(two_trees / "a"), follow_symlinks=True)
+    index = MultiRootIndex()
+    index.set_roots([ScanRoot(rules=rules, cmd=build_fd_cmd(NATIVE_SCANNER, rules), scan_period=60)])
+    index.refresh(background=False)
+    assert index.is_dir(f"{two_trees}/a/sub/") is True
+    # Unmarked entries may be links to directories (fd doesn't mark them), left to a stat
+    assert index.is_dir(f"{two_trees}/a/sub/x") is None
+
+
+def test_multi_root_skips_failed_roots(two_trees):
+    broken_rules = ScanRules(base_dir=str(two_trees / "b"))
+    broken = ScanRoot(rules=broken_rules, cmd=("/nonexistent/fd", ".", broken_rules.base_dir), scan_period=60)
+    index = MultiRootIndex()
+    index.set_roots([_native_root(two_trees / "a"), broken])
+    assert set(index.refresh(background=False).entries()) == _a_entries(two_trees)
+
+
+def test_multi_root_serves_ready_roots(two_trees):
+    slow_rules = ScanRules(base_dir=str(two_trees / "b"))
+    slow = ScanRoot(rules=slow_rules, cmd=("sh", "-c", "sleep 0.5; printf '/slow\\n'"), scan_period=60)
+    index = MultiRootIndex()
+    index.set_roots([_native_root(two_trees / "a"), slow])
+    # The first scan of the slow root is only waited for until the other root is ready
+    assert set(index.refresh().entries()) == _a_entries(two_trees)
+    time.sleep(1)
+    assert set(index.refresh().entries()) == _a_entries(two_trees) | {"/slow"}
+
+    # Waiting for fresh results, a root past its timeout is left out
+    index.set_roots([_native_root(two_trees / "a"), ScanRoot(slow_rules, slow.cmd + ("x",), 60, scan_timeout=0.1)])
+    assert set(index.refresh(background=False).entries()) == _a_entries(two_trees)
+
+
+def _lines(snapshot):
+    return sorted(snapshot.data.split(b"\n")[:-1])
+
+
+def test_merged_diff():
+    rng = random.Random(7)
+    roots = [{f"/r{root}/{i}".encode() for i in range(40)} for root in range(3)]
+    snapshots = tuple(FileSystemSnapshot(data=b"".join(line + b"\n" for line in lines), timestamp=0) for lines in roots)
+    index = MultiRootIndex()
+    merged = index._merge(snapshots)
+    counter = 100
+    diffed = 0
+    for round_ in range(60):
+        changed = []
+        for root, (lines, snapshot) in enumerate(zip(roots, snapshots)):
+            if rng.random() < 0.3:
+                changed.append(snapshot)
+                continue
+            for line in rng.sample(sorted(lines), 2):
+                lines.discard(line)
+            for _ in range(rng.randint(0, 3)):
+                counter += 1
+                lines.add(f"/r{root}/{counter}".encode())
+            data = b"".join(line + b"\n" for line in rng.sample(sorted(lines), len(lines)))
+            changed.append(snapshot.apply(diff_snapshot(snapshot, data, max_changed_ratio=1.0), round_))
+        snapshots = tuple(changed)
+
+        previous = merged
+        merged = index._merge(snapshots)
+        assert _lines(merged) == sorted(set().union(*roots))
+        if merged is not previous and merged.diff is not None:
+            # Patched, matchers can update their state instead of rebuilding it
+            diffed += 1
+            assert merged.diff.base == previous.generation
+            assert merged.diff.patch(previous.data) == merged.data
+    # Rebuilt only when a root is scattered in too many segments
+    assert diffed > 45
+
+
+def test_merge_rebuilds_replaced_roots():
+    first = FileSystemSnapshot(data=b"/a/x\n", timestamp=0)
+    second = FileSystemSnapshot(data=b"/b/y\n", timestamp=0)
+    index = MultiRootIndex()
+    merged = index._merge((first, second))
+    assert index._merge((first, second)) is merged
+
+    replaced = FileSystemSnapshot(data=b"/b/z\n", timestamp=1)
+    rebuilt = index._merge((first, replaced))
+    assert rebuilt.diff is None and rebuilt.data == b"/a/x\n/b/z\n"
+    # A root left out
+    assert index._merge((first,)).data == b"/a/x\n"
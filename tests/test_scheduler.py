@@ -0,0 +1,46 @@
+import threading
+import time
+
+from matcher.scheduler import QueryScheduler
+
+
+def test_submit_cancels_previous_queries():
+    scheduler = QueryScheduler()
+    cancelled = []
+    first = scheduler.submit(lambda: cancelled.append("first"))
+    assert scheduler.is_latest(first)
+    second = scheduler.submit(lambda: cancelled.append("second"))
+    assert cancelled == ["first", "second"]
+    assert not scheduler.is_latest(first) and scheduler.is_latest(second)
+    # No debounce, the answer is immediate
+    assert not scheduler.wait(first, 0)
+    assert scheduler.wait(second, 0)
+
+
+def test_debounce():
+    scheduler = QueryScheduler()
+    ticket = scheduler.submit(lambda: None)
+    start = time.monotonic()
+    assert scheduler.wait(ticket, 0.05)
+    assert time.monotonic() - start >= 0.05
+
+
+def test_newer_query_ends_the_debounce():
+    scheduler = QueryScheduler()
+    ticket = scheduler.submit(lambda: None)
+    result = {}
+    waiting = threading.Event()
+
+    def wait():
+        waiting.set()
+        result["latest"] = scheduler.wait(ticket, 10)
+
+    thread = threading.Thread(target=wait)
+    start = time.monotonic()
+    thread.start()
+    waiting.wait()
+    scheduler.submit(lambda: None)
+    thread.join(5)
+    # Woken up by the newer query instead of waiting for the whole debounce window
+    assert result == {"latest": False}
+    assert time.monotonic() - start < 5
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from os import path
+
+import pytest
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+# Backends imported on first use, they would slow down the start of the extension
+LAZY_MODULES = ["matcher.content", "matcher.sharded", "scan.native"]
+
+
+def test_main_imports_backends_lazily():
+    pytest.importorskip("ulauncher")
+    # In a fresh interpreter, the tests may have imported them already
+    process = subprocess.run(
+        [sys.executable, "-c", "import sys, main; print('\\n'.join(sys.modules))"],
+        cwd=ROOT, stdout=subprocess.PIPE, encoding="utf-8", check=True,
+    )
+    modules = set(process.stdout.splitlines())
+    assert "main" in modules
+    assert modules.isdisjoint(LAZY_MODULES)
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from usage import store
+from usage.store import HALF_LIFE, UsageStore
+
+
+@pytest.fixture
+def usage(tmp_path):
+    return UsageStore(str(tmp_path / "usage.log"))
+
+
+def _log_lines(usage):
+    with open(usage.file_name) as file:
+        return file.read().splitlines()
+
+
+def test_frecency_is_reloaded(usage):
+    now = time.time()
+    usage.record("/a", now)
+    usage.record("/a", now - HALF_LIFE)
+    with open(usage.file_name, "a") as file:
+        # Truncated by a crash
+        file.write("12.5")
+    assert usage.frecency("/a") == pytest.approx(1.5, rel=1e-3)
+    assert UsageStore(usage.file_name).frecency("/a") == pytest.approx(1.5, rel=1e-3)
+    assert usage.frecency("/b") == 0.0
+
+
+def test_compaction(usage, monkeypatch):
+    monkeypatch.setattr(store, "COMPACT_SLACK", 4)
+    monkeypatch.setattr(store, "MAX_ENTRIES", 3)
+    now = time.time()
+    # Worth less than MIN_FRECENCY visits
+    usage.record("/old", now - 10 * HALF_LIFE)
+    for _ in range(8):
+        usage.record("/a", now)
+    # Compacted to one line per path once the log holds more than 2 lines per path (plus the slack)
+    assert _log_lines(usage) == [f"{usage._weights['/a']!r}\t/a"]
+    assert usage.frecency("/a") == pytest.approx(8, rel=1e-3)
+
+    with open(usage.file_name, "a") as file:
+        file.writelines(f"{(now - i * HALF_LIFE) / HALF_LIFE!r}\t/p{i}\n" for i in range(8))
+    # Compacted when loaded, only the MAX_ENTRIES most frecent paths are kept
+    reloaded = UsageStore(usage.file_name)
+    assert reloaded.frecency("/a") == pytest.approx(8, rel=1e-3)
+    assert reloaded.frecency("/p7") == 0.0
+    assert [line.split("\t")[1] for line in _log_lines(usage)] == ["/a", "/p0", "/p1"]
+
+
+def test_rerank(usage):
+    results = ["/a", "/b", "/c", "/d"]
+    assert usage.rerank(results, 2) == ["/a", "/b"]
+
+    now = time.time()
+    usage.record("/d", now)
+    # One visit moves a result up by one page (of 'limit' results), ties keep the matcher order
+    assert usage.rerank(results, 2) == ["/a", "/b"]
+    assert usage.rerank(results, 3) == ["/a", "/d", "/b"]
+    usage.record("/d", now)
+    usage.record("/d", now)
+    assert usage.rerank(results, 2) == ["/d", "/a"]
+    # Old visits are worth less
+    usage.record("/c", now - 4 * HALF_LIFE)
+    assert usage.rerank(results, 4) == ["/d", "/a", "/b", "/c"]
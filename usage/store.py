@@ -0,0 +1,166 @@
+import logging
+import math
+import os
+import threading
+import time
+from os import path
+from typing import Dict, List, Optional
+
+from matcher.native import parse_query, score_line
+from scan.snapshot import ENCODING, ENCODING_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a visit counts half
+HALF_LIFE = 7 * 24 * 3600
+# Pages of results (of 'limit' entries) a result moves up per doubling of its frecency
+FRECENCY_WEIGHT = 1.0
+# The matchers are asked for this many times the results to rerank
+RERANK_POOL_FACTOR = 4
+# Compaction keeps at most this many paths, dropping the ones worth less than MIN_FRECENCY visits
+MAX_ENTRIES = 2000
+MIN_FRECENCY = 0.01
+COMPACT_SLACK = 256
+
+
+def default_data_dir() -> str:
+    data_home = os.environ.get("XDG_DATA_HOME") or path.expanduser("~/.local/share")
+    return path.join(data_home, "ulauncher-fzf")
+
+
+def _log_add(a: float, b: float) -> float:
+    """ log2(2**a + 2**b) without overflowing """
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+class UsageStore:
+    """
+    Frecency of the paths opened from the results: every visit is worth one, halved every HALF_LIFE
+    seconds. Visits are appended to a log as 'log2 weight<TAB>path' lines, the log is compacted to
+    one line per path once it grows. Weights are kept in memory, ranking never touches the disk.
+    """
+
+    def __init__(self, file_name: Optional[str] = None):
+        self.file_name = file_name or path.join(default_data_dir(), "usage.log")
+        self._lock = threading.Lock()
+        self._weights: Optional[Dict[str, float]] = None
+        self._lines = 0
+
+    def _load(self) -> Dict[str, float]:
+        """ Called with the lock held, the log is read on first use """
+        if self._weights is not None:
+            return self._weights
+
+        weights: Dict[str, float] = {}
+        lines = 0
+        try:
+            with open(self.file_name, encoding=ENCODING, errors=ENCODING_ERRORS) as file:
+                for line in file:
+                    weight, sep, path_name = line.rstrip("\n").partition("\t")
+                    try:
+                        weight = float(weight)
+                    except ValueError:
+                        continue
+                    if not sep or not path_name:
+                        # e.g. a line truncated by a crash
+                        continue
+                    previous = weights.get(path_name)
+                    weights[path_name] = weight if previous is None else _log_add(previous, weight)
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            logger.warning("Unable to read usage log '%s': %s", self.file_name, error)
+
+        self._weights, self._lines = weights, lines
+        if self._needs_compaction():
+            self._compact()
+        return self._weights
+
+    def _entries(self) -> Dict[str, float]:
+        # Compaction replaces the dict instead of mutating it, readers can keep using their reference
+        with self._lock:
+            return self._load()
+
+    def _needs_compaction(self) -> bool:
+        entries = len(self._weights)
+        return self._lines > 2 * entries + COMPACT_SLACK or entries > MAX_ENTRIES + COMPACT_SLACK
+
+    def _compact(self) -> None:
+        """ Called with the lock held, rewrite the log with one line per path worth keeping """
+        min_weight = time.time() / HALF_LIFE + math.log2(MIN_FRECENCY)
+        kept = sorted(((w, p) for p, w in self._weights.items() if w >= min_weight), reverse=True)[:MAX_ENTRIES]
+        self._weights = {p: w for w, p in kept}
+
+        tmp_name = f"{self.file_name}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(path.dirname(self.file_name), exist_ok=True)
+            with open(tmp_name, "w", encoding=ENCODING, errors=ENCODING_ERRORS) as file:
+                file.writelines(f"{w!r}\t{p}\n" for w, p in kept)
+            os.replace(tmp_name, self.file_name)
+        except OSError as error:
+            logger.warning("Unable to compact usage log '%s': %s", self.file_name, error)
+            try:
+                os.remove(tmp_name)
+            except OSError:
+                pass
+            return
+        self._lines = len(kept)
+        logger.debug("Usage log compacted to %d paths", len(kept))
+
+    def record(self, path_name: str, timestamp: Optional[float] = None) -> None:
+        if "\n" in path_name:
+            return
+        weight = (timestamp if timestamp is not None else time.time()) / HALF_LIFE
+        with self._lock:
+            weights = self._load()
+            previous = weights.get(path_name)
+            weights[path_name] = weight if previous is None else _log_add(previous, weight)
+            try:
+                os.makedirs(path.dirname(self.file_name), exist_ok=True)
+                with open(self.file_name, "a", encoding=ENCODING, errors=ENCODING_ERRORS) as file:
+                    file.write(f"{weight!r}\t{path_name}\n")
+                self._lines += 1
+            except OSError as error:
+                logger.warning("Unable to write usage log '%s': %s", self.file_name, error)
+            if self._needs_compaction():
+                self._compact()
+
+    def frecency(self, path_name: str) -> float:
+        """ Visits to 'path_name', each one weighted by how recent it is """
+        weight = self._entries().get(path_name)
+        return 0.0 if weight is None else 2 ** (weight - time.time() / HALF_LIFE)
+
+    def rerank(self, results: List[str], limit: int) -> List[str]:
+        """ Move each result up by FRECENCY_WEIGHT pages of 'limit' results per doubling of its frecency """
+        weights = self._entries()
+        if not weights:
+            return results[:limit]
+        now_weight = time.time() / HALF_LIFE
+        boost = FRECENCY_WEIGHT * limit
+
+        def blended_rank(item) -> float:
+            rank, path_name = item
+            weight = weights.get(path_name)
+            if weight is None:
+                return rank
+            return rank - boost * math.log2(1 + 2 ** (weight - now_weight))
+
+        # Stable: results with the same blended rank keep the matcher order
+        return [path_name for _, path_name in sorted(enumerate(results), key=blended_rank)[:limit]]
+
+    def match(self, query: str, limit: int) -> List[str]:
+        """ Frecent paths still existing and matching 'query', most frecent first, without a snapshot """
+        term_sets = parse_query(query)
+        if not term_sets:
+            return []
+        weights = self._entries()
+        hits = sorted(((w, p) for p, w in list(weights.items()) if score_line(term_sets, p) is not None), reverse=True)
+        results = []
+        for _, path_name in hits:
+            if path.lexists(path_name):
+                results.append(path_name)
+                if len(results) == limit:
+                    break
+        return results